@@ -0,0 +1,121 @@
+from fastapi import APIRouter, UploadFile, File, HTTPException, Query
+from typing import List, Optional
+import logging
+
+from core.config import settings
+from core.metrics import stage
+from api.responses import FastJSONResponse, export_response
+from services.job_queue import job_manager, Job, JobQueueFullError
+from services.ocr import ENGINE_AUTO
+from services.receipt_pipeline import summarize_result, table_fields, engines_used
+from services.exporter import resolve_export_columns, iterate_results, EXPORT_MEDIA_TYPES
+from utils.helpers import read_upload
+
+router = APIRouter()
+logger = logging.getLogger(__name__)
+
+@router.post("/ocr/jobs", status_code=202)
+async def submit_job(
+    files: List[UploadFile] = File(..., description="上传的多张小票/支付截图"),
+    engine: str = Query(ENGINE_AUTO, description="OCR引擎选择（auto 按成本和预计耗时自动选择）"),
+    columns: Optional[List[str]] = Query(None, description="需要提取的列名（原始文本行 raw_lines 只在此请求时保留）")
+):
+    """提交后台识别任务，立即返回任务ID，之后通过 GET /ocr/jobs/{job_id} 查询进度"""
+    logger.info(f"收到请求: 方法=POST, 路径=/ocr/jobs, files={len(files)}, engine={engine}")
+    if len(files) > settings.batch_max_files:
+        raise HTTPException(status_code=400, detail=f"单次最多上传 {settings.batch_max_files} 张图片")
+
+    uploads = []
+    rejected = {}
+    for index, file in enumerate(files):
+        try:
+            with stage("upload_read"):
+                uploads.append(await read_upload(file, settings.max_upload_bytes, settings.upload_chunk_size))
+        except Exception as e:
+            rejected[index] = {"file": file.filename, "status": "error", "error": str(e), "parsed": None}
+
+    try:
+        job = job_manager.submit(uploads, engine, rejected, fields=table_fields(columns))
+    except JobQueueFullError as e:
+        raise HTTPException(status_code=429, detail=str(e))
+
+    return FastJSONResponse(_job_status(job), status_code=202)
+
+@router.get("/ocr/jobs/{job_id}")
+async def get_job(
+    job_id: str,
+    columns: Optional[List[str]] = Query(None, description="需要返回的列名"),
+    include_results: bool = Query(True, description="是否返回已完成图片的结果")
+):
+    """查询任务进度，并返回已完成图片的结果（部分结果）"""
+    job = await _get_job_or_404(job_id)
+    status = _job_status(job)
+    if include_results:
+        status["results"] = [summarize_result(result, columns, index) for index, result in job.completed_results()]
+    return FastJSONResponse(status)
+
+@router.get("/ocr/jobs/{job_id}/result")
+async def get_job_result(
+    job_id: str,
+    columns: Optional[List[str]] = Query(None, description="需要返回的列名")
+):
+    """获取已完成任务的合并结果，格式与 /ocr/receipts/batch 相同"""
+    job = await _get_job_or_404(job_id)
+    if not job.finished:
+        raise HTTPException(status_code=409, detail=f"任务尚未完成（{job.completed}/{job.total}）")
+
+    # 合并结果在任务结束时计算一次；其它进程取消的任务在所属进程处理取消标记之前还没有合并结果
+    merged = job.merged
+    if merged is None:
+        raise HTTPException(status_code=409, detail="任务正在结束，请稍后再试")
+    return FastJSONResponse({
+        "success": merged["summary"]["succeeded"] > 0,
+        "job_id": job.id,
+        "status": job.status,
+        "engine_used": engines_used(job.results, job.engine),
+        "data": merged["rows"],
+        "summary": merged["summary"],
+        "results": [summarize_result(result, columns) for _, result in job.completed_results()]
+    })
+
+@router.get("/ocr/jobs/{job_id}/export")
+async def export_job(
+    job_id: str,
+    columns: Optional[List[str]] = Query(None, description="需要导出的列名"),
+    format: str = Query("csv", description="导出格式：csv 或 xlsx")
+):
+    """将已完成任务的支付表格导出为 CSV/XLSX（流式写出）"""
+    if format not in EXPORT_MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail=f"不支持的导出格式: {format}")
+    job = await _get_job_or_404(job_id)
+    if not job.finished:
+        raise HTTPException(status_code=409, detail=f"任务尚未完成（{job.completed}/{job.total}）")
+    return export_response(iterate_results(job.completed_results()), format, resolve_export_columns(columns))
+
+@router.delete("/ocr/jobs/{job_id}")
+async def cancel_job(job_id: str):
+    """取消任务，尚未识别的图片不再处理，已完成的结果仍可获取"""
+    await _get_job_or_404(job_id)
+    return _job_status(await job_manager.cancel(job_id))
+
+@router.get("/ocr/jobs")
+async def get_job_stats():
+    """任务队列概况"""
+    return job_manager.stats()
+
+async def _get_job_or_404(job_id: str) -> Job:
+    job = await job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="任务不存在或已过期")
+    return job
+
+def _job_status(job: Job) -> dict:
+    return {
+        "job_id": job.id,
+        "status": job.status,
+        "engine": job.engine,
+        "created_at": job.created_at,
+        "started_at": job.started_at,
+        "finished_at": job.finished_at,
+        "progress": job.progress()
+    }
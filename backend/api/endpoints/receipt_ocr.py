@@ -1,55 +1,220 @@
 from fastapi import APIRouter, UploadFile, File, HTTPException, Query
-from fastapi.responses import JSONResponse
-from typing import List, Optional, Dict, Any
+from fastapi.responses import StreamingResponse
+from typing import AsyncIterator, FrozenSet, List, Optional, Dict, Any, Tuple
+import asyncio
 import io
 from PIL import Image
 import logging
 
-from services.ocr import ocr_manager
-from services.receipt_parser import ReceiptParser
+from core.config import settings
+from core.metrics import stage
+from api.responses import FastJSONResponse, dumps_json, export_response
+from services.ocr import ocr_manager, ENGINE_AUTO, PRIORITY_INTERACTIVE, PRIORITY_BATCH
+from services.receipt_parser import resolve_fields, RECEIPT_FIELDS
+from services.receipt_pipeline import (receipt_parser, process_image, summarize_result, filter_columns,
+                                       table_fields, new_deduplicator, engines_used, TABLE_FIELDS)
+from services.dedup import ImageDeduplicator
+from services.refinement import refine_ocr_results
+from services.data_processor import merge_receipt_results, new_transaction_index, check_duplicate_transaction
+from services.exporter import resolve_export_columns, EXPORT_MEDIA_TYPES
+from utils.helpers import read_upload, UploadRejected
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
-receipt_parser = ReceiptParser()
 
 @router.post("/ocr/receipt")
 async def process_receipt(
     file: UploadFile = File(..., description="上传的购物小票图片"),
-    engine: str = Query("baiduocr", description="OCR引擎选择"),
+    engine: str = Query(ENGINE_AUTO, description="OCR引擎选择（auto 按成本和预计耗时自动选择）"),
     columns: Optional[List[str]] = Query(None, description="需要返回的列名")
 ):
     """处理购物小票识别请求"""
     logger.info(f"收到请求: 方法=POST, 路径=/ocr/receipt, engine={engine}, columns={columns}")
     try:
-        # 验证文件类型
-        if not file.content_type.startswith('image/'):
-            raise HTTPException(status_code=400, detail="请上传图片文件")
-        
-        # 读取图片数据
-        image_data = await file.read()
+        # 分块读取图片数据（校验大小和文件头，同时计算哈希）
+        with stage("upload_read"):
+            upload = await read_upload(file, settings.max_upload_bytes, settings.upload_chunk_size)
         
         # 使用指定OCR引擎识别文字
-        ocr_results = ocr_manager.recognize_text(image_data, engine_name=engine)
-        
-        # 解析小票内容
-        parsed_data = receipt_parser.parse_receipt_text(ocr_results)
+        trace = {}
+        ocr_results = await ocr_manager.recognize_text_async(upload.data, engine_name=engine, trace=trace,
+                                                             image_digest=upload.sha256)
+        if settings.refine_enabled and ocr_results:
+            # 置信度低或格式异常的文字框裁剪后再识别一次
+            with stage("refine"):
+                ocr_results = await refine_ocr_results(upload.data, ocr_results, trace.get("engine_used", engine), trace)
+        del upload
         
-        # 根据用户选择的列过滤数据
-        filtered_data = _filter_columns(parsed_data, columns)
+        # 解析小票内容，只提取用户选择的列（商品明细和置信度始终返回）
+        with stage("parse"):
+            parsed = receipt_parser.parse(ocr_results, resolve_fields(columns) | {"items", "confidence"})
         
-        return JSONResponse({
+        return FastJSONResponse({
             "success": True,
-            "engine_used": engine,
-            "data": parsed_data.get("items", []),  # 始终返回 items 数组
-            "available_columns": list(parsed_data.keys()),
-            "confidence": parsed_data.get("confidence", 0),
-            "full_data": filtered_data  # 可选：额外字段返回完整对象
+            "engine_used": trace.get("engine_used", engine),
+            "data": parsed.items.to_records(),  # 始终返回 items 数组
+            "available_columns": list(RECEIPT_FIELDS),
+            "confidence": parsed.confidence,
+            "full_data": filter_columns(parsed.to_dict(), columns),  # 其它请求的字段（不含已在 data 中的商品明细）
+            "image_stats": trace.get("preprocess"),
+            "refined_lines": trace["refine"]["replaced"] if trace.get("refine") else 0
         })
         
+    except UploadRejected as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
     except Exception as e:
         logger.error(f"处理小票识别失败: {str(e)}")
         raise HTTPException(status_code=500, detail=f"处理失败: {str(e)}")
 
+@router.post("/ocr/receipts/batch")
+async def process_receipts_batch(
+    files: List[UploadFile] = File(..., description="上传的多张小票/支付截图"),
+    engine: str = Query(ENGINE_AUTO, description="OCR引擎选择（auto 按成本和预计耗时自动选择）"),
+    columns: Optional[List[str]] = Query(None, description="需要返回的列名")
+):
+    """批量处理小票识别请求，并发调用OCR并合并为一张支付表格"""
+    logger.info(f"收到请求: 方法=POST, 路径=/ocr/receipts/batch, files={len(files)}, engine={engine}, columns={columns}")
+    if len(files) > settings.batch_max_files:
+        raise HTTPException(status_code=400, detail=f"单次最多上传 {settings.batch_max_files} 张图片")
+
+    semaphore = asyncio.Semaphore(max(1, settings.batch_concurrency))
+    fields = table_fields(columns)
+    dedup = new_deduplicator()
+    results = await asyncio.gather(*(_recognize_one(file, index, engine, semaphore, fields, dedup)
+                                     for index, file in enumerate(files)))
+    merged = merge_receipt_results(results)
+
+    return FastJSONResponse({
+        "success": merged["summary"]["succeeded"] > 0,
+        "engine_used": engines_used(results, engine),
+        "data": merged["rows"],
+        "summary": merged["summary"],
+        "results": [summarize_result(r, columns) for r in results]
+    })
+
+async def _recognize_one(file: UploadFile, index: int, engine: str, semaphore: asyncio.Semaphore,
+                         fields: FrozenSet[str], dedup: Optional[ImageDeduplicator]) -> Dict[str, Any]:
+    """识别并解析单张图片，失败时返回错误状态而不是抛出异常"""
+    # 在并发限制内读取，同一时刻内存中最多只有 batch_concurrency 张图片
+    async with semaphore:
+        try:
+            with stage("upload_read"):
+                upload = await read_upload(file, settings.max_upload_bytes, settings.upload_chunk_size)
+        except Exception as e:
+            logger.error(f"批量识别 {file.filename} 读取失败: {str(e)}")
+            return {"file": file.filename, "status": "error", "error": str(e), "parsed": None}
+        finally:
+            # 读取后立即释放上传的临时文件，识别期间只保留读取的图片数据
+            await file.close()
+        return await process_image(upload, engine, priority=PRIORITY_BATCH, fields=fields, dedup=dedup, index=index)
+
+# 流式返回格式：text/event-stream 或 换行分隔的JSON
+STREAM_MEDIA_TYPES = {"sse": "text/event-stream", "ndjson": "application/x-ndjson"}
+
+@router.post("/ocr/receipts/stream")
+async def process_receipts_stream(
+    files: List[UploadFile] = File(..., description="上传的多张小票/支付截图"),
+    engine: str = Query(ENGINE_AUTO, description="OCR引擎选择（auto 按成本和预计耗时自动选择）"),
+    columns: Optional[List[str]] = Query(None, description="需要返回的列名"),
+    format: str = Query("sse", description="流格式：sse 或 ndjson")
+):
+    """批量识别并流式返回：每张图片识别完成后立即推送一个 result 事件，全部完成后推送 summary 事件"""
+    logger.info(f"收到请求: 方法=POST, 路径=/ocr/receipts/stream, files={len(files)}, engine={engine}, format={format}")
+    if len(files) > settings.batch_max_files:
+        raise HTTPException(status_code=400, detail=f"单次最多上传 {settings.batch_max_files} 张图片")
+    if format not in STREAM_MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail=f"不支持的流格式: {format}")
+
+    # 图片在各自的识别任务中读取，读取失败的图片作为错误事件推送
+    return StreamingResponse(
+        _stream_results(_detach_uploads(files), engine, columns, format),
+        media_type=STREAM_MEDIA_TYPES[format],
+        # 禁止代理缓冲，保证事件即时送达
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+async def _stream_results(files: List[UploadFile], engine: str, columns: Optional[List[str]],
+                          fmt: str) -> AsyncIterator[bytes]:
+    """按完成顺序生成事件；客户端断开时取消尚未完成的识别"""
+    tasks = _start_recognition(files, engine, table_fields(columns))
+    results: List[Optional[Dict[str, Any]]] = [None] * len(files)
+    # 按完成顺序比对交易，重复的结果在推送前标记，行不会先推送再被合并剔除
+    transactions = new_transaction_index()
+    try:
+        for future in asyncio.as_completed(tasks):
+            index, result = await future
+            check_duplicate_transaction(transactions, index, result)
+            results[index] = result
+            yield _format_event(fmt, "result", summarize_result(result, columns, index))
+
+        merged = merge_receipt_results(results)
+        yield _format_event(fmt, "summary", {
+            "success": merged["summary"]["succeeded"] > 0,
+            "engine_used": engines_used(results, engine),
+            "summary": merged["summary"]
+        })
+    finally:
+        _cancel_recognition(tasks, files)
+
+def _format_event(fmt: str, event: str, payload: Dict[str, Any]) -> bytes:
+    """单个事件的编码：SSE 为 event/data 两行，NDJSON 为带 event 字段的一行JSON"""
+    if fmt == "sse":
+        return b"event: " + event.encode("ascii") + b"\ndata: " + dumps_json(payload) + b"\n\n"
+    return dumps_json({"event": event, **payload}) + b"\n"
+
+@router.post("/ocr/receipts/export")
+async def export_receipts(
+    files: List[UploadFile] = File(..., description="上传的一张或多张小票/支付截图"),
+    engine: str = Query(ENGINE_AUTO, description="OCR引擎选择（auto 按成本和预计耗时自动选择）"),
+    columns: Optional[List[str]] = Query(None, description="需要导出的列名"),
+    format: str = Query("csv", description="导出格式：csv 或 xlsx")
+):
+    """识别后将合并的支付表格导出为 CSV/XLSX；按上传顺序逐张写出，前面的图片识别完即开始下载"""
+    logger.info(f"收到请求: 方法=POST, 路径=/ocr/receipts/export, files={len(files)}, engine={engine}, format={format}")
+    if len(files) > settings.batch_max_files:
+        raise HTTPException(status_code=400, detail=f"单次最多上传 {settings.batch_max_files} 张图片")
+    if format not in EXPORT_MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail=f"不支持的导出格式: {format}")
+
+    return export_response(_ordered_results(_detach_uploads(files), engine),
+                           format, resolve_export_columns(columns))
+
+def _detach_uploads(files: List[UploadFile]) -> List[UploadFile]:
+    """接管上传文件：框架在返回响应后、开始发送流之前就会关闭表单中的文件，
+    这里把底层文件转给新的 UploadFile，由识别任务读取后关闭，图片不必在响应开始前全部读入内存"""
+    detached = []
+    for file in files:
+        detached.append(UploadFile(file.file, size=file.size, filename=file.filename, headers=file.headers))
+        file.file = io.BytesIO()
+    return detached
+
+def _start_recognition(files: List[UploadFile], engine: str,
+                       fields: FrozenSet[str] = TABLE_FIELDS) -> List[asyncio.Task]:
+    """为每张图片启动识别任务：在并发限制内读取并识别（同批重复的图片不调用OCR），任务结果为 (序号, 识别结果)"""
+    semaphore = asyncio.Semaphore(max(1, settings.batch_concurrency))
+    dedup = new_deduplicator()
+
+    async def run(index: int, file: UploadFile) -> Tuple[int, Dict[str, Any]]:
+        return index, await _recognize_one(file, index, engine, semaphore, fields, dedup)
+
+    return [asyncio.create_task(run(index, file)) for index, file in enumerate(files)]
+
+def _cancel_recognition(tasks: List[asyncio.Task], files: List[UploadFile]):
+    """取消尚未完成的识别，并关闭还没来得及读取的上传文件"""
+    for task in tasks:
+        task.cancel()
+    for file in files:
+        file.file.close()
+
+async def _ordered_results(files: List[UploadFile], engine: str) -> AsyncIterator[Tuple[int, Dict[str, Any]]]:
+    """所有图片并发识别，按上传顺序逐个产出结果；客户端断开时取消尚未完成的识别"""
+    tasks = _start_recognition(files, engine)
+    try:
+        for task in tasks:
+            yield await task
+    finally:
+        _cancel_recognition(tasks, files)
+
 @router.get("/ocr/engines")
 async def get_available_engines():
     """获取可用的OCR引擎列表"""
@@ -62,22 +227,17 @@ async def get_available_engines():
     return {
         "available_engines": engines,
         "engines_info": engines_info,
-        "default_engine": ocr_manager.default_engine
+        "default_engine": ocr_manager.default_engine,
+        "engine_states": ocr_manager.get_engine_states(),
+        # engine=auto 时交互请求和批量任务当前的引擎选择顺序
+        "auto_order": {
+            "interactive": ocr_manager.auto_candidates(PRIORITY_INTERACTIVE),
+            "batch": ocr_manager.auto_candidates(PRIORITY_BATCH)
+        }
     }
 
-def _filter_columns(data: Dict[str, Any], columns: Optional[List[str]]) -> Dict[str, Any]:
-    """根据用户选择的列过滤数据"""
-    if not columns:
-        return data
-    
-    filtered = {}
-    for col in columns:
-        if col in data:
-            filtered[col] = data[col]
-        else:
-            # 如果列不存在，尝试在嵌套结构中查找
-            for key, value in data.items():
-                if isinstance(value, dict) and col in value:
-                    filtered[col] = value[col]
-    
-    return filtered
\ No newline at end of file
+@router.get("/ocr/cache")
+async def get_cache_stats():
+    """获取OCR结果缓存的命中/未命中统计"""
+    # 多进程运行时磁盘缓存大小保存在共享存储中，读取可能阻塞，放到线程中执行
+    return await asyncio.to_thread(ocr_manager.get_cache_stats)
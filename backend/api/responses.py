@@ -0,0 +1,38 @@
+# 接口响应编码：安装了 orjson 时使用它（比标准库 json 快数倍），否则回退到标准库
+from typing import Any, AsyncIterator, Dict, List, Tuple
+import json
+import time
+
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from services.exporter import stream_export, EXPORT_MEDIA_TYPES
+
+try:
+    import orjson
+except ImportError:  # orjson 为可选依赖
+    orjson = None
+
+
+def dumps_json(content: Any) -> bytes:
+    """序列化为UTF-8编码的紧凑JSON"""
+    if orjson is not None:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(content, ensure_ascii=False, separators=(",", ":"), default=str).encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    """使用 dumps_json 编码的 JSONResponse"""
+
+    def render(self, content: Any) -> bytes:
+        return dumps_json(content)
+
+
+def export_response(results: AsyncIterator[Tuple[int, Dict[str, Any]]], fmt: str,
+                    columns: List[str]) -> StreamingResponse:
+    """以附件形式流式返回导出的支付表格"""
+    filename = f"receipts-{time.strftime('%Y%m%d-%H%M%S')}.{fmt}"
+    return StreamingResponse(
+        stream_export(results, fmt, columns),
+        media_type=EXPORT_MEDIA_TYPES[fmt],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"', "X-Accel-Buffering": "no"}
+    )
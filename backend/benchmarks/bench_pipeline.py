@@ -0,0 +1,169 @@
+# OCR -> 表格 全链路基准测试
+# 使用本地模拟百度服务，测量 /api/v1/ocr/receipt 在不同并发下的吞吐与 p50/p95/p99 延迟，
+# 并对 ReceiptParser.parse_receipt_text 与 filter_columns 做微基准，结果输出为JSON。
+# 用法（在 backend 目录下）:
+#   python -m benchmarks.bench_pipeline --concurrency 1,8,32 --requests 200 --output bench.json
+#   python -m benchmarks.bench_pipeline --baseline bench.json   # 与基线对比，退化超出容忍度时退出码为1
+from typing import List, Dict, Any
+import argparse
+import asyncio
+import json
+import platform
+import sys
+import time
+
+from benchmarks.common import AppServer, configure_env, make_image, summarize
+from benchmarks.corpus import make_corpus
+from benchmarks.fake_baidu import FakeBaiduServer
+
+
+async def drive_endpoint(url: str, images: List[bytes], concurrency: int, total_requests: int) -> Dict[str, Any]:
+    """以固定并发数向识别接口发送 total_requests 个请求"""
+    import httpx
+
+    latencies = []
+    errors = 0
+    counter = iter(range(total_requests))
+
+    async def worker(client):
+        nonlocal errors
+        for i in counter:
+            files = {"file": (f"receipt_{i}.jpg", images[i % len(images)], "image/jpeg")}
+            start = time.perf_counter()
+            try:
+                response = await client.post(f"{url}/api/v1/ocr/receipt", files=files)
+                if response.status_code != 200:
+                    errors += 1
+            except httpx.HTTPError:
+                errors += 1
+            latencies.append(time.perf_counter() - start)
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(timeout=120, limits=limits) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+
+    return {
+        "concurrency": concurrency,
+        "requests": total_requests,
+        "errors": errors,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(total_requests / elapsed, 2),
+        **summarize(latencies)
+    }
+
+
+def bench_parser(repeat: int) -> List[Dict[str, Any]]:
+    """解析与列过滤微基准（每次调用的平均耗时，微秒）"""
+    from services.receipt_pipeline import filter_columns
+    from services.receipt_parser import ReceiptParser, resolve_fields
+
+    parser = ReceiptParser()
+    columns = ["store_name", "total_amount", "items"]
+    fields = resolve_fields(columns)
+    cases = []
+    for size in (5, 20, 80, 300):
+        receipts = make_corpus(sizes=(size,), per_size=10)
+        start = time.perf_counter()
+        for _ in range(repeat):
+            parsed = [parser.parse_receipt_text(r) for r in receipts]
+        parse_us = (time.perf_counter() - start) / (repeat * len(receipts)) * 1e6
+        start = time.perf_counter()
+        for _ in range(repeat):
+            for p in parsed:
+                filter_columns(p, columns)
+        filter_us = (time.perf_counter() - start) / (repeat * len(receipts)) * 1e6
+        # 列投影下推：只提取请求的列
+        start = time.perf_counter()
+        for _ in range(repeat):
+            for r in receipts:
+                parser.parse_receipt_text(r, fields)
+        projected_us = (time.perf_counter() - start) / (repeat * len(receipts)) * 1e6
+        cases.append({"items": size, "parse_us": round(parse_us, 2), "filter_columns_us": round(filter_us, 2),
+                      "projected_parse_us": round(projected_us, 2)})
+    return cases
+
+
+def compare(report: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """与基线对比，返回超出容忍度的退化项"""
+    regressions = []
+    base_runs = {r["concurrency"]: r for r in baseline.get("endpoint", [])}
+    for run in report["endpoint"]:
+        base = base_runs.get(run["concurrency"])
+        if not base:
+            continue
+        if run["p95_ms"] > base["p95_ms"] * (1 + tolerance):
+            regressions.append(f"c={run['concurrency']} p95 {base['p95_ms']}ms -> {run['p95_ms']}ms")
+        if run["throughput_rps"] < base["throughput_rps"] * (1 - tolerance):
+            regressions.append(f"c={run['concurrency']} 吞吐 {base['throughput_rps']} -> {run['throughput_rps']} rps")
+    base_parser = {c["items"]: c for c in baseline.get("parser", [])}
+    for case in report["parser"]:
+        base = base_parser.get(case["items"])
+        if base and case["parse_us"] > base["parse_us"] * (1 + tolerance):
+            regressions.append(f"items={case['items']} 解析 {base['parse_us']}us -> {case['parse_us']}us")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="OCR全链路基准测试")
+    parser.add_argument("--concurrency", default="1,4,16,32", help="逗号分隔的并发数列表")
+    parser.add_argument("--requests", type=int, default=100, help="每个并发级别的请求数")
+    parser.add_argument("--latency", type=float, default=0.2, help="模拟百度接口平均延迟（秒）")
+    parser.add_argument("--jitter", type=float, default=0.05)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--qps", default="0", help="应用的 BAIDU_OCR_QPS（默认不限流；设为线上值可单独测量限流排队）")
+    parser.add_argument("--image-size", default="1080x2400", help="测试图片尺寸 WxH")
+    parser.add_argument("--parser-repeat", type=int, default=20)
+    parser.add_argument("--output", help="结果写入的JSON文件（默认输出到标准输出）")
+    parser.add_argument("--baseline", help="用于对比的历史结果JSON")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="允许的退化比例")
+    args = parser.parse_args()
+
+    fake = FakeBaiduServer(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate).start()
+    # 关闭结果缓存，保证每个请求都走完整链路
+    configure_env(fake.url, OCR_CACHE_ENABLED="0", BAIDU_OCR_QPS=args.qps)
+    from main import app
+
+    width, height = (int(v) for v in args.image_size.lower().split("x"))
+    images = [make_image(width, height, seed=i) for i in range(8)]
+
+    server = AppServer(app).start()
+    try:
+        endpoint_runs = []
+        for concurrency in (int(c) for c in args.concurrency.split(",")):
+            run = asyncio.run(drive_endpoint(server.url, images, concurrency, args.requests))
+            endpoint_runs.append(run)
+            print(f"c={concurrency}: {run['throughput_rps']} rps, p95={run['p95_ms']}ms", file=sys.stderr)
+    finally:
+        server.stop()
+        fake.stop()
+
+    report = {
+        "benchmark": "ocr_pipeline",
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "config": {k: v for k, v in vars(args).items() if k not in ("output", "baseline")},
+        "image_bytes": sum(len(i) for i in images) // len(images),
+        "fake_server": fake.stats(),
+        "endpoint": endpoint_runs,
+        "parser": bench_parser(args.parser_repeat),
+    }
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+    else:
+        print(output)
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        for line in regressions:
+            print(f"性能退化: {line}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
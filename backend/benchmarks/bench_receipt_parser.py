@@ -0,0 +1,104 @@
+# ReceiptParser 微基准：对比逐字段多次扫描的旧实现与单次扫描的新实现
+# 用法（在 backend 目录下）: python -m benchmarks.bench_receipt_parser
+import json
+import re
+import sys
+import time
+from typing import List, Dict, Any, Optional
+
+from benchmarks.corpus import make_corpus
+from services.receipt_parser import ReceiptParser
+
+
+class LegacyReceiptParser:
+    """旧版解析器（每个字段各扫描一遍，正则未预编译），仅用于对比"""
+
+    def __init__(self):
+        self.store_keywords = ['超市', '商场', '便利店', '百货', '市场', 'store', 'market', 'mart']
+        self.amount_pattern = r'(\d+\.\d{2})|(\d+[\.\,]\d{2})'
+        self.date_pattern = r'(\d{4}[-/年]\d{1,2}[-/月]\d{1,2})|(\d{1,2}[-/]\d{1,2}[-/]\d{4})'
+        self.time_pattern = r'(\d{1,2}:\d{2}:\d{2})|(\d{1,2}:\d{2})'
+
+    def parse_receipt_text(self, ocr_results: List[Dict[str, Any]]) -> Dict[str, Any]:
+        lines = [result['text'].strip() for result in ocr_results if result['text'].strip()]
+        return {
+            "store_name": self._extract_store_name(lines),
+            "transaction_date": self._extract_first(lines, self.date_pattern),
+            "transaction_time": self._extract_first(lines, self.time_pattern),
+            "total_amount": self._extract_total_amount(lines),
+            "items": self._extract_items(lines),
+            "raw_lines": lines,
+            "confidence": sum(r.get('confidence', 0) for r in ocr_results) / len(ocr_results) if ocr_results else 0
+        }
+
+    def _extract_store_name(self, lines):
+        for line in lines[:3]:
+            for keyword in self.store_keywords:
+                if keyword in line:
+                    return line
+            if any(word in line for word in ['有限公司', '公司', '专卖店', '分店']):
+                return line
+        return lines[0] if lines else "未知商店"
+
+    def _extract_first(self, lines, pattern) -> Optional[str]:
+        for line in lines:
+            match = re.search(pattern, line)
+            if match:
+                return match.group()
+        return None
+
+    def _extract_total_amount(self, lines):
+        total_keywords = ['合计', '总计', '总额', '金额', '应收', 'total', 'amount', 'sum']
+        for line in reversed(lines):
+            if any(keyword in line.lower() for keyword in total_keywords):
+                match = re.search(self.amount_pattern, line)
+                if match:
+                    return float(match.group().replace(',', '.'))
+        amounts = []
+        for line in lines:
+            for match in re.findall(self.amount_pattern, line):
+                amounts.append(float((match[0] if match[0] else match[1]).replace(',', '.')))
+        return max(amounts) if amounts else None
+
+    def _extract_items(self, lines):
+        items = []
+        for line in lines:
+            if any(keyword in line for keyword in ['合计', '总计', '收款', '找零', '欢迎']):
+                continue
+            match = re.match(r'^(.+?)\s+(\d+\.\d{2})\s*$', line.strip())
+            if match:
+                name, price = match.groups()
+                items.append({"name": name.strip(), "price": float(price), "quantity": 1})
+        return items
+
+
+def _time_per_call(func, receipts, repeat: int) -> float:
+    """返回每次调用的平均耗时（微秒）"""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for receipt in receipts:
+            func(receipt)
+    return (time.perf_counter() - start) / (repeat * len(receipts)) * 1e6
+
+
+def run(repeat: int = 20) -> Dict[str, Any]:
+    # 旧实现每次调用都会走 re 模块的编译缓存查找，这里不额外清空缓存
+    legacy, current = LegacyReceiptParser(), ReceiptParser()
+    report = {"benchmark": "receipt_parser", "repeat": repeat, "cases": []}
+    for size in (5, 20, 80, 300):
+        receipts = make_corpus(sizes=(size,), per_size=10)
+        for receipt in receipts:
+            assert legacy.parse_receipt_text(receipt) == current.parse_receipt_text(receipt), "解析结果与旧实现不一致"
+        legacy_us = _time_per_call(legacy.parse_receipt_text, receipts, repeat)
+        current_us = _time_per_call(current.parse_receipt_text, receipts, repeat)
+        report["cases"].append({
+            "items": size,
+            "legacy_us": round(legacy_us, 2),
+            "current_us": round(current_us, 2),
+            "speedup": round(legacy_us / current_us, 2)
+        })
+    return report
+
+
+if __name__ == "__main__":
+    print(json.dumps(run(int(sys.argv[1]) if len(sys.argv) > 1 else 20), ensure_ascii=False, indent=2))
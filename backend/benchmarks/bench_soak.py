@@ -0,0 +1,297 @@
+# 长时间压测（soak）：持续向独立进程中的真实应用上传不同尺寸的图片（OCR由本地模拟百度服务完成），
+# 定期采样应用的常驻内存、事件循环延迟和请求延迟，结束时按阈值判定内存增长、事件循环阻塞和延迟退化。
+# 任一检查未通过时退出码为1，可用于发布前的回归门禁。
+# 用法（在 backend 目录下）:
+#   python -m benchmarks.bench_soak --duration 3600 --concurrency 16 --output soak.json
+#   python -m benchmarks.bench_soak --duration 300 --warmup 30 --max-rss-growth-mb 32 --max-loop-lag-ms 50
+from typing import List, Dict, Any, Optional, Tuple
+import argparse
+import asyncio
+import json
+import platform
+import random
+import re
+import sys
+import time
+
+from benchmarks.common import AppProcess, configure_env, make_image, percentile, summarize
+from benchmarks.fake_baidu import FakeBaiduServer
+
+RSS_METRIC = "process_resident_memory_bytes"
+LAG_METRIC = "gootool_event_loop_lag_seconds"
+
+_SERIES_RE = re.compile(r'^([a-zA-Z_:][\w:]*)(\{[^}]*\})?\s+(\S+)$')
+_LE_RE = re.compile(r'le="([^"]+)"')
+
+
+def parse_metrics(text: str) -> Dict[str, Any]:
+    """从 /metrics 文本中取出常驻内存和事件循环延迟直方图（累计分桶 [(上界, 计数)]、总数、总和）"""
+    result: Dict[str, Any] = {"rss": None, "lag_buckets": [], "lag_count": 0.0, "lag_sum": 0.0}
+    for line in text.splitlines():
+        match = _SERIES_RE.match(line)
+        if not match:
+            continue
+        name, labels, value = match.group(1), match.group(2) or "", float(match.group(3))
+        if name == RSS_METRIC:
+            result["rss"] = value
+        elif name == f"{LAG_METRIC}_bucket":
+            result["lag_buckets"].append((float(_LE_RE.search(labels).group(1)), value))
+        elif name == f"{LAG_METRIC}_count":
+            result["lag_count"] = value
+        elif name == f"{LAG_METRIC}_sum":
+            result["lag_sum"] = value
+    return result
+
+
+def lag_window(before: Dict[str, Any], after: Dict[str, Any]) -> Dict[str, Optional[float]]:
+    """两次采样之间的事件循环延迟：p99 和最大值取所在分桶的上界（偏保守），毫秒"""
+    previous = dict(before["lag_buckets"])
+    buckets = [(bound, count - previous.get(bound, 0.0)) for bound, count in after["lag_buckets"]]
+    count = after["lag_count"] - before["lag_count"]
+    if count <= 0 or not buckets:
+        return {"count": 0, "mean_ms": None, "p99_ms": None, "max_ms": None}
+    # 落在 +Inf 分桶时按最大的有限上界计
+    finite = max(bound for bound, _ in buckets if bound != float("inf"))
+
+    def bucket_bound(target: float) -> float:
+        for bound, cumulative in buckets:
+            if cumulative >= target:
+                return min(bound, finite)
+        return finite
+
+    return {
+        "count": int(count),
+        "mean_ms": round((after["lag_sum"] - before["lag_sum"]) / count * 1000, 3),
+        "p99_ms": round(bucket_bound(count * 0.99) * 1000, 3),
+        "max_ms": round(bucket_bound(count) * 1000, 3),
+    }
+
+
+def slope_per_hour(points: List[Tuple[float, float]]) -> float:
+    """最小二乘拟合的斜率（每小时）"""
+    n = len(points)
+    if n < 2:
+        return 0.0
+    mean_t = sum(t for t, _ in points) / n
+    mean_v = sum(v for _, v in points) / n
+    var = sum((t - mean_t) ** 2 for t, _ in points)
+    if var == 0:
+        return 0.0
+    return sum((t - mean_t) * (v - mean_v) for t, v in points) / var * 3600
+
+
+class LoadDriver:
+    """以固定并发持续发送单张识别和批量识别请求，记录每个请求的完成时间、耗时和是否成功"""
+
+    def __init__(self, url: str, images: List[bytes], concurrency: int, batch_ratio: float, batch_size: int):
+        self.url = url
+        self.images = images
+        self.concurrency = concurrency
+        self.batch_ratio = batch_ratio
+        self.batch_size = batch_size
+        self.records: List[Tuple[float, float, bool]] = []
+        self._rng = random.Random(0)
+
+    async def run(self, deadline: float):
+        import httpx
+
+        limits = httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency)
+        async with httpx.AsyncClient(timeout=120, limits=limits) as client:
+            await asyncio.gather(*(self._worker(client, deadline) for _ in range(self.concurrency)))
+
+    async def _worker(self, client, deadline: float):
+        import httpx
+
+        sequence = 0
+        while time.time() < deadline:
+            sequence += 1
+            if self._rng.random() < self.batch_ratio:
+                # 同一批使用不同的图片，避免被批量去重跳过
+                picked = self._rng.sample(range(len(self.images)), min(self.batch_size, len(self.images)))
+                files = [("files", (f"batch_{sequence}_{i}.jpg", self.images[i], "image/jpeg")) for i in picked]
+                path = "/api/v1/ocr/receipts/batch"
+            else:
+                index = self._rng.randrange(len(self.images))
+                files = {"file": (f"receipt_{sequence}.jpg", self.images[index], "image/jpeg")}
+                path = "/api/v1/ocr/receipt"
+            start = time.perf_counter()
+            try:
+                response = await client.post(self.url + path, files=files)
+                ok = response.status_code == 200
+            except httpx.HTTPError:
+                ok = False
+            self.records.append((time.time(), time.perf_counter() - start, ok))
+
+
+async def sample_loop(url: str, driver: LoadDriver, started: float, deadline: float, interval: float,
+                      warmup: float) -> List[Dict[str, Any]]:
+    """每 interval 秒采集一次应用指标和这段时间内完成的请求"""
+    import httpx
+
+    samples = []
+    async with httpx.AsyncClient(timeout=30) as client:
+        previous = parse_metrics((await client.get(f"{url}/metrics")).text)
+        consumed = 0
+        while time.time() < deadline:
+            await asyncio.sleep(interval)
+            current = parse_metrics((await client.get(f"{url}/metrics")).text)
+            window = driver.records[consumed:]
+            consumed += len(window)
+            latencies = [latency for _, latency, _ in window]
+            elapsed = time.time() - started
+            samples.append({
+                "t_s": round(elapsed, 1),
+                "warmup": elapsed < warmup,
+                "rss_mb": round(current["rss"] / 1024 / 1024, 2) if current["rss"] is not None else None,
+                "requests": len(window),
+                "errors": sum(1 for _, _, ok in window if not ok),
+                "rps": round(len(window) / interval, 2),
+                "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+                "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+                "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+                "loop_lag": lag_window(previous, current),
+            })
+            previous = current
+            last = samples[-1]
+            print(f"[{last['t_s']:>7}s] rss={last['rss_mb']}MB rps={last['rps']} p95={last['p95_ms']}ms "
+                  f"lag_p99={last['loop_lag']['p99_ms']}ms errors={last['errors']}", file=sys.stderr)
+    return samples
+
+
+def _median(values: List[float]) -> float:
+    return percentile(values, 50)
+
+
+def evaluate(samples: List[Dict[str, Any]], records: List[Tuple[float, float, bool]], started: float,
+             lag_total: Dict[str, Optional[float]], args) -> List[Dict[str, Any]]:
+    """按阈值检查预热之后的数据，返回各项检查结果"""
+    checks = []
+
+    def check(name: str, value: Optional[float], threshold: float, unit: str):
+        checks.append({"name": name, "value": value, "threshold": threshold, "unit": unit,
+                       "passed": value is None or value <= threshold,
+                       "skipped": value is None})
+
+    measured = [s for s in samples if not s["warmup"]]
+    steady = [(t, latency, ok) for t, latency, ok in records if t - started >= args.warmup]
+
+    errors = sum(1 for _, _, ok in steady if not ok)
+    check("error_rate", round(errors / len(steady), 4) if steady else None, args.max_error_rate, "ratio")
+    check("latency_p95", summarize([latency for _, latency, _ in steady])["p95_ms"] if steady else None,
+          args.max_p95_ms, "ms")
+
+    # 延迟退化：后三分之一采样窗口的 p95 中位数相对前三分之一的增长比例
+    windows = [s["p95_ms"] for s in measured if s["requests"]]
+    drift = None
+    if len(windows) >= 3:
+        third = max(1, len(windows) // 3)
+        first, last = _median(windows[:third]), _median(windows[-third:])
+        drift = round(last / first - 1, 3) if first > 0 else None
+    check("latency_p95_drift", drift, args.max_latency_drift, "ratio")
+
+    check("loop_lag_p99", lag_total["p99_ms"], args.max_loop_lag_ms, "ms")
+    check("loop_lag_max", lag_total["max_ms"], args.max_loop_stall_ms, "ms")
+
+    # 内存：预热后前三个与最后三个采样的中位数之差，以及整体趋势（运行时间足够长时才判断）
+    rss = [(s["t_s"], s["rss_mb"]) for s in measured if s["rss_mb"] is not None]
+    growth = round(_median([v for _, v in rss[-3:]]) - _median([v for _, v in rss[:3]]), 2) if len(rss) >= 2 else None
+    check("rss_growth", growth, args.max_rss_growth_mb, "MB")
+    long_enough = len(rss) >= 2 and rss[-1][0] - rss[0][0] >= args.min_slope_span
+    check("rss_slope", round(slope_per_hour(rss), 2) if long_enough else None, args.max_rss_slope_mb_h, "MB/h")
+    return checks
+
+
+def main():
+    parser = argparse.ArgumentParser(description="OCR服务长时间压测（内存、事件循环延迟与请求延迟门禁）")
+    parser.add_argument("--duration", type=float, default=600, help="总运行时间（秒）")
+    parser.add_argument("--warmup", type=float, default=60, help="预热时间（秒），不参与检查")
+    parser.add_argument("--sample-interval", type=float, default=10, help="采样间隔（秒）")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--batch-ratio", type=float, default=0.2, help="批量识别请求所占比例")
+    parser.add_argument("--batch-size", type=int, default=4, help="每个批量请求的图片数")
+    parser.add_argument("--image-sizes", default="1080x2400,3024x4032,720x1280",
+                        help="测试图片尺寸（手机截图、相机照片等），逗号分隔的 WxH")
+    parser.add_argument("--images-per-size", type=int, default=3)
+    parser.add_argument("--latency", type=float, default=0.2, help="模拟百度接口平均延迟（秒）")
+    parser.add_argument("--jitter", type=float, default=0.05)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="模拟百度接口返回QPS超限错误的比例")
+    parser.add_argument("--qps", default="0", help="应用的 BAIDU_OCR_QPS（默认不限流）")
+    # 检查阈值
+    parser.add_argument("--max-error-rate", type=float, default=0.01)
+    parser.add_argument("--max-p95-ms", type=float, default=5000)
+    parser.add_argument("--max-latency-drift", type=float, default=0.5, help="p95 允许的增长比例")
+    parser.add_argument("--max-loop-lag-ms", type=float, default=100, help="事件循环延迟 p99 上限")
+    parser.add_argument("--max-loop-stall-ms", type=float, default=1000, help="单次事件循环阻塞上限")
+    parser.add_argument("--max-rss-growth-mb", type=float, default=64)
+    parser.add_argument("--max-rss-slope-mb-h", type=float, default=32, help="常驻内存增长趋势上限（MB/小时）")
+    parser.add_argument("--min-slope-span", type=float, default=600, help="预热后运行超过该秒数才检查内存趋势")
+    parser.add_argument("--output", help="结果写入的JSON文件（默认输出到标准输出）")
+    args = parser.parse_args()
+
+    fake = FakeBaiduServer(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate).start()
+    # 关闭结果缓存，保证每个请求都走完整链路；事件循环延迟每 100ms 采样一次
+    configure_env(fake.url, OCR_CACHE_ENABLED="0", BAIDU_OCR_QPS=args.qps, EVENT_LOOP_LAG_INTERVAL="0.1",
+                  OCR_BATCH_MAX_FILES=str(max(100, args.batch_size)))
+
+    images = []
+    for size in args.image_sizes.split(","):
+        width, height = (int(v) for v in size.lower().split("x"))
+        images.extend(make_image(width, height, seed=len(images) + i) for i in range(args.images_per_size))
+
+    app = AppProcess().start()
+    try:
+        driver = LoadDriver(app.url, images, args.concurrency, args.batch_ratio, args.batch_size)
+        started = time.time()
+        deadline = started + args.duration
+
+        async def run():
+            import httpx
+
+            async with httpx.AsyncClient(timeout=30) as client:
+                samples_task = asyncio.ensure_future(
+                    sample_loop(app.url, driver, started, deadline, args.sample_interval, args.warmup))
+                load_task = asyncio.ensure_future(driver.run(deadline))
+                # 预热结束时记录事件循环延迟直方图，作为整体统计的起点
+                await asyncio.sleep(min(args.warmup, args.duration))
+                lag_start = parse_metrics((await client.get(f"{app.url}/metrics")).text)
+                samples = await samples_task
+                await load_task
+                lag_end = parse_metrics((await client.get(f"{app.url}/metrics")).text)
+                return samples, lag_window(lag_start, lag_end)
+
+        samples, lag_total = asyncio.run(run())
+    finally:
+        app.stop()
+        fake.stop()
+
+    checks = evaluate(samples, driver.records, started, lag_total, args)
+    steady = [latency for t, latency, _ in driver.records if t - started >= args.warmup]
+    report = {
+        "benchmark": "ocr_soak",
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "config": {k: v for k, v in vars(args).items() if k != "output"},
+        "image_bytes": sum(len(i) for i in images) // len(images),
+        "fake_server": fake.stats(),
+        "latency": summarize(steady),
+        "loop_lag": lag_total,
+        "checks": checks,
+        "passed": all(c["passed"] for c in checks),
+        "samples": samples,
+    }
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+    else:
+        print(output)
+
+    for c in checks:
+        status = "跳过" if c["skipped"] else ("通过" if c["passed"] else "未通过")
+        print(f"{status}: {c['name']} = {c['value']} {c['unit']}（阈值 {c['threshold']}）", file=sys.stderr)
+    if not report["passed"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+# 基准测试公共工具
+from typing import List, Dict, Any
+import io
+import os
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def configure_env(api_base: str, **overrides: str):
+    """在导入应用模块之前设置环境变量，使应用连接本地模拟服务"""
+    os.environ.setdefault("BAIDU_OCR_API_KEY", "bench-key")
+    os.environ.setdefault("BAIDU_OCR_SECRET_KEY", "bench-secret")
+    os.environ["BAIDU_OCR_API_BASE"] = api_base
+    # 模拟服务没有QPS限制：默认关闭客户端限流，否则测到的是限流器（默认2 QPS）而不是处理链路
+    os.environ.setdefault("BAIDU_OCR_QPS", "0")
+    os.environ.setdefault("FRONTEND_DIR", os.path.join(os.path.dirname(BACKEND_DIR), "frontend"))
+    for key, value in overrides.items():
+        os.environ[key] = value
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """线性插值计算百分位数"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = (len(ordered) - 1) * pct / 100.0
+    low = int(k)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (k - low)
+
+
+def summarize(latencies: List[float]) -> Dict[str, float]:
+    """延迟统计（毫秒）"""
+    return {
+        "count": len(latencies),
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 2) if latencies else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "max_ms": round(max(latencies) * 1000, 2) if latencies else 0.0,
+    }
+
+
+def make_image(width: int = 1080, height: int = 2400, seed: int = 0, fmt: str = "JPEG") -> bytes:
+    """生成接近手机截图大小的测试图片（带噪声以避免被过度压缩）"""
+    from PIL import Image, ImageDraw
+
+    rng = random.Random(seed)
+    img = Image.effect_noise((width, height), 24).convert("RGB")
+    draw = ImageDraw.Draw(img)
+    for row in range(40, height - 40, 48):
+        draw.rectangle([40, row, rng.randint(200, width - 40), row + 24], fill=(20, 20, 20))
+    buf = io.BytesIO()
+    img.save(buf, format=fmt, quality=92)
+    return buf.getvalue()
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class AppServer:
+    """在后台线程中运行真实的 FastAPI 应用（uvicorn）"""
+
+    def __init__(self, app, port: int = 0):
+        import uvicorn
+
+        self.port = port or free_port()
+        self.server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=self.port, log_level="warning"))
+        self.thread = threading.Thread(target=self.server.run, name="app-server", daemon=True)
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    def start(self, timeout: float = 30.0) -> "AppServer":
+        self.thread.start()
+        deadline = time.time() + timeout
+        while not self.server.started:
+            if time.time() > deadline:
+                raise RuntimeError("应用启动超时")
+            time.sleep(0.05)
+        return self
+
+    def stop(self):
+        self.server.should_exit = True
+        self.thread.join(timeout=10)
+
+
+class AppProcess:
+    """在独立进程中运行真实的 FastAPI 应用（uvicorn），内存和事件循环不受压测客户端影响
+
+    环境变量需先通过 configure_env 设置，子进程继承当前环境。
+    """
+
+    def __init__(self, port: int = 0, extra_args: List[str] = ()):
+        self.port = port or free_port()
+        self.args = [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(self.port),
+                     "--log-level", "warning", *extra_args]
+        self.process: "subprocess.Popen" = None
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    def start(self, timeout: float = 60.0) -> "AppProcess":
+        self.process = subprocess.Popen(self.args, cwd=BACKEND_DIR, env=dict(os.environ))
+        deadline = time.time() + timeout
+        while True:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"应用进程已退出，退出码 {self.process.returncode}")
+            try:
+                with urllib.request.urlopen(f"{self.url}/health", timeout=1) as response:
+                    if response.status == 200:
+                        return self
+            except OSError:
+                pass
+            if time.time() > deadline:
+                self.stop()
+                raise RuntimeError("应用启动超时")
+            time.sleep(0.2)
+
+    def stop(self, timeout: float = 15.0):
+        if self.process is None or self.process.poll() is not None:
+            return
+        self.process.terminate()
+        try:
+            self.process.wait(timeout)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
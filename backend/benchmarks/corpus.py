@@ -0,0 +1,43 @@
+# 合成小票语料，用于基准测试
+from typing import List, Dict, Any
+import random
+
+STORES = ["华润万家超市", "永辉超市(建设路分店)", "全家便利店", "沃尔玛购物广场", "Fresh Mart"]
+GOODS = ["农夫山泉550ml", "康师傅红烧牛肉面", "蒙牛纯牛奶250ml", "金龙鱼调和油5L", "伊利酸奶", "苹果 散装",
+         "洗洁精1.5kg", "抽纸3包装", "鸡蛋30枚", "五花肉", "面包", "可口可乐2L", "大米10kg", "酱油500ml"]
+NOISE = ["收银员: 0032", "欢迎光临 谢谢惠顾", "会员卡号: 6222****1234", "POS机号 07", "请妥善保管小票",
+         "找零 0.00", "收款 100.00", "积分: 35", "退换货请凭小票"]
+
+
+def make_receipt(item_count: int, seed: int = 0) -> List[Dict[str, Any]]:
+    """生成一张包含 item_count 个商品行的OCR结果（与引擎输出格式一致）"""
+    rng = random.Random(seed)
+    # 约四分之一的小票没有"合计"行，覆盖按最大金额推断总额的分支
+    total_label = rng.choice(["合计", "合计", "TOTAL", None])
+    lines = [rng.choice(STORES), f"2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d} "
+             f"{rng.randint(8, 21):02d}:{rng.randint(0, 59):02d}:{rng.randint(0, 59):02d}"]
+    total = 0.0
+    for i in range(item_count):
+        price = round(rng.uniform(1, 200), 2)
+        total += price
+        lines.append(f"{rng.choice(GOODS)} {price:.2f}")
+        if i % 7 == 3:
+            lines.append(rng.choice(NOISE))
+    if total_label:
+        lines.append(f"{total_label} {total:.2f}")
+    lines.extend(rng.sample(NOISE, 3))
+
+    results = []
+    for row, text in enumerate(lines):
+        top = 40 + row * 36
+        results.append({
+            "text": text,
+            "confidence": round(rng.uniform(0.8, 1.0), 4),
+            "bbox": [20, top, 600, top, 600, top + 30, 20, top + 30]
+        })
+    return results
+
+
+def make_corpus(sizes=(5, 20, 80, 300), per_size: int = 5) -> List[List[Dict[str, Any]]]:
+    """生成不同长度的小票集合"""
+    return [make_receipt(size, seed=size * 1000 + i) for size in sizes for i in range(per_size)]
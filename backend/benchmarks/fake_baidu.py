@@ -0,0 +1,122 @@
+# 本地模拟的百度OCR服务（oauth/2.0/token 与 ocr/v1/accurate、accurate_basic），延迟和错误率可配置
+# 单独运行（在 backend 目录下）: python -m benchmarks.fake_baidu --port 9100 --latency 0.3
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Dict, Any, Optional
+import argparse
+import json
+import random
+import threading
+import time
+
+from benchmarks.corpus import make_corpus
+
+# 百度接口的QPS超限错误
+QPS_LIMIT_ERROR = {"error_code": 18, "error_msg": "Open api qps request limit reached"}
+
+
+def to_words_result(ocr_results: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """将统一格式的OCR结果转换为百度 accurate 接口的返回格式（含文字位置）"""
+    words = []
+    for r in ocr_results:
+        bbox = r["bbox"]
+        words.append({
+            "words": r["text"],
+            "location": {"left": bbox[0], "top": bbox[1], "width": bbox[2] - bbox[0], "height": bbox[5] - bbox[1]},
+            "probability": {"average": r["confidence"], "min": r["confidence"], "variance": 0.0}
+        })
+    return {"log_id": random.getrandbits(48), "words_result_num": len(words), "words_result": words}
+
+
+class FakeBaiduServer:
+    """在后台线程中运行的模拟百度OCR服务"""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.2, jitter: float = 0.05,
+                 error_rate: float = 0.0, http_error_rate: float = 0.0, payloads: Optional[List[Dict[str, Any]]] = None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.http_error_rate = http_error_rate
+        self.payloads = payloads or [to_words_result(r) for r in make_corpus(sizes=(8, 20, 40), per_size=4)]
+        self.token_requests = 0
+        self.ocr_requests = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "FakeBaiduServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-baidu", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"token_requests": self.token_requests, "ocr_requests": self.ocr_requests}
+
+    def _make_handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                if length:
+                    self.rfile.read(length)
+                path = self.path.split("?", 1)[0]
+                if path == "/oauth/2.0/token":
+                    with fake._lock:
+                        fake.token_requests += 1
+                    self._send(200, {"access_token": "fake-token", "expires_in": 2592000})
+                elif path in ("/rest/2.0/ocr/v1/accurate", "/rest/2.0/ocr/v1/accurate_basic"):
+                    with fake._lock:
+                        fake.ocr_requests += 1
+                    time.sleep(max(0.0, random.gauss(fake.latency, fake.jitter)))
+                    roll = random.random()
+                    if roll < fake.http_error_rate:
+                        self._send(500, {"error": "internal error"})
+                    elif roll < fake.http_error_rate + fake.error_rate:
+                        self._send(200, QPS_LIMIT_ERROR)
+                    else:
+                        self._send(200, random.choice(fake.payloads))
+                else:
+                    self._send(404, {"error": "not found"})
+
+            def _send(self, status: int, body: Dict[str, Any]):
+                data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        return Handler
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="本地模拟百度OCR服务")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--latency", type=float, default=0.2, help="平均响应延迟（秒）")
+    parser.add_argument("--jitter", type=float, default=0.05, help="延迟标准差（秒）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="返回QPS超限错误的比例")
+    parser.add_argument("--http-error-rate", type=float, default=0.0, help="返回HTTP 500的比例")
+    args = parser.parse_args()
+    server = FakeBaiduServer(port=args.port, latency=args.latency, jitter=args.jitter,
+                             error_rate=args.error_rate, http_error_rate=args.http_error_rate).start()
+    print(f"模拟百度OCR服务已启动: {server.url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.stop()
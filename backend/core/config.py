@@ -0,0 +1,163 @@
+# 全局配置（从环境变量读取，无需数据库）
+import os
+
+
+def _env_int(name: str, default: int) -> int:
+    """读取整型环境变量，非法值时回退到默认值"""
+    try:
+        return int(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def _env_float(name: str, default: float) -> float:
+    """读取浮点型环境变量，非法值时回退到默认值"""
+    try:
+        return float(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def _env_bool(name: str, default: bool) -> bool:
+    """读取布尔型环境变量（1/true/yes/on 为真）"""
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+def _env_map(name: str, cast=str) -> dict:
+    """读取 "键=值,键=值" 形式的环境变量，非法项忽略"""
+    result = {}
+    for item in os.getenv(name, "").split(","):
+        key, sep, value = item.partition("=")
+        if not sep or not key.strip():
+            continue
+        try:
+            result[key.strip()] = cast(value.strip())
+        except (TypeError, ValueError):
+            continue
+    return result
+
+
+class Settings:
+    """应用配置"""
+
+    def __init__(self):
+        # 前端静态文件目录
+        self.frontend_dir = os.getenv("FRONTEND_DIR", "/home/admin/goodtool/frontend")
+
+        # 服务监听地址与工作进程数（大于1时各进程通过 OCR_SHARED_STATE_PATH 共享 token、限流和额度状态）
+        self.server_host = os.getenv("SERVER_HOST", "0.0.0.0")
+        self.server_port = _env_int("SERVER_PORT", 8000)
+        self.server_workers = _env_int("SERVER_WORKERS", 1)
+        # 多进程共享状态的 SQLite 文件路径，为空时状态只在进程内
+        self.shared_state_path = os.getenv("OCR_SHARED_STATE_PATH", "")
+
+        # 是否在响应中附带 Server-Timing 头（各处理阶段耗时）
+        self.server_timing_enabled = _env_bool("SERVER_TIMING_ENABLED", True)
+        # 事件循环延迟的采样间隔（秒），0 表示不采样
+        self.loop_lag_interval = _env_float("EVENT_LOOP_LAG_INTERVAL", 0.5)
+
+        # 单张上传图片的大小上限与分块读取大小
+        self.max_upload_bytes = _env_int("MAX_UPLOAD_MB", 20) * 1024 * 1024
+        self.upload_chunk_size = _env_int("UPLOAD_CHUNK_KB", 64) * 1024
+
+        # 批量识别时同时进行的OCR调用数量上限
+        self.batch_concurrency = _env_int("OCR_BATCH_CONCURRENCY", 8)
+        # 单次批量请求允许上传的最大图片数
+        self.batch_max_files = _env_int("OCR_BATCH_MAX_FILES", 100)
+        # 后台识别任务（/ocr/jobs）：工作协程数、排队图片总大小上限、同时未完成的任务数、完成后保留时间（秒）
+        self.job_workers = _env_int("OCR_JOB_WORKERS", 8)
+        self.job_max_queued_bytes = _env_int("OCR_JOB_MAX_QUEUED_MB", 512) * 1024 * 1024
+        self.job_max_active = _env_int("OCR_JOB_MAX_ACTIVE", 20)
+        self.job_ttl = _env_float("OCR_JOB_TTL", 3600.0)
+        self.job_max_retained = _env_int("OCR_JOB_MAX_RETAINED", 200)
+        # 批量去重：OCR前只跳过内容完全相同的图片，感知哈希距离不超过上限的图片仅作为提示；
+        # 解析后合并同一笔交易（时间窗口，秒）
+        self.dedup_enabled = _env_bool("OCR_DEDUP_ENABLED", True)
+        self.dedup_image_distance = _env_int("OCR_DEDUP_IMAGE_DISTANCE", 3)
+        self.dedup_time_window = _env_float("OCR_DEDUP_TIME_WINDOW", 600.0)
+        # CPU密集型OCR引擎使用的线程池大小（0 表示按CPU核数自动计算）
+        self.ocr_executor_workers = _env_int("OCR_EXECUTOR_WORKERS", 0)
+
+        # 百度OCR接口地址（基准测试时可指向本地模拟服务）
+        self.baidu_api_base = os.getenv("BAIDU_OCR_API_BASE", "https://aip.baidubce.com").rstrip("/")
+        # 百度OCR识别接口：默认 accurate_basic（不含文字位置，按每框一行解析）；
+        # 设为 accurate 返回文字位置，可按版面合并同一行的文字框，但单次调用费用更高
+        self.baidu_ocr_api = os.getenv("BAIDU_OCR_API", "accurate_basic")
+        # 百度OCR HTTP连接池大小与超时（秒）
+        self.baidu_pool_size = _env_int("BAIDU_OCR_POOL_SIZE", 20)
+        self.baidu_connect_timeout = _env_float("BAIDU_OCR_CONNECT_TIMEOUT", 5.0)
+        self.baidu_read_timeout = _env_float("BAIDU_OCR_READ_TIMEOUT", 30.0)
+        # 百度OCR客户端限流：QPS、突发量、排队上限与排队超时（秒），QPS 为 0 表示不限流
+        self.baidu_qps = _env_float("BAIDU_OCR_QPS", 2.0)
+        self.baidu_burst = _env_int("BAIDU_OCR_BURST", 2)
+        self.baidu_max_queue = _env_int("BAIDU_OCR_MAX_QUEUE", 100)
+        self.baidu_queue_timeout = _env_float("BAIDU_OCR_QUEUE_TIMEOUT", 30.0)
+        # 每日调用额度（0 表示不限制），以及为交互请求保留的额度比例
+        self.baidu_daily_quota = _env_int("BAIDU_OCR_DAILY_QUOTA", 0)
+        self.baidu_quota_reserve = _env_float("BAIDU_OCR_QUOTA_RESERVE", 0.1)
+        # access_token 在过期前多少秒由后台任务提前刷新
+        self.baidu_token_refresh_margin = _env_float("BAIDU_OCR_TOKEN_REFRESH_MARGIN", 600.0)
+
+        # 请求到达时引擎仍在初始化的最长等待时间（秒）
+        self.engine_ready_timeout = _env_float("OCR_ENGINE_READY_TIMEOUT", 30.0)
+
+        # 多引擎路由：备用引擎（逗号分隔）、对冲请求延迟（秒，0 关闭）、临时错误重试与熔断
+        self.ocr_fallback_engines = [e.strip() for e in os.getenv("OCR_FALLBACK_ENGINES", "easyocr").split(",") if e.strip()]
+        self.ocr_hedge_after = _env_float("OCR_HEDGE_AFTER", 3.0)
+        self.ocr_max_retries = _env_int("OCR_MAX_RETRIES", 2)
+        self.ocr_retry_backoff = _env_float("OCR_RETRY_BACKOFF", 0.2)
+        self.ocr_retry_backoff_max = _env_float("OCR_RETRY_BACKOFF_MAX", 2.0)
+        self.ocr_breaker_threshold = _env_int("OCR_BREAKER_THRESHOLD", 5)
+        self.ocr_breaker_reset = _env_float("OCR_BREAKER_RESET", 30.0)
+
+        # 本地EasyOCR引擎（无需网络，百度额度用完时可作为备用）
+        # EASYOCR_MODE=pool 时模型在独立进程中加载，inline 时在Web进程内加载
+        self.easyocr_enabled = _env_bool("EASYOCR_ENABLED", False)
+        self.easyocr_mode = os.getenv("EASYOCR_MODE", "pool")
+        self.easyocr_gpu = _env_bool("EASYOCR_GPU", False)
+        self.easyocr_workers = _env_int("EASYOCR_WORKERS", max(1, (os.cpu_count() or 2) // 2))
+        # 排队等待的任务数上限（不含正在执行的），超出后拒绝新任务
+        self.easyocr_max_queue = _env_int("EASYOCR_MAX_QUEUE", 16)
+        self.easyocr_queue_timeout = _env_float("EASYOCR_QUEUE_TIMEOUT", 10.0)
+
+        # 引擎注册表：启用的引擎（逗号分隔，默认百度OCR，EASYOCR_ENABLED 时加上 easyocr），
+        # 以及通过配置声明的第三方引擎（"名称=模块:类名"，也可用 gootool.ocr_engines 入口点声明）
+        default_engines = "baiduocr,easyocr" if self.easyocr_enabled else "baiduocr"
+        self.ocr_engines = [e.strip() for e in os.getenv("OCR_ENGINES", default_engines).split(",") if e.strip()]
+        self.ocr_engine_plugins = _env_map("OCR_ENGINE_PLUGINS")
+        # 覆盖引擎声明的单次调用成本和预计延迟（秒），如 "baiduocr=0.008,easyocr=0"
+        self.ocr_engine_costs = _env_map("OCR_ENGINE_COSTS", float)
+        self.ocr_engine_latencies = _env_map("OCR_ENGINE_LATENCIES", float)
+        # engine=auto 时可接受的预计延迟（秒）：在此范围内选择成本最低的引擎，批量任务可以等得更久
+        self.ocr_auto_latency_budget = _env_float("OCR_AUTO_LATENCY_BUDGET", 3.0)
+        self.ocr_auto_batch_latency_budget = _env_float("OCR_AUTO_BATCH_LATENCY_BUDGET", 30.0)
+
+        # OCR结果缓存：内存LRU + 可选磁盘缓存（OCR_CACHE_DIR 为空时不启用磁盘缓存）
+        self.ocr_cache_enabled = _env_bool("OCR_CACHE_ENABLED", True)
+        self.ocr_cache_max_entries = _env_int("OCR_CACHE_MAX_ENTRIES", 512)
+        self.ocr_cache_dir = os.getenv("OCR_CACHE_DIR", "")
+        self.ocr_cache_ttl = _env_float("OCR_CACHE_TTL", 7 * 24 * 3600)
+        self.ocr_cache_max_disk_mb = _env_int("OCR_CACHE_MAX_DISK_MB", 512)
+
+        # 二次识别：置信度低于阈值或金额/日期格式异常的文字框裁剪放大后合成一张小图再识别一次，
+        # 最多处理的文字框数、放大后的行高（像素），以及使用的引擎（为空时使用首次识别实际使用的引擎）
+        self.refine_enabled = _env_bool("OCR_REFINE_ENABLED", True)
+        self.refine_min_confidence = _env_float("OCR_REFINE_MIN_CONFIDENCE", 0.8)
+        self.refine_max_regions = _env_int("OCR_REFINE_MAX_REGIONS", 6)
+        self.refine_line_height = _env_int("OCR_REFINE_LINE_HEIGHT", 64)
+        self.refine_engine = os.getenv("OCR_REFINE_ENGINE", "")
+
+        # 图片预处理：自动旋转、限制长边、灰度化并重新压缩为JPEG后再送OCR
+        self.preprocess_enabled = _env_bool("OCR_PREPROCESS_ENABLED", True)
+        self.preprocess_max_long_edge = _env_int("OCR_PREPROCESS_MAX_LONG_EDGE", 2560)
+        self.preprocess_grayscale = _env_bool("OCR_PREPROCESS_GRAYSCALE", True)
+        self.preprocess_jpeg_quality = _env_int("OCR_PREPROCESS_JPEG_QUALITY", 85)
+        self.preprocess_min_jpeg_quality = _env_int("OCR_PREPROCESS_MIN_JPEG_QUALITY", 50)
+        self.preprocess_max_bytes = _env_int("OCR_PREPROCESS_MAX_BYTES", 2 * 1024 * 1024)
+
+
+# 全局配置实例
+settings = Settings()
@@ -0,0 +1,213 @@
+# 运行指标：分阶段耗时、负载大小、引擎错误数、缓存命中（Prometheus 文本格式）
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, List, Dict, Any, Optional, Tuple
+import asyncio
+import bisect
+import os
+import threading
+import time
+
+# 耗时分桶（秒）
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# 字节数分桶
+SIZE_BUCKETS = (1024, 16 * 1024, 64 * 1024, 256 * 1024, 1024 ** 2, 2 * 1024 ** 2, 4 * 1024 ** 2,
+                8 * 1024 ** 2, 16 * 1024 ** 2, 32 * 1024 ** 2)
+
+
+def _format_labels(labelnames: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class Counter:
+    """单调递增计数器"""
+    type_name = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, **labels) -> float:
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            return self._values.get(key, 0)
+
+    def collect(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {value}" for key, value in items]
+
+
+class Histogram:
+    """累计分桶直方图"""
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # 每组标签: [各桶计数..., 总数, 总和]
+        self._values: Dict[Tuple[str, ...], List[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                state[index] += 1
+            state[-2] += 1
+            state[-1] += value
+
+    def collect(self) -> List[str]:
+        with self._lock:
+            items = sorted((key, list(state)) for key, state in self._values.items())
+        lines = []
+        for key, state in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, state):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, 'le="%s"' % bound)
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{labels} {state[-2]}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {state[-2]}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {round(state[-1], 6)}")
+        return lines
+
+
+class Gauge:
+    """瞬时值；传入 func 时在输出时调用它读取当前值（返回 None 时不输出）"""
+    type_name = "gauge"
+
+    def __init__(self, name: str, documentation: str, func: Optional[Callable[[], Optional[float]]] = None):
+        self.name = name
+        self.documentation = documentation
+        self._func = func
+        self._value: Optional[float] = None
+
+    def set(self, value: float):
+        self._value = value
+
+    def collect(self) -> List[str]:
+        value = self._func() if self._func else self._value
+        return [] if value is None else [f"{self.name} {value}"]
+
+
+def resident_memory_bytes() -> Optional[int]:
+    """当前进程的常驻内存（Linux 读取 /proc/self/statm，其它平台返回 None）"""
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+class MetricsRegistry:
+    """指标注册表"""
+
+    def __init__(self):
+        self._metrics: List[Any] = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        """输出 Prometheus 文本格式"""
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type_name}")
+            lines.extend(metric.collect())
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+STAGE_SECONDS = registry.register(Histogram(
+    "gootool_stage_duration_seconds", "各处理阶段耗时", ("stage",)))
+PAYLOAD_BYTES = registry.register(Histogram(
+    "gootool_payload_bytes", "各阶段的数据大小", ("kind",), buckets=SIZE_BUCKETS))
+ENGINE_REQUESTS = registry.register(Counter(
+    "gootool_ocr_engine_requests_total", "OCR引擎调用次数", ("engine",)))
+ENGINE_ERRORS = registry.register(Counter(
+    "gootool_ocr_engine_errors_total", "OCR引擎调用失败次数", ("engine",)))
+CACHE_LOOKUPS = registry.register(Counter(
+    "gootool_ocr_cache_lookups_total", "OCR结果缓存查询次数", ("result",)))
+HTTP_REQUESTS = registry.register(Histogram(
+    "gootool_http_request_duration_seconds", "HTTP请求总耗时", ("method", "path", "status")))
+EVENT_LOOP_LAG = registry.register(Histogram(
+    "gootool_event_loop_lag_seconds", "事件循环调度延迟（定时器实际唤醒时间比预期晚的秒数）"))
+PROCESS_RSS = registry.register(Gauge(
+    "process_resident_memory_bytes", "进程常驻内存（字节）", resident_memory_bytes))
+
+
+async def monitor_event_loop_lag(interval: float = 0.5):
+    """定时测量事件循环延迟：同步代码长时间占用事件循环时，定时器会晚醒（应用启动时作为后台任务运行）"""
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        EVENT_LOOP_LAG.observe(max(0.0, loop.time() - start - interval))
+
+# 当前请求的分阶段耗时，用于生成 Server-Timing 响应头
+_request_timings: ContextVar[Optional[List[Tuple[str, float]]]] = ContextVar("request_timings", default=None)
+
+
+def start_request_trace() -> List[Tuple[str, float]]:
+    """为当前请求开启分阶段计时（在中间件中调用）"""
+    timings: List[Tuple[str, float]] = []
+    _request_timings.set(timings)
+    return timings
+
+
+def clear_request_trace():
+    """后台任务不属于任何请求，在其上下文中关闭分阶段计时，避免写入创建它的请求"""
+    _request_timings.set(None)
+
+
+def record_stage(name: str, seconds: float):
+    """记录一个阶段的耗时（秒）"""
+    STAGE_SECONDS.observe(seconds, stage=name)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings.append((name, seconds))
+
+
+@contextmanager
+def stage(name: str):
+    """计时上下文：with stage("parse"): ..."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(name, time.perf_counter() - start)
+
+
+def server_timing_header(timings: List[Tuple[str, float]]) -> str:
+    """生成 Server-Timing 头，同名阶段（如批量请求中的多次调用）累加"""
+    totals: Dict[str, float] = {}
+    for name, seconds in timings:
+        totals[name] = totals.get(name, 0.0) + seconds
+    return ", ".join(f"{name.replace('.', '_')};dur={seconds * 1000:.1f}" for name, seconds in totals.items())
@@ -0,0 +1,155 @@
+# 多进程共享状态：多个 uvicorn 工作进程通过同一个 SQLite 文件共享 access_token、限流令牌桶、调用额度等小块状态
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable, Optional, Tuple
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from core.config import settings
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS shared_state (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL,
+    expires_at REAL
+)
+"""
+
+
+class SharedStateStore:
+    """SQLite 键值存储，值为JSON，可设置过期时间
+
+    update() 在 BEGIN IMMEDIATE 事务中读取-修改-写回，同一时刻只有一个进程能修改，
+    用于跨进程的令牌桶、额度计数和刷新锁；每个线程使用独立连接。
+    其它进程持有写锁时 SQLite 会阻塞等待（最多 timeout 秒），事件循环中应通过 run_async()/submit()
+    在专用线程中执行，按提交顺序依次完成。
+    """
+
+    def __init__(self, path: str, timeout: float = 5.0):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._executor_lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = self._connection()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(_SCHEMA)
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # isolation_level=None：由代码显式控制事务
+            conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        # 单个线程：同一进程内的写入按提交顺序执行，try_lock/unlock 的持有者也保持一致
+        if self._executor is None:
+            with self._executor_lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="shared-state")
+        return self._executor
+
+    async def run_async(self, func: Callable[..., Any], *args, **kwargs) -> Any:
+        """在专用线程中执行会访问存储的函数，不阻塞事件循环"""
+        return await asyncio.get_running_loop().run_in_executor(self._get_executor(), partial(func, *args, **kwargs))
+
+    def submit(self, func: Callable[..., Any], *args, **kwargs) -> Future:
+        """在专用线程中执行、不等待结果（失败时记录日志），用于不影响当前请求的写入"""
+        future = self._get_executor().submit(func, *args, **kwargs)
+        future.add_done_callback(_log_failure)
+        return future
+
+    def get(self, key: str) -> Optional[Any]:
+        """读取未过期的值，不存在时返回 None"""
+        row = self._connection().execute(
+            "SELECT value, expires_at FROM shared_state WHERE key = ?", (key,)).fetchone()
+        if row is None or (row[1] is not None and row[1] < time.time()):
+            return None
+        return json.loads(row[0])
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        self._connection().execute(
+            "INSERT OR REPLACE INTO shared_state (key, value, expires_at) VALUES (?, ?, ?)",
+            (key, json.dumps(value, ensure_ascii=False), time.time() + ttl if ttl else None))
+
+    def delete(self, key: str):
+        self._connection().execute("DELETE FROM shared_state WHERE key = ?", (key,))
+
+    def update(self, key: str, func: Callable[[Optional[Any]], Tuple[Any, Any]], ttl: Optional[float] = None) -> Any:
+        """原子地读取-修改-写回：func(旧值) 返回 (新值, 返回值)，新值为 None 时删除该键，
+        新值就是传入的旧值对象时不写回（保留原过期时间）；func 抛出异常时不做修改"""
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT value, expires_at FROM shared_state WHERE key = ?", (key,)).fetchone()
+            current = None
+            if row is not None and (row[1] is None or row[1] >= time.time()):
+                current = json.loads(row[0])
+            value, result = func(current)
+            if value is current and current is not None:
+                pass
+            elif value is None:
+                conn.execute("DELETE FROM shared_state WHERE key = ?", (key,))
+            else:
+                conn.execute(
+                    "INSERT OR REPLACE INTO shared_state (key, value, expires_at) VALUES (?, ?, ?)",
+                    (key, json.dumps(value, ensure_ascii=False), time.time() + ttl if ttl else None))
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+        return result
+
+    def try_lock(self, key: str, ttl: float) -> bool:
+        """获取跨进程的租约锁（到期自动释放），已被其它进程持有时返回 False"""
+        owner = self._owner()
+        return self.update(key, lambda current: (owner, True) if current in (None, owner) else (current, False), ttl)
+
+    def unlock(self, key: str):
+        """释放本线程持有的租约锁（已过期并被其它进程取得的锁不受影响）"""
+        owner = self._owner()
+        self.update(key, lambda current: (None if current == owner else current, None))
+
+    @staticmethod
+    def _owner() -> str:
+        return f"{os.getpid()}:{threading.get_ident()}"
+
+    def purge_expired(self):
+        self._connection().execute(
+            "DELETE FROM shared_state WHERE expires_at IS NOT NULL AND expires_at < ?", (time.time(),))
+
+
+def _log_failure(future: Future):
+    if not future.cancelled() and future.exception() is not None:
+        logger.warning(f"写入共享状态失败: {str(future.exception())}")
+
+
+def open_shared_state() -> Optional[SharedStateStore]:
+    """按配置打开共享状态存储；OCR_SHARED_STATE_PATH 为空（单进程运行）时返回 None"""
+    if not settings.shared_state_path:
+        return None
+    try:
+        store = SharedStateStore(settings.shared_state_path)
+        store.purge_expired()
+    except sqlite3.Error as e:
+        logger.error(f"打开共享状态存储失败，退回进程内状态 {settings.shared_state_path}: {str(e)}")
+        return None
+    logger.info(f"使用共享状态存储: {settings.shared_state_path}")
+    return store
+
+
+# 全局共享状态存储（未配置时为 None）
+shared_state = open_shared_state()
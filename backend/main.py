@@ -1,10 +1,19 @@
 from contextlib import asynccontextmanager
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
+from fastapi.responses import PlainTextResponse, JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 import uvicorn
+import argparse
+import asyncio
 import logging
+import os
+import tempfile
+import time
 
+from core.config import settings
+from core.metrics import registry, start_request_trace, server_timing_header, monitor_event_loop_lag, HTTP_REQUESTS
 from services.ocr import ocr_manager
+from services.job_queue import job_manager
 from api.router import api_router
 
 from fastapi.staticfiles import StaticFiles
@@ -23,31 +32,69 @@ async def lifespan(app: FastAPI):
     - yield 之后的代码在应用关闭时执行
     """
     # 启动逻辑 (替代原来的 @app.on_event("startup"))
-    logger.info("正在初始化OCR引擎...")
-    try:
-        if not ocr_manager.initialize_engines():
-            logger.error("OCR引擎初始化失败，服务可能无法正常工作")
-        else:
-            logger.info("OCR引擎初始化完成")
-    except Exception as e:
-        logger.error(f"OCR引擎初始化过程中发生错误: {str(e)}")
+    # 引擎在后台并行初始化，服务无需等待即可开始处理请求，可通过 /ready 查看引擎状态
+    logger.info("正在后台初始化OCR引擎...")
+    ocr_manager.start_initialization()
+    # 采样事件循环延迟，通过 /metrics 观察是否有阻塞事件循环的同步调用
+    lag_monitor = None
+    if settings.loop_lag_interval > 0:
+        lag_monitor = asyncio.create_task(monitor_event_loop_lag(settings.loop_lag_interval))
     
     # yield 标志应用已启动完成，可以开始处理请求
     yield
     
     # 关闭逻辑 (替代原来的 @app.on_event("shutdown"))
     logger.info("正在执行清理操作...")
-    # 可以在此添加资源释放等清理代码
+    if lag_monitor is not None:
+        lag_monitor.cancel()
+    await job_manager.aclose()
+    await ocr_manager.aclose()
 
 # 创建FastAPI应用并传入lifespan参数
 app = FastAPI(title="购物小票OCR识别系统", version="1.0.0", lifespan=lifespan)
 app.include_router(api_router, prefix="/api/v1")
+
+@app.middleware("http")
+async def timing_middleware(request: Request, call_next):
+    """记录请求耗时，并通过 Server-Timing 头返回各阶段耗时"""
+    timings = start_request_trace()
+    start = time.perf_counter()
+    response = await call_next(request)
+    elapsed = time.perf_counter() - start
+    route = request.scope.get("route")
+    HTTP_REQUESTS.observe(elapsed, method=request.method, path=getattr(route, "path", None) or "other",
+                          status=response.status_code)
+    if settings.server_timing_enabled:
+        timings.append(("total", elapsed))
+        response.headers["Server-Timing"] = server_timing_header(timings)
+    return response
+
+@app.get("/health", include_in_schema=False)
+async def health():
+    """存活检查：进程能处理请求即返回成功"""
+    return {"status": "ok"}
+
+@app.get("/ready", include_in_schema=False)
+async def ready():
+    """就绪检查：至少一个OCR引擎可用时返回200，否则返回503，并附带各引擎状态"""
+    engines = ocr_manager.get_engine_states()
+    is_ready = bool(ocr_manager.get_available_engines())
+    return JSONResponse(
+        {"ready": is_ready, "default_engine": ocr_manager.default_engine, "engines": engines},
+        status_code=200 if is_ready else 503
+    )
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Prometheus 格式的运行指标"""
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
 # print("注册路由完成")
 # for route in app.routes:
 #     print(f"注册路由: {route.path} - 方法: {route.methods}")
 # print("路由打印完成")
 # 假设你的前端文件放在项目根目录的 frontend 文件夹中
-app.mount("/", StaticFiles(directory="/home/admin/goodtool/frontend", html=True), name="static")
+app.mount("/", StaticFiles(directory=settings.frontend_dir, html=True), name="static")
 # 配置CORS（保持不变）
 app.add_middleware(
     CORSMiddleware,
@@ -60,5 +107,28 @@ app.add_middleware(
 async def root():
     return {"message": "购物小票OCR识别系统已就绪"}
 
+def prepare_workers_env(workers: int):
+    """多进程运行前设置共享状态和磁盘缓存目录（工作进程启动时读取环境变量），未配置时放在临时目录下"""
+    if workers <= 1:
+        return
+    state_dir = os.path.join(tempfile.gettempdir(), "goodtool")
+    os.environ.setdefault("OCR_SHARED_STATE_PATH", os.path.join(state_dir, "shared_state.db"))
+    # 内存缓存各进程独立，磁盘缓存作为各进程共用的一级
+    if not os.environ.get("OCR_CACHE_DIR"):
+        os.environ["OCR_CACHE_DIR"] = os.path.join(state_dir, "ocr_cache")
+    logger.info(f"以 {workers} 个工作进程运行，共享状态: {os.environ['OCR_SHARED_STATE_PATH']}，"
+                f"OCR磁盘缓存: {os.environ['OCR_CACHE_DIR']}")
+
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="购物小票OCR识别系统")
+    parser.add_argument("--host", default=settings.server_host)
+    parser.add_argument("--port", type=int, default=settings.server_port)
+    parser.add_argument("--workers", type=int, default=settings.server_workers,
+                        help="工作进程数，大于1时各进程共享 access_token、限流、额度和OCR磁盘缓存")
+    args = parser.parse_args()
+    if args.workers > 1:
+        prepare_workers_env(args.workers)
+        # 多进程模式需要以导入路径启动，各工作进程重新导入应用
+        uvicorn.run("main:app", host=args.host, port=args.port, workers=args.workers)
+    else:
+        uvicorn.run(app, host=args.host, port=args.port)
\ No newline at end of file
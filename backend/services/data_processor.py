@@ -1 +1,84 @@
-# 数据结构化处理
\ No newline at end of file
+# 数据结构化处理
+from typing import List, Dict, Any, Optional
+import logging
+
+from core.config import settings
+from services.dedup import TransactionIndex, mark_duplicate, DUPLICATE_IMAGE, DUPLICATE_TRANSACTION
+
+logger = logging.getLogger(__name__)
+
+
+def receipt_rows(result: Dict[str, Any], index: int) -> List[Dict[str, Any]]:
+    """单张图片的解析结果展开为支付表格的行（每个商品一行，附带来源和交易信息）"""
+    parsed = result.get("parsed") or {}
+    rows = []
+    for item in parsed.get("items", []):
+        row = dict(item)
+        row["source_file"] = result.get("file")
+        row["source_index"] = index
+        row["store_name"] = parsed.get("store_name")
+        row["transaction_date"] = parsed.get("transaction_date")
+        row["transaction_time"] = parsed.get("transaction_time")
+        rows.append(row)
+    return rows
+
+
+def new_transaction_index() -> Optional[TransactionIndex]:
+    """每次合并/每个流式请求使用一个交易索引（OCR_DEDUP_ENABLED 关闭时为 None）"""
+    return TransactionIndex() if settings.dedup_enabled else None
+
+
+def check_duplicate_transaction(transactions: Optional[TransactionIndex], index: int, result: Dict[str, Any]) -> bool:
+    """识别成功的结果与已登记的交易比对，是同一笔交易时标记为重复并返回 True
+
+    流式接口按完成顺序逐个调用，推送行之前即可排除重复的交易；已标记为重复的结果在最终合并时直接跳过。
+    """
+    if transactions is None or result.get("status") != "ok":
+        return False
+    original = transactions.find_or_add(index, result.get("parsed") or {})
+    if original is None:
+        return False
+    # 交易比对确认了OCR前的外观相近提示时，视为同一张图片的重复上传
+    reason = DUPLICATE_IMAGE if result.get("similar_to") == original else DUPLICATE_TRANSACTION
+    mark_duplicate(result, original, reason)
+    return True
+
+
+def merge_receipt_results(results: List[Dict[str, Any]], indices: Optional[List[int]] = None) -> Dict[str, Any]:
+    """将多张图片的识别结果合并为一张支付表格
+
+    每条结果格式: {"file": 文件名, "status": "ok"/"error"/"duplicate", "parsed": 解析结果, ...}
+    按上传顺序合并，同一笔交易（如小票和对应的支付截图）只保留先出现的一条，其余标记为重复。
+    indices 为各结果的上传序号（如取消的任务只有部分结果），用于行的 source_index 和 duplicate_of，默认为列表位置。
+    """
+    rows = []
+    total_amount = 0.0
+    succeeded = 0
+    duplicates = 0
+    transactions = new_transaction_index()
+
+    for index, result in zip(range(len(results)) if indices is None else indices, results):
+        check_duplicate_transaction(transactions, index, result)
+        status = result.get("status")
+        if status == "duplicate":
+            duplicates += 1
+            continue
+        if status != "ok":
+            continue
+        succeeded += 1
+        parsed = result.get("parsed") or {}
+        rows.extend(receipt_rows(result, index))
+        if parsed.get("total_amount") is not None:
+            total_amount += parsed["total_amount"]
+
+    return {
+        "rows": rows,
+        "summary": {
+            "total_files": len(results),
+            "succeeded": succeeded,
+            "duplicates": duplicates,
+            "failed": len(results) - succeeded - duplicates,
+            "row_count": len(rows),
+            "total_amount": round(total_amount, 2),
+        },
+    }
@@ -0,0 +1,198 @@
+# 批量去重：OCR前跳过内容完全相同的图片（感知哈希相近只作为提示），解析后按交易指纹合并同一笔支付
+from typing import Dict, List, Any, Optional, Tuple
+import asyncio
+import io
+import logging
+import re
+
+from core.config import settings
+from core.metrics import registry, Counter
+from services.ocr.base_ocr import get_ocr_executor
+from utils.helpers import UploadedImage
+
+logger = logging.getLogger(__name__)
+
+DEDUP_EVENTS = registry.register(Counter(
+    "gootool_dedup_total", "批量识别中检出的重复图片/重复交易数", ("kind",)))
+
+# 重复原因
+DUPLICATE_IMAGE = "image"
+DUPLICATE_TRANSACTION = "transaction"
+
+# dHash：缩放为 9x8 灰度图，比较相邻像素，得到64位哈希
+HASH_WIDTH = 9
+HASH_HEIGHT = 8
+HASH_BITS = (HASH_WIDTH - 1) * HASH_HEIGHT
+
+UNKNOWN_MERCHANTS = {"未知商店", "未知商户"}
+
+
+def image_dhash(data: bytes) -> Optional[int]:
+    """计算图片的差值哈希（dHash），无法解码时返回 None"""
+    from PIL import Image
+
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            # JPEG 可按比例缩小解码，避免解码整张大图
+            image.draft("L", (HASH_WIDTH * 16, HASH_HEIGHT * 16))
+            small = image.convert("L").resize((HASH_WIDTH, HASH_HEIGHT), Image.BILINEAR)
+    except Exception as e:
+        logger.debug(f"计算图片哈希失败: {str(e)}")
+        return None
+    pixels = list(small.getdata())
+    value = 0
+    for row in range(HASH_HEIGHT):
+        offset = row * HASH_WIDTH
+        for col in range(HASH_WIDTH - 1):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+class ImageHashIndex:
+    """感知哈希的分段索引：汉明距离不超过 max_distance 的两个哈希，
+    分成 max_distance+1 段后至少有一段完全相同（抽屉原理），因此只需比较同段桶内的候选"""
+
+    def __init__(self, max_distance: int = 3):
+        self.max_distance = max(0, max_distance)
+        bands = self.max_distance + 1
+        width = HASH_BITS // bands
+        self._bands = [(i * width, (1 << width) - 1 if i < bands - 1 else (1 << (HASH_BITS - i * width)) - 1)
+                       for i in range(bands)]
+        self._buckets: Dict[Tuple[int, int], List[Tuple[int, Any]]] = {}
+
+    def find_or_add(self, key: Any, value: int) -> Optional[Any]:
+        """返回已登记的近似哈希对应的 key；没有时登记当前哈希并返回 None"""
+        band_keys = [(i, (value >> shift) & mask) for i, (shift, mask) in enumerate(self._bands)]
+        for band_key in band_keys:
+            for other_value, other_key in self._buckets.get(band_key, ()):
+                if bin(value ^ other_value).count("1") <= self.max_distance:
+                    return other_key
+        for band_key in band_keys:
+            self._buckets.setdefault(band_key, []).append((value, key))
+        return None
+
+
+class ImageDeduplicator:
+    """一批图片的OCR前去重：只有内容哈希完全相同的图片才跳过OCR
+
+    感知哈希相近的图片可能是重新压缩的同一张图，也可能是同一模板的两张不同支付截图
+    （商户、金额、时间不同，dHash 距离同样很小），因此只作为提示，由解析后的交易比对确认。
+    """
+
+    def __init__(self, max_distance: Optional[int] = None):
+        self._digests: Dict[str, int] = {}
+        self._hashes = ImageHashIndex(settings.dedup_image_distance if max_distance is None else max_distance)
+
+    async def check(self, index: int, upload: UploadedImage) -> Tuple[Optional[int], Optional[int]]:
+        """返回 (内容完全相同的图片序号, 感知哈希相近的图片序号)；前者不为 None 时无需识别"""
+        original = self._digests.get(upload.sha256)
+        if original is not None:
+            DEDUP_EVENTS.inc(kind=DUPLICATE_IMAGE)
+            return original, None
+        self._digests[upload.sha256] = index
+        loop = asyncio.get_running_loop()
+        value = await loop.run_in_executor(get_ocr_executor(), image_dhash, upload.data)
+        if value is None:
+            return None, None
+        return None, self._hashes.find_or_add(index, value)
+
+
+_DATE_PARTS_RE = re.compile(r"(\d{4})[-/年](\d{1,2})[-/月](\d{1,2})|(\d{1,2})[-/](\d{1,2})[-/](\d{4})")
+_TIME_PARTS_RE = re.compile(r"(\d{1,2}):(\d{2})")
+# 比较商户名前去掉括号内容、常见后缀和空白
+_MERCHANT_NOISE_RE = re.compile(r"[（(][^）)]*[）)]|股份有限公司|有限责任公司|有限公司|公司|分店|门店|\s")
+
+
+def _normalize_date(text: Optional[str]) -> Optional[Tuple[int, int, int]]:
+    match = _DATE_PARTS_RE.search(text) if text else None
+    if not match:
+        return None
+    if match.group(1):
+        return int(match.group(1)), int(match.group(2)), int(match.group(3))
+    return int(match.group(6)), int(match.group(4)), int(match.group(5))
+
+
+def _normalize_minutes(text: Optional[str]) -> Optional[int]:
+    match = _TIME_PARTS_RE.search(text) if text else None
+    return int(match.group(1)) * 60 + int(match.group(2)) if match else None
+
+
+def _merchant_bigrams(name: Optional[str]) -> Optional[frozenset]:
+    if not name or name in UNKNOWN_MERCHANTS:
+        return None
+    cleaned = _MERCHANT_NOISE_RE.sub("", name).lower()
+    if not cleaned:
+        return None
+    return frozenset(cleaned[i:i + 2] for i in range(max(1, len(cleaned) - 1)))
+
+
+class _Transaction:
+    __slots__ = ("index", "source", "date", "minutes", "merchant", "transaction_id")
+
+    def __init__(self, index: int, parsed: Dict[str, Any]):
+        self.index = index
+        self.source = parsed.get("source") or "receipt"
+        self.date = _normalize_date(parsed.get("transaction_date"))
+        self.minutes = _normalize_minutes(parsed.get("transaction_time"))
+        self.merchant = _merchant_bigrams(parsed.get("store_name"))
+        self.transaction_id = parsed.get("transaction_id")
+
+
+class TransactionIndex:
+    """按金额分桶的交易指纹索引，每笔交易只与金额相同的交易比较
+
+    金额相同且日期/时间吻合、商户名相近时视为同一笔支付（如超市小票和对应的微信支付截图）；
+    同一来源的两张单据要求时间精确到分钟一致，交易单号不同的一定不是同一笔。
+    """
+
+    def __init__(self, time_window: Optional[float] = None):
+        window = settings.dedup_time_window if time_window is None else time_window
+        self.time_window_minutes = window / 60.0
+        self._by_amount: Dict[int, List[_Transaction]] = {}
+
+    def find_or_add(self, index: int, parsed: Dict[str, Any]) -> Optional[int]:
+        """返回与之重复的结果序号，不重复时登记并返回 None"""
+        amount = parsed.get("total_amount")
+        if amount is None:
+            return None
+        transaction = _Transaction(index, parsed)
+        # 没有日期和时间时无法区分两笔同金额的消费，不参与去重
+        if transaction.date is None and transaction.minutes is None:
+            return None
+        bucket = self._by_amount.setdefault(round(amount * 100), [])
+        for other in bucket:
+            if self._same(transaction, other):
+                DEDUP_EVENTS.inc(kind=DUPLICATE_TRANSACTION)
+                return other.index
+        bucket.append(transaction)
+        return None
+
+    def _same(self, a: _Transaction, b: _Transaction) -> bool:
+        if a.transaction_id and b.transaction_id:
+            return a.transaction_id == b.transaction_id
+        compared = False
+        if a.date is not None and b.date is not None:
+            if a.date != b.date:
+                return False
+            compared = True
+        if a.minutes is not None and b.minutes is not None:
+            window = 0 if a.source == b.source else self.time_window_minutes
+            if abs(a.minutes - b.minutes) > window:
+                return False
+            compared = True
+        elif a.source == b.source:
+            # 同一来源缺少时间时无法区分同一天同金额的两笔消费
+            return False
+        if not compared:
+            return False
+        if a.merchant is not None and b.merchant is not None:
+            overlap = len(a.merchant & b.merchant)
+            return overlap / min(len(a.merchant), len(b.merchant)) >= 0.5
+        return True
+
+
+def mark_duplicate(result: Dict[str, Any], original: int, reason: str):
+    """把结果标记为重复：不计入支付表格和合计"""
+    result["status"] = "duplicate"
+    result["duplicate_of"] = original
+    result["duplicate_reason"] = reason
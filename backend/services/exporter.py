@@ -0,0 +1,269 @@
+# 支付表格导出：CSV / XLSX，逐行写出并分块返回，内存占用与行数无关
+from typing import AsyncIterator, Iterable, List, Dict, Any, Optional, Tuple
+from xml.sax.saxutils import escape
+import csv
+import io
+import re
+import zipfile
+
+from core.config import settings
+from services.data_processor import receipt_rows
+from services.dedup import TransactionIndex, mark_duplicate, DUPLICATE_TRANSACTION
+
+# 可导出的列及表头（按导出顺序）
+EXPORT_COLUMNS = {
+    "name": "商品名称",
+    "quantity": "数量",
+    "price": "单价",
+    "total_price": "总价",
+    "store_name": "商店名称",
+    "transaction_date": "交易日期",
+    "transaction_time": "交易时间",
+    "source_file": "来源文件",
+}
+# 前端列选择器使用的列名
+COLUMN_ALIASES = {"item_name": "name", "unit_price": "price"}
+DEFAULT_EXPORT_COLUMNS = ["name", "quantity", "price", "total_price", "store_name", "transaction_date",
+                          "transaction_time", "source_file"]
+
+EXPORT_MEDIA_TYPES = {
+    "csv": "text/csv; charset=utf-8",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+}
+
+# 累积到该大小后交给响应发送
+FLUSH_BYTES = 64 * 1024
+
+
+def resolve_export_columns(columns: Optional[List[str]]) -> List[str]:
+    """用户选择的列（可逗号分隔）换算为导出列，忽略无法导出的列；未选择或都无法导出时导出全部列"""
+    if not columns:
+        return list(DEFAULT_EXPORT_COLUMNS)
+    resolved = []
+    for column in columns:
+        for name in column.split(","):
+            name = COLUMN_ALIASES.get(name.strip(), name.strip())
+            if name in EXPORT_COLUMNS and name not in resolved:
+                resolved.append(name)
+    return resolved or list(DEFAULT_EXPORT_COLUMNS)
+
+
+def _row_values(row: Dict[str, Any], columns: List[str]) -> List[Any]:
+    values = []
+    for column in columns:
+        if column == "total_price":
+            price = row.get("price")
+            values.append(round(price * row.get("quantity", 1), 2) if price is not None else None)
+        else:
+            values.append(row.get(column))
+    return values
+
+
+# 以这些字符开头的文本会被表格软件当作公式执行（CSV注入）
+_FORMULA_PREFIXES = ("=", "+", "-", "@", "\t", "\r")
+
+
+def _csv_cell(value: Any) -> Any:
+    if value is None:
+        return ""
+    if isinstance(value, str) and value.startswith(_FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+class CSVStreamWriter:
+    """CSV 写出器，带 UTF-8 BOM 以便 Excel 正确识别中文"""
+
+    def __init__(self):
+        self._buffer = io.StringIO()
+        self._writer = csv.writer(self._buffer)
+        self._buffer.write("\ufeff")
+
+    def write_row(self, values: List[Any]):
+        self._writer.writerow([_csv_cell(value) for value in values])
+
+    @property
+    def pending_bytes(self) -> int:
+        return self._buffer.tell()
+
+    def drain(self) -> bytes:
+        data = self._buffer.getvalue().encode("utf-8")
+        self._buffer.seek(0)
+        self._buffer.truncate()
+        return data
+
+    def close(self):
+        pass
+
+
+class _ChunkSink:
+    """供 ZipFile 写入的只追加缓冲区（不支持 seek，ZipFile 会改用数据描述符，无需回写文件头）"""
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+        self.size = 0
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        self.size += len(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        self.size = 0
+        return data
+
+
+# 控制字符在XML中非法，OCR文本中偶尔会出现
+_XML_ILLEGAL_RE = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+_XLSX_STATIC_PARTS = {
+    "[Content_Types].xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '</Types>'
+    ),
+    "_rels/.rels": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+        'Target="xl/workbook.xml"/>'
+        '</Relationships>'
+    ),
+    "xl/workbook.xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        '<sheets><sheet name="支付表格" sheetId="1" r:id="rId1"/></sheets>'
+        '</workbook>'
+    ),
+    "xl/_rels/workbook.xml.rels": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+        'Target="worksheets/sheet1.xml"/>'
+        '</Relationships>'
+    ),
+}
+
+
+def _column_letter(index: int) -> str:
+    letters = ""
+    index += 1
+    while index:
+        index, remainder = divmod(index - 1, 26)
+        letters = chr(65 + remainder) + letters
+    return letters
+
+
+class XLSXStreamWriter:
+    """最小的 XLSX 写出器：工作表XML边生成边压缩写入ZIP，字符串使用内联格式（无共享字符串表）"""
+
+    def __init__(self, column_count: int):
+        self._sink = _ChunkSink()
+        self._zip = zipfile.ZipFile(self._sink, mode="w", compression=zipfile.ZIP_DEFLATED)
+        for name, content in _XLSX_STATIC_PARTS.items():
+            self._zip.writestr(name, content)
+        self._sheet = self._zip.open("xl/worksheets/sheet1.xml", mode="w", force_zip64=True)
+        self._letters = [_column_letter(i) for i in range(column_count)]
+        self._row = 0
+        self._sheet.write(
+            b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+            b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+        )
+
+    def write_row(self, values: List[Any]):
+        self._row += 1
+        row = self._row
+        cells = []
+        for letter, value in zip(self._letters, values):
+            if value is None or value == "":
+                continue
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                cells.append(f'<c r="{letter}{row}"><v>{value}</v></c>')
+            else:
+                text = escape(_XML_ILLEGAL_RE.sub("", str(value)))
+                cells.append(f'<c r="{letter}{row}" t="inlineStr"><is><t>{text}</t></is></c>')
+        self._sheet.write(f'<row r="{row}">{"".join(cells)}</row>'.encode("utf-8"))
+
+    @property
+    def pending_bytes(self) -> int:
+        return self._sink.size
+
+    def drain(self) -> bytes:
+        return self._sink.drain()
+
+    def close(self):
+        self._sheet.write(b"</sheetData></worksheet>")
+        self._sheet.close()
+        self._zip.close()
+
+
+def _make_writer(fmt: str, column_count: int):
+    if fmt == "xlsx":
+        return XLSXStreamWriter(column_count)
+    return CSVStreamWriter()
+
+
+async def stream_export(results: AsyncIterator[Tuple[int, Dict[str, Any]]], fmt: str,
+                        columns: List[str]) -> AsyncIterator[bytes]:
+    """按结果到达顺序逐行写出支付表格，末尾附合计行
+
+    results 逐个产生 (图片序号, 识别结果)，结果格式同 receipt_pipeline.process_image；
+    与 merge_receipt_results 一样，重复的交易只写出先出现的一条。
+    """
+    writer = _make_writer(fmt, len(columns))
+    writer.write_row([EXPORT_COLUMNS[column] for column in columns])
+    items_total = 0.0
+    receipts_total = 0.0
+    transactions = TransactionIndex() if settings.dedup_enabled else None
+    async for index, result in results:
+        if result.get("status") != "ok":
+            continue
+        parsed = result.get("parsed") or {}
+        if transactions is not None:
+            original = transactions.find_or_add(index, parsed)
+            if original is not None:
+                mark_duplicate(result, original, DUPLICATE_TRANSACTION)
+                continue
+        if parsed.get("total_amount") is not None:
+            receipts_total += parsed["total_amount"]
+        for row in receipt_rows(result, index):
+            items_total += row.get("price", 0) * row.get("quantity", 1)
+            writer.write_row(_row_values(row, columns))
+            if writer.pending_bytes >= FLUSH_BYTES:
+                yield writer.drain()
+
+    # 合计行：商品金额合计与各小票总额之和，写在金额列（没有金额列时写在第二列）
+    amount_column = min(1, len(columns) - 1)
+    for candidate in ("price", "total_price"):
+        if candidate in columns:
+            amount_column = columns.index(candidate)
+    for label, amount in (("商品合计", items_total), ("小票总额", receipts_total)):
+        values: List[Any] = [None] * len(columns)
+        values[0] = label
+        if amount_column == 0:
+            values[0] = f"{label} {round(amount, 2)}"
+        else:
+            values[amount_column] = round(amount, 2)
+        writer.write_row(values)
+    writer.close()
+    yield writer.drain()
+
+
+async def iterate_results(results: Iterable[Tuple[int, Dict[str, Any]]]) -> AsyncIterator[Tuple[int, Dict[str, Any]]]:
+    """把已有的结果列表包装为 stream_export 所需的异步迭代器"""
+    for item in results:
+        yield item
@@ -0,0 +1,131 @@
+# 图片预处理：在送入OCR引擎前缩小并重新压缩上传的图片
+from typing import Dict, Any, Optional, Tuple
+import io
+import logging
+from PIL import Image, ImageOps
+
+from core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# EXIF 中的方向标签
+_EXIF_ORIENTATION = 0x0112
+
+
+class PreprocessResult:
+    """预处理结果"""
+    def __init__(self, data: bytes, original_bytes: int, width: int, height: int, changed: bool):
+        self.data = data
+        self.original_bytes = original_bytes
+        self.processed_bytes = len(data)
+        self.width = width
+        self.height = height
+        self.changed = changed
+
+    @property
+    def bytes_saved(self) -> int:
+        return self.original_bytes - self.processed_bytes
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "original_bytes": self.original_bytes,
+            "processed_bytes": self.processed_bytes,
+            "bytes_saved": self.bytes_saved,
+            "width": self.width,
+            "height": self.height,
+            "changed": self.changed
+        }
+
+
+class ImagePreprocessor:
+    """解码一次，自动旋转、限制长边、灰度化，再编码为不超过大小上限的JPEG"""
+
+    def __init__(self, enabled: bool = True, max_long_edge: int = 2560, grayscale: bool = True,
+                 jpeg_quality: int = 85, min_jpeg_quality: int = 50, max_bytes: int = 2 * 1024 * 1024):
+        self.enabled = enabled
+        self.max_long_edge = max_long_edge
+        self.grayscale = grayscale
+        self.jpeg_quality = jpeg_quality
+        self.min_jpeg_quality = min_jpeg_quality
+        self.max_bytes = max_bytes
+
+    def signature(self) -> Dict[str, Any]:
+        """影响输出结果的参数，用于区分不同配置下的缓存"""
+        if not self.enabled:
+            return {}
+        return {
+            "long_edge": self.max_long_edge,
+            "gray": self.grayscale,
+            "quality": self.jpeg_quality,
+            "max_bytes": self.max_bytes
+        }
+
+    def output_size(self, size: Tuple[int, int], limits: Optional[Dict[str, Any]] = None) -> Tuple[int, int]:
+        """按 process 的缩放规则估算预处理后的尺寸（缓存命中时没有预处理信息，用于换算文字框坐标）"""
+        limits = limits or {}
+        max_long_edge = min(v for v in (self.max_long_edge, limits.get("max_long_edge")) if v)
+        if max(size) <= max_long_edge:
+            return size
+        scale = max_long_edge / max(size)
+        return max(1, round(size[0] * scale)), max(1, round(size[1] * scale))
+
+    def process(self, image_data: bytes, limits: Optional[Dict[str, Any]] = None) -> PreprocessResult:
+        """预处理图片；limits 为引擎限制（max_image_bytes / max_long_edge），取与本地配置中更严格的值"""
+        limits = limits or {}
+        max_long_edge = min(v for v in (self.max_long_edge, limits.get("max_long_edge")) if v)
+        max_bytes = min(v for v in (self.max_bytes, limits.get("max_image_bytes")) if v)
+
+        img = Image.open(io.BytesIO(image_data))
+        original_size = img.size
+        needs_rotate = img.getexif().get(_EXIF_ORIENTATION, 1) != 1
+        oversized = max(original_size) > max_long_edge
+
+        if not self.enabled and not oversized and len(image_data) <= max_bytes:
+            return PreprocessResult(image_data, len(image_data), *original_size, changed=False)
+
+        # JPEG 可以在解码时直接降采样，减少解码开销
+        if img.format == "JPEG" and oversized:
+            scale = max_long_edge / max(original_size)
+            img.draft("L" if self.grayscale else "RGB",
+                      (int(original_size[0] * scale), int(original_size[1] * scale)))
+        img = ImageOps.exif_transpose(img)
+        img = img.convert("L" if self.grayscale else "RGB")
+        if max(img.size) > max_long_edge:
+            img.thumbnail((max_long_edge, max_long_edge), Image.LANCZOS)
+
+        # 为满足大小上限可能进一步缩小尺寸，结果中的尺寸以实际编码的图片为准
+        data, size = self._encode(img, max_bytes)
+        # 原图已满足限制且重新编码没有变小时保留原图
+        if len(data) >= len(image_data) and not needs_rotate and not oversized and len(image_data) <= max_bytes:
+            return PreprocessResult(image_data, len(image_data), *original_size, changed=False)
+
+        result = PreprocessResult(data, len(image_data), *size, changed=True)
+        logger.info(f"图片预处理: {original_size} -> {size}, "
+                    f"{result.original_bytes} -> {result.processed_bytes} 字节 (节省 {result.bytes_saved})")
+        return result
+
+    def _encode(self, img: Image.Image, max_bytes: int) -> Tuple[bytes, Tuple[int, int]]:
+        """逐步降低质量（必要时缩小尺寸）直到JPEG大小不超过上限，返回编码结果和最终尺寸"""
+        quality = self.jpeg_quality
+        while True:
+            buf = io.BytesIO()
+            img.save(buf, format="JPEG", quality=quality, optimize=True)
+            if buf.tell() <= max_bytes:
+                return buf.getvalue(), img.size
+            if quality > self.min_jpeg_quality:
+                quality = max(self.min_jpeg_quality, quality - 10)
+            elif min(img.size) > 64:
+                img = img.resize((int(img.width * 0.75), int(img.height * 0.75)), Image.LANCZOS)
+            else:
+                return buf.getvalue(), img.size
+
+
+# 全局预处理器实例
+image_preprocessor = ImagePreprocessor(
+    enabled=settings.preprocess_enabled,
+    max_long_edge=settings.preprocess_max_long_edge,
+    grayscale=settings.preprocess_grayscale,
+    jpeg_quality=settings.preprocess_jpeg_quality,
+    min_jpeg_quality=settings.preprocess_min_jpeg_quality,
+    max_bytes=settings.preprocess_max_bytes
+)
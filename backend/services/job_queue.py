@@ -0,0 +1,362 @@
+# 后台识别任务：提交后立即返回任务ID，由本地工作协程识别，客户端轮询进度和结果
+# 多进程运行时任务快照写入共享存储，轮询请求落到其它工作进程也能查到进度和结果
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, FrozenSet, List, Any, Optional, Tuple
+import asyncio
+import logging
+import time
+import uuid
+
+from core.config import settings
+from core.metrics import registry, Counter, clear_request_trace
+from core.shared_state import shared_state
+from services.ocr import PRIORITY_BATCH
+from services.receipt_pipeline import process_image, new_deduplicator, TABLE_FIELDS
+from services.data_processor import merge_receipt_results
+from utils.helpers import UploadedImage
+
+logger = logging.getLogger(__name__)
+
+JOB_EVENTS = registry.register(Counter(
+    "gootool_ocr_jobs_total", "后台识别任务数（按提交/完成/取消/拒绝统计）", ("event",)))
+
+# 任务状态
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_CANCELLED = "cancelled"
+
+# 任务进行中时写入共享存储的最小间隔（秒），状态变化时立即写入
+JOB_PUBLISH_INTERVAL = 1.0
+
+
+class JobQueueFullError(Exception):
+    """未完成的任务数或排队图片总大小已达上限"""
+    pass
+
+
+class Job:
+    """一次批量识别任务；图片在识别完成后即释放，只保留解析结果"""
+
+    def __init__(self, job_id: str, engine: str, uploads: List[UploadedImage],
+                 rejected: Optional[Dict[int, Dict[str, Any]]] = None, fields: FrozenSet[str] = TABLE_FIELDS):
+        self.id = job_id
+        self.engine = engine
+        self.fields = fields
+        # 同一任务内重复的图片不调用OCR
+        self.dedup = new_deduplicator()
+        self.status = JOB_QUEUED
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.total = len(uploads) + len(rejected or {})
+        self.files: List[Optional[str]] = [None] * self.total
+        # 按上传顺序保存每张图片的结果，未完成的为 None
+        self.results: List[Optional[Dict[str, Any]]] = [None] * self.total
+        self.completed = 0
+        self.succeeded = 0
+        self.duplicates = 0
+        # 任务结束时合并一次的支付表格（格式同 merge_receipt_results）
+        self.merged: Optional[Dict[str, Any]] = None
+        self.pending: Deque[Tuple[int, UploadedImage]] = deque()
+        self.queued_bytes = 0
+
+        uploads_iter = iter(uploads)
+        for index in range(self.total):
+            if rejected and index in rejected:
+                self.files[index] = rejected[index]["file"]
+                self._record(index, rejected[index])
+            else:
+                upload = next(uploads_iter)
+                self.files[index] = upload.filename
+                self.pending.append((index, upload))
+                self.queued_bytes += upload.size
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (JOB_DONE, JOB_CANCELLED)
+
+    def _record(self, index: int, result: Dict[str, Any]):
+        self.results[index] = result
+        self.completed += 1
+        if result.get("status") == "ok":
+            self.succeeded += 1
+        elif result.get("status") == "duplicate":
+            self.duplicates += 1
+        if self.completed >= self.total and not self.finished:
+            self.finish(JOB_DONE)
+
+    def finish(self, status: str):
+        """结束任务并按上传序号合并已完成的结果；合并时标记的重复交易同步到进度统计"""
+        self.status = status
+        self.finished_at = time.time()
+        indices, results = [], []
+        for index, result in self.completed_results():
+            indices.append(index)
+            results.append(result)
+        self.merged = merge_receipt_results(results, indices)
+        self.succeeded = self.merged["summary"]["succeeded"]
+        self.duplicates = self.merged["summary"]["duplicates"]
+
+    def progress(self) -> Dict[str, Any]:
+        return {
+            "total": self.total,
+            "completed": self.completed,
+            "succeeded": self.succeeded,
+            "duplicates": self.duplicates,
+            "failed": self.completed - self.succeeded - self.duplicates,
+            "percent": round(self.completed * 100.0 / self.total, 1) if self.total else 100.0
+        }
+
+    def completed_results(self) -> List[Tuple[int, Dict[str, Any]]]:
+        """已完成的结果（含序号），用于返回部分结果"""
+        return [(index, result) for index, result in enumerate(self.results) if result is not None]
+
+    def to_record(self) -> Dict[str, Any]:
+        """写入共享存储的快照（不含待识别的图片）"""
+        return {
+            "id": self.id, "engine": self.engine, "status": self.status,
+            "created_at": self.created_at, "started_at": self.started_at, "finished_at": self.finished_at,
+            "files": self.files, "results": self.results,
+            "completed": self.completed, "succeeded": self.succeeded, "duplicates": self.duplicates,
+            "merged": self.merged
+        }
+
+    @classmethod
+    def from_record(cls, record: Dict[str, Any]) -> "Job":
+        """由其它进程写入的快照还原出只读的任务"""
+        job = cls.__new__(cls)
+        job.id = record["id"]
+        job.engine = record["engine"]
+        job.fields = TABLE_FIELDS
+        job.dedup = None
+        job.status = record["status"]
+        job.created_at = record["created_at"]
+        job.started_at = record["started_at"]
+        job.finished_at = record["finished_at"]
+        job.files = record["files"]
+        job.results = record["results"]
+        job.total = len(job.results)
+        job.completed = record["completed"]
+        job.succeeded = record["succeeded"]
+        job.duplicates = record["duplicates"]
+        job.merged = record.get("merged")
+        job.pending = deque()
+        job.queued_bytes = 0
+        return job
+
+
+class JobManager:
+    """内存中的任务表 + 工作协程池
+
+    各任务的图片轮流分配给工作协程，大任务不会阻塞其它用户后提交的小任务；
+    完成的任务在 ttl 秒后（或保留数超过上限时）被清除。
+    传入 shared 时任务快照写入共享存储：任务仍由提交它的进程识别，其它进程可以查询和取消。
+    """
+
+    def __init__(self, workers: int = 8, ttl: float = 3600.0, max_active: int = 20,
+                 max_queued_bytes: int = 512 * 1024 * 1024, max_retained: int = 200,
+                 processor: Callable[..., Awaitable[Dict[str, Any]]] = process_image, shared=None):
+        self.workers = max(1, workers)
+        self.ttl = ttl
+        self.max_active = max_active
+        self.max_queued_bytes = max_queued_bytes
+        self.max_retained = max_retained
+        self._processor = processor
+        self._shared = shared
+        self._published: Dict[str, float] = {}
+        self._cancel_checked: Dict[str, float] = {}
+        self._jobs: Dict[str, Job] = {}
+        # 还有待识别图片的任务，按轮转顺序排列
+        self._ready: Deque[Job] = deque()
+        self._queued_bytes = 0
+        self._wakeup: Optional[asyncio.Event] = None
+        self._worker_tasks: List[asyncio.Task] = []
+
+    def submit(self, uploads: List[UploadedImage], engine: str,
+               rejected: Optional[Dict[int, Dict[str, Any]]] = None, fields: FrozenSet[str] = TABLE_FIELDS) -> Job:
+        """创建任务并排队；rejected 为读取阶段已失败的图片 {序号: 错误结果}，fields 为需要提取的字段"""
+        self._evict_expired()
+        active = sum(1 for job in self._jobs.values() if not job.finished)
+        size = sum(upload.size for upload in uploads)
+        if active >= self.max_active or self._queued_bytes + size > self.max_queued_bytes:
+            JOB_EVENTS.inc(event="rejected")
+            raise JobQueueFullError("当前排队的识别任务过多，请稍后再试")
+
+        job = Job(uuid.uuid4().hex, engine, uploads, rejected, fields)
+        self._jobs[job.id] = job
+        self._publish(job, force=True)
+        JOB_EVENTS.inc(event="submitted")
+        if job.pending:
+            self._queued_bytes += job.queued_bytes
+            self._ready.append(job)
+            self._ensure_workers()
+            self._wakeup.set()
+        else:
+            JOB_EVENTS.inc(event="done")
+        logger.info(f"任务 {job.id} 已提交: {job.total} 张图片, engine={engine}")
+        return job
+
+    async def get(self, job_id: str) -> Optional[Job]:
+        self._evict_expired()
+        job = self._jobs.get(job_id)
+        if job is None and self._shared is not None:
+            record = await self._shared.run_async(self._shared.get, f"job:{job_id}")
+            job = Job.from_record(record) if record else None
+        return job
+
+    async def cancel(self, job_id: str) -> Optional[Job]:
+        """取消任务：丢弃尚未开始识别的图片，已完成的结果保留"""
+        job = self._jobs.get(job_id)
+        if job is None:
+            return await self._cancel_remote(job_id)
+        self._cancel_local(job)
+        return job
+
+    def _cancel_local(self, job: Job):
+        if job.finished:
+            return
+        self._release(job)
+        job.finish(JOB_CANCELLED)
+        self._publish(job, force=True)
+        JOB_EVENTS.inc(event="cancelled")
+
+    async def _cancel_remote(self, job_id: str) -> Optional[Job]:
+        """取消其它进程中的任务：写入取消标记，由该进程在取下一张图片时处理"""
+        job = await self.get(job_id)
+        if job is None or job.finished:
+            return job
+        await self._shared.run_async(self._shared.set, f"job:{job_id}:cancel", True, ttl=self.ttl)
+        job.status = JOB_CANCELLED
+        return job
+
+    def _publish(self, job: Job, force: bool = False):
+        """把任务快照写入共享存储（在存储线程中按顺序写入，不等待）；进行中的任务按最小间隔限频"""
+        if self._shared is None:
+            return
+        now = time.monotonic()
+        if not force and not job.finished and now - self._published.get(job.id, 0.0) < JOB_PUBLISH_INTERVAL:
+            return
+        self._published[job.id] = now
+        try:
+            self._shared.submit(self._shared.set, f"job:{job.id}", job.to_record(), ttl=self.ttl)
+        except Exception as e:
+            logger.warning(f"写入任务 {job.id} 快照失败: {str(e)}")
+
+    async def _cancel_requested(self, job: Job) -> bool:
+        """检查其它进程写入的取消标记（每个任务按最小间隔检查）"""
+        if self._shared is None:
+            return False
+        now = time.monotonic()
+        if now - self._cancel_checked.get(job.id, 0.0) < JOB_PUBLISH_INTERVAL:
+            return False
+        self._cancel_checked[job.id] = now
+        try:
+            return bool(await self._shared.run_async(self._shared.get, f"job:{job.id}:cancel"))
+        except Exception as e:
+            logger.warning(f"读取任务 {job.id} 取消标记失败: {str(e)}")
+            return False
+
+    def stats(self) -> Dict[str, Any]:
+        by_status: Dict[str, int] = {}
+        for job in self._jobs.values():
+            by_status[job.status] = by_status.get(job.status, 0) + 1
+        return {
+            "jobs": by_status,
+            "queued_images": sum(len(job.pending) for job in self._ready),
+            "queued_bytes": self._queued_bytes,
+            "workers": len(self._worker_tasks),
+            "shared": self._shared is not None
+        }
+
+    def _release(self, job: Job):
+        self._queued_bytes -= job.queued_bytes
+        job.queued_bytes = 0
+        job.pending.clear()
+
+    def _ensure_workers(self):
+        """第一次提交任务时在当前事件循环中启动工作协程"""
+        if self._worker_tasks:
+            return
+        self._wakeup = asyncio.Event()
+        self._worker_tasks = [asyncio.create_task(self._worker(i)) for i in range(self.workers)]
+
+    async def _next_task(self) -> Optional[Tuple[Job, int, UploadedImage]]:
+        """轮转取下一张待识别图片"""
+        while self._ready:
+            job = self._ready.popleft()
+            if not job.finished and await self._cancel_requested(job):
+                self._cancel_local(job)
+            if job.finished or not job.pending:
+                continue
+            index, upload = job.pending.popleft()
+            job.queued_bytes -= upload.size
+            self._queued_bytes -= upload.size
+            if job.pending:
+                self._ready.append(job)
+                # 检查取消标记时可能让出了事件循环，其它工作协程此时看到空队列后已进入等待
+                self._wakeup.set()
+            if job.status == JOB_QUEUED:
+                job.status = JOB_RUNNING
+                job.started_at = time.time()
+                self._publish(job, force=True)
+            return job, index, upload
+        return None
+
+    async def _worker(self, worker_id: int):
+        clear_request_trace()
+        while True:
+            task = await self._next_task()
+            if task is None:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            job, index, upload = task
+            try:
+                result = await self._processor(upload, job.engine, priority=PRIORITY_BATCH, fields=job.fields,
+                                               dedup=job.dedup, index=index)
+            except Exception as e:
+                logger.error(f"任务 {job.id} 第 {index} 张图片处理失败: {str(e)}")
+                result = {"file": upload.filename, "status": "error", "error": str(e), "parsed": None}
+            del upload
+            if job.status == JOB_CANCELLED:
+                continue
+            job._record(index, result)
+            self._publish(job)
+            if job.status == JOB_DONE:
+                JOB_EVENTS.inc(event="done")
+                logger.info(f"任务 {job.id} 完成: 成功 {job.succeeded}/{job.total}")
+
+    def _evict_expired(self):
+        """清除过期的已完成任务；保留数超过上限时从最早完成的开始清除"""
+        now = time.time()
+        finished = sorted((job for job in self._jobs.values() if job.finished), key=lambda job: job.finished_at)
+        overflow = len(finished) - self.max_retained
+        for job in finished:
+            if overflow > 0 or now - job.finished_at > self.ttl:
+                del self._jobs[job.id]
+                self._published.pop(job.id, None)
+                self._cancel_checked.pop(job.id, None)
+                overflow -= 1
+
+    async def aclose(self):
+        """停止工作协程（应用关闭时调用）"""
+        for task in self._worker_tasks:
+            task.cancel()
+        if self._worker_tasks:
+            await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        self._worker_tasks = []
+        for job in list(self._ready):
+            self._release(job)
+        self._ready.clear()
+
+
+# 全局任务管理器实例
+job_manager = JobManager(
+    workers=settings.job_workers,
+    ttl=settings.job_ttl,
+    max_active=settings.job_max_active,
+    max_queued_bytes=settings.job_max_queued_bytes,
+    max_retained=settings.job_max_retained,
+    shared=shared_state
+)
@@ -0,0 +1,250 @@
+# 版面分析：按文字框位置还原行/列结构，识别单据类型（超市小票 / 微信支付 / 支付宝截图）
+import re
+from itertools import islice
+from typing import List, Dict, Any, Optional, Tuple
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 单据类型
+SOURCE_RECEIPT = "receipt"
+SOURCE_WECHAT = "wechat"
+SOURCE_ALIPAY = "alipay"
+PAYMENT_SOURCES = (SOURCE_WECHAT, SOURCE_ALIPAY)
+
+# 各类支付截图的特征词（两者共有的词如"支付时间"不参与判断），命中至少两个才认定
+TEMPLATE_KEYWORDS = {
+    SOURCE_WECHAT: ["微信支付", "商户全称", "当前状态", "交易单号", "商户单号", "收单机构", "零钱通", "零钱"],
+    SOURCE_ALIPAY: ["支付宝", "账单详情", "创建时间", "商家订单号", "收款方全称", "花呗", "余额宝", "账单分类"],
+}
+TEMPLATE_MIN_HITS = 2
+
+# 支付截图中的 标签 -> 字段
+PAYMENT_LABELS = {
+    "商品": "item", "商品说明": "item", "商品名称": "item",
+    "商户全称": "store", "收款方全称": "store", "商户名称": "store",
+    "支付时间": "datetime", "创建时间": "datetime", "付款时间": "datetime", "交易时间": "datetime",
+    "支付方式": "payment_method", "付款方式": "payment_method",
+    "交易单号": "transaction_id", "订单号": "transaction_id",
+}
+
+_KEYWORD_TO_TEMPLATE = {keyword: source for source, keywords in TEMPLATE_KEYWORDS.items() for keyword in keywords}
+_TEMPLATE_RE = re.compile("|".join(re.escape(k) for k in sorted(_KEYWORD_TO_TEMPLATE, key=len, reverse=True)))
+# 标签可能与值识别为同一个文字框（如"商品 xxx"），按最长标签匹配行首
+_LABEL_RE = re.compile("(" + "|".join(re.escape(k) for k in sorted(PAYMENT_LABELS, key=len, reverse=True)) + r")[:：\s]*")
+# 截图顶部醒目的金额，如 -25.00、¥25.00
+_AMOUNT_RE = re.compile(r"[-+]?\s*[¥￥]?\s*(\d[\d,]*\.\d{2})")
+_DATE_RE = re.compile(r"(\d{4}[-/年]\d{1,2}[-/月]\d{1,2}日?)|(\d{1,2}[-/]\d{1,2}[-/]\d{4})")
+_TIME_RE = re.compile(r"(\d{1,2}:\d{2}:\d{2})|(\d{1,2}:\d{2})")
+
+
+class LayoutDocument:
+    """版面分析结果：文字框按列存储（文字、原始 bbox、纵向中心、高度），
+    rows 为按从上到下排列的行，每行是从左到右排列的文字框序号"""
+    __slots__ = ("texts", "boxes", "centers", "heights", "rows", "source", "has_layout")
+
+    def __init__(self, texts: List[str], boxes: List[Any], centers: List[float], heights: List[float],
+                 rows: List[List[int]], source: str, has_layout: bool):
+        self.texts = texts
+        self.boxes = boxes
+        self.centers = centers
+        self.heights = heights
+        self.rows = rows
+        self.source = source
+        self.has_layout = has_layout
+
+    @property
+    def lines(self) -> List[str]:
+        """每行文字框按空格拼接，左侧的商品名与右侧的价格合为一行"""
+        texts = self.texts
+        if len(self.rows) == len(texts):
+            return [texts[row[0]] for row in self.rows]
+        return [" ".join(texts[i] for i in row) if len(row) > 1 else texts[row[0]] for row in self.rows]
+
+
+def _box_geometry(boxes: List[Any]) -> Tuple[List[float], List[float]]:
+    """计算各文字框的纵向中心和高度；bbox 可以是四边形的8个坐标或 [x1, y1, x2, y2]"""
+    try:
+        # 常见情况：引擎返回四边形，用四个角的平均值，避免逐个调用 min/max
+        return ([(b[1] + b[3] + b[5] + b[7]) * 0.25 for b in boxes],
+                [(b[5] + b[7] - b[1] - b[3]) * 0.5 for b in boxes])
+    except (IndexError, TypeError):
+        pass
+    centers, heights = [], []
+    for box in boxes:
+        if box and len(box) >= 8:
+            centers.append((box[1] + box[3] + box[5] + box[7]) * 0.25)
+            heights.append((box[5] + box[7] - box[1] - box[3]) * 0.5)
+        elif box and len(box) >= 4:
+            centers.append((box[1] + box[3]) * 0.5)
+            heights.append(box[3] - box[1])
+        else:
+            centers.append(0.0)
+            heights.append(0.0)
+    return centers, heights
+
+
+def _box_left(box: Any) -> float:
+    if box and len(box) >= 8:
+        return min(box[0], box[6])
+    return box[0] if box else 0
+
+
+def analyze_layout(ocr_results: List[Dict[str, Any]]) -> LayoutDocument:
+    """把OCR文字框按位置分组为行，并判断单据类型
+
+    没有有效位置信息（如接口不返回位置）时每个文字框单独成行，保持引擎返回的顺序。
+    小票通常每行一个文字框：文字框已从上到下排列且互不重叠时同样每框一行，
+    跳过几何计算和分行（此时 centers、heights 为空）；支付截图总是完整分析。
+    """
+    texts = [result['text'].strip() for result in ocr_results]
+    boxes = [result.get('bbox') for result in ocr_results]
+    if not all(texts):
+        kept = [i for i, text in enumerate(texts) if text]
+        texts = [texts[i] for i in kept]
+        boxes = [boxes[i] for i in kept]
+
+    source = detect_source(texts)
+    if source not in PAYMENT_SOURCES and _stacked(boxes):
+        return LayoutDocument(texts, boxes, [], [], [[i] for i in range(len(texts))], source, any(boxes))
+
+    centers, heights = _box_geometry(boxes)
+    has_layout = sum(1 for height in heights if height > 0) * 2 > len(texts)
+    rows = group_rows(centers, heights, boxes) if has_layout else [[i] for i in range(len(texts))]
+    return LayoutDocument(texts, boxes, centers, heights, rows, source, has_layout)
+
+
+def _stacked(boxes: List[Any]) -> bool:
+    """文字框是否各占一行：没有位置信息，或每个框的上边不高于前一个框的下边
+
+    只比较相邻框的纵坐标，不计算中心和高度；坐标格式不一致时返回 False，交给完整分析。
+    """
+    if not any(boxes):
+        return True
+    following = islice(boxes, 1, None)
+    try:
+        if len(boxes[0]) >= 8:
+            # 四边形按左右两侧分别比较，容忍轻微倾斜
+            return all(box[1] >= prev[7] and box[3] >= prev[5] for prev, box in zip(boxes, following))
+        return all(box[1] >= prev[3] for prev, box in zip(boxes, following))
+    except (IndexError, TypeError):
+        return False
+
+
+def group_rows(centers: List[float], heights: List[float], boxes: List[Any]) -> List[List[int]]:
+    """按纵向中心排序后扫描：中心距离当前行不超过半个文字高度的框归入同一行
+
+    排序相当于一维空间索引，每个框只与当前行比较，复杂度 O(n log n)；
+    引擎通常已按从上到下返回，此时无需排序。
+    """
+    count = len(centers)
+    if not count:
+        return []
+    tolerance = max(1.0, sorted(heights)[count // 2] * 0.5)
+    rows = _sweep_rows(range(count), centers, tolerance)
+    if rows is None:
+        rows = _sweep_rows(sorted(range(count), key=centers.__getitem__), centers, tolerance)
+    if len(rows) < count:
+        for row in rows:
+            if len(row) > 1:
+                row.sort(key=lambda i: _box_left(boxes[i]))
+    return rows
+
+
+def _sweep_rows(order, centers: List[float], tolerance: float) -> Optional[List[List[int]]]:
+    """按给定顺序扫描分行；遇到明显位于上一行之上的框（顺序不是从上到下）时返回 None"""
+    rows: List[List[int]] = []
+    current: List[int] = []
+    row_cy = float("-inf")
+    for index in order:
+        cy = centers[index]
+        delta = cy - row_cy
+        if delta > tolerance:
+            current = [index]
+            rows.append(current)
+            row_cy = cy
+        elif delta >= -tolerance:
+            current.append(index)
+            # 行中心取已加入框的平均值，避免逐个偏移导致整页连成一行
+            row_cy += delta / len(current)
+        else:
+            return None
+    return rows
+
+
+def detect_source(texts: List[str]) -> str:
+    """一次正则扫描统计各类支付截图特征词的命中数，命中最多且不少于阈值的类型胜出"""
+    hits: Dict[str, set] = {}
+    for keyword in _TEMPLATE_RE.findall("\n".join(texts)):
+        hits.setdefault(_KEYWORD_TO_TEMPLATE[keyword], set()).add(keyword)
+    best, best_hits = SOURCE_RECEIPT, TEMPLATE_MIN_HITS - 1
+    for source, keywords in hits.items():
+        if len(keywords) > best_hits:
+            best, best_hits = source, len(keywords)
+    return best
+
+
+def _key_value(texts: List[str], row: List[int]) -> Optional[Tuple[str, str]]:
+    """行首为已知标签时返回 (字段, 值)；标签和值可以是同一行的两个框，也可以在同一个框内"""
+    first = texts[row[0]]
+    match = _LABEL_RE.match(first)
+    if not match:
+        return None
+    rest = first[match.end():].strip()
+    value = " ".join(filter(None, [rest] + [texts[i] for i in row[1:]]))
+    return PAYMENT_LABELS[match.group(1)], value
+
+
+def extract_payment(document: LayoutDocument) -> Dict[str, Any]:
+    """微信/支付宝账单详情截图：顶部为商户名和醒目的金额，下方为 标签-值 两列"""
+    fields: Dict[str, Any] = {}
+    amount = None
+    amount_row = None
+    amount_height = 0.0
+    texts = document.texts
+    # 没有位置信息时标签和值各占一行：只有标签的一行与下一行配对
+    pending = None
+    for index, row in enumerate(document.rows):
+        pair = _key_value(texts, row)
+        if pair:
+            field, value = pair
+            if value and field not in fields:
+                fields[field] = value
+            pending = field if not value and not document.has_layout else None
+            continue
+        if pending is not None:
+            fields.setdefault(pending, " ".join(texts[i] for i in row))
+            pending = None
+            continue
+        # 金额行：整行只有金额，取字号（框高度）最大的一个
+        if len(row) == 1:
+            match = _AMOUNT_RE.fullmatch(texts[row[0]].replace(" ", ""))
+            height = document.heights[row[0]]
+            if match and (amount is None or height > amount_height):
+                amount = float(match.group(1).replace(",", ""))
+                amount_row = index
+                amount_height = height
+
+    store = fields.get("store")
+    # 没有商户全称时，金额上方一行通常是商户名
+    if store is None and amount_row:
+        store = document.lines[amount_row - 1]
+
+    date = time = None
+    datetime_text = fields.get("datetime")
+    if datetime_text:
+        date_match = _DATE_RE.search(datetime_text)
+        time_match = _TIME_RE.search(datetime_text)
+        date = date_match.group() if date_match else None
+        time = time_match.group() if time_match else None
+
+    item_name = fields.get("item") or store
+    return {
+        "store_name": store or "未知商户",
+        "transaction_date": date,
+        "transaction_time": time,
+        "total_amount": amount,
+        "items": [(item_name, amount)] if amount is not None and item_name else [],
+        "payment_method": fields.get("payment_method"),
+        "transaction_id": fields.get("transaction_id"),
+    }
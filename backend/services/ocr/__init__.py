@@ -1,11 +1,27 @@
 from typing import Dict, List, Any, Optional
-from .base_ocr import BaseOCREngine
-from .easyocr_engine import EasyOCREngine
-from .baidu_ocr_engine import BaiduOCREngine
+from .base_ocr import BaseOCREngine, EngineCapabilities, get_ocr_executor, shutdown_ocr_executor, PRIORITY_INTERACTIVE, PRIORITY_BATCH
+from .cache import OCRResultCache
+from .registry import EngineSpec, engine_registry
+from .routing import EngineRouter, RoutingPolicy
+import asyncio
 import logging
 
+from core.config import settings
+from core.metrics import stage, PAYLOAD_BYTES, ENGINE_REQUESTS, ENGINE_ERRORS, CACHE_LOOKUPS
+from core.shared_state import shared_state
+from services.image_preprocessor import image_preprocessor
+
 logger = logging.getLogger(__name__)
 
+# 按各引擎声明的成本和预计耗时自动选择引擎
+ENGINE_AUTO = "auto"
+
+# 引擎状态
+ENGINE_PENDING = "pending"
+ENGINE_INITIALIZING = "initializing"
+ENGINE_READY = "ready"
+ENGINE_FAILED = "failed"
+
 class OCRManager:
     """OCR引擎管理器，支持多种引擎动态切换"""
     
@@ -13,56 +29,310 @@ class OCRManager:
         self.engines: Dict[str, BaseOCREngine] = {}
         self.default_engine = "baiduocr"
         self.initialized = False
+        self.engine_states: Dict[str, str] = {}
+        self.engine_errors: Dict[str, str] = {}
+        self._init_tasks: Dict[str, asyncio.Task] = {}
+        self.router = EngineRouter(RoutingPolicy(
+            fallbacks=settings.ocr_fallback_engines,
+            hedge_after=settings.ocr_hedge_after,
+            max_retries=settings.ocr_max_retries,
+            backoff_base=settings.ocr_retry_backoff,
+            backoff_max=settings.ocr_retry_backoff_max,
+            breaker_threshold=settings.ocr_breaker_threshold,
+            breaker_reset=settings.ocr_breaker_reset
+        ))
+        self.cache: Optional[OCRResultCache] = None
+        if settings.ocr_cache_enabled:
+            self.cache = OCRResultCache(
+                max_entries=settings.ocr_cache_max_entries,
+                disk_dir=settings.ocr_cache_dir,
+                ttl=settings.ocr_cache_ttl,
+                max_disk_bytes=settings.ocr_cache_max_disk_mb * 1024 * 1024,
+                shared=shared_state
+            )
     
     def register_engine(self, name: str, engine: BaseOCREngine, **kwargs) -> bool:
         """注册OCR引擎"""
+        self.engine_states[name] = ENGINE_INITIALIZING
         try:
             if engine.initialize(**kwargs):
                 self.engines[name] = engine
+                self.engine_states[name] = ENGINE_READY
+                self.engine_errors.pop(name, None)
                 logger.info(f"OCR引擎 {name} 注册成功")
                 return True
+            self.engine_errors[name] = "初始化失败"
         except Exception as e:
             logger.error(f"注册OCR引擎 {name} 失败: {str(e)}")
+            self.engine_errors[name] = str(e)
+        self.engine_states[name] = ENGINE_FAILED
         return False
     
+    def enabled_engines(self) -> Dict[str, EngineSpec]:
+        """按配置返回需要启用的引擎声明"""
+        return engine_registry.enabled()
+    
+    def _load_engine(self, name: str, spec: EngineSpec) -> bool:
+        """导入、实例化并初始化单个引擎（阻塞）"""
+        try:
+            engine = spec.create()
+        except Exception as e:
+            logger.error(f"加载OCR引擎 {name} 失败: {str(e)}")
+            self.engine_states[name] = ENGINE_FAILED
+            self.engine_errors[name] = str(e)
+            return False
+        # 配置中的成本/耗时覆盖引擎声明的值
+        engine.capabilities = engine.capabilities.replace(
+            cost_per_call=settings.ocr_engine_costs.get(name),
+            expected_latency=settings.ocr_engine_latencies.get(name)
+        )
+        return self.register_engine(name, engine, **spec.options)
+    
+    def _update_default_engine(self):
+        """默认优先使用百度OCR，不可用时切换到其它已就绪的引擎"""
+        if "baiduocr" in self.engines:
+            self.default_engine = "baiduocr"
+        elif self.default_engine not in self.engines and self.engines:
+            self.default_engine = next(iter(self.engines))
+        self.initialized = bool(self.engines)
+    
     def initialize_engines(self) -> bool:
-        """初始化所有引擎"""
+        """同步初始化所有启用的引擎（脚本等非服务场景使用）"""
         try:
-            # 初始化EasyOCR
-            # easyocr_engine = EasyOCREngine()
-            # if self.register_engine("easyocr", easyocr_engine, languages=['ch_sim', 'en'], gpu=False):
-            #     self.initialized = True
-            #     logger.info("所有OCR引擎初始化完成")
-            #     return True
-            self.engines['baiduocr'] = BaiduOCREngine()
-            if not self.engines['baiduocr'].initialize(languages=['ch_sim', 'en']):
-                logger.error("BaiduOCR 初始化失败")
-            else:
-                self.default_engine = 'baiduocr'  # 设置默认引擎
-                return True
+            for name, spec in self.enabled_engines().items():
+                if not self._load_engine(name, spec):
+                    logger.error(f"{name} 初始化失败")
         except Exception as e:
             logger.error(f"OCR引擎初始化失败: {str(e)}")
-        return False
+        self._update_default_engine()
+        return self.initialized
+    
+    def start_initialization(self):
+        """在后台并行初始化所有启用的引擎，服务无需等待即可开始处理请求（需在事件循环中调用）"""
+        for name, spec in self.enabled_engines().items():
+            if name in self._init_tasks:
+                continue
+            self.engine_states[name] = ENGINE_PENDING
+            self._init_tasks[name] = asyncio.ensure_future(self._initialize_engine_async(name, spec))
+    
+    async def _initialize_engine_async(self, name: str, spec: EngineSpec) -> bool:
+        # 导入和初始化（如获取token、加载模型）都是阻塞操作，放到线程中并行执行
+        ok = await asyncio.to_thread(self._load_engine, name, spec)
+        if ok:
+            self._update_default_engine()
+            engine = self.engines[name]
+            if hasattr(engine, "start_token_refresher"):
+                engine.start_token_refresher()
+            logger.info(f"OCR引擎 {name} 已就绪")
+        return ok
+    
+    async def wait_engine_ready(self, engine_name: str, timeout: Optional[float] = None) -> bool:
+        """等待正在初始化的引擎就绪"""
+        if engine_name in self.engines:
+            return True
+        task = self._init_tasks.get(engine_name)
+        if task is None:
+            return False
+        try:
+            await asyncio.wait_for(asyncio.shield(task), timeout or settings.engine_ready_timeout)
+        except asyncio.TimeoutError:
+            return False
+        return engine_name in self.engines
+    
+    async def wait_any_engine_ready(self, timeout: Optional[float] = None) -> bool:
+        """没有就绪的引擎时，等待任一正在初始化的引擎就绪"""
+        pending = [task for task in self._init_tasks.values() if not task.done()]
+        deadline = asyncio.get_running_loop().time() + (timeout or settings.engine_ready_timeout)
+        while not self.engines and pending:
+            remaining = deadline - asyncio.get_running_loop().time()
+            if remaining <= 0:
+                break
+            done, pending = await asyncio.wait(pending, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+        return bool(self.engines)
+    
+    def get_capabilities(self, engine_name: str) -> EngineCapabilities:
+        """获取引擎能力与成本"""
+        if engine_name not in self.engines:
+            raise ValueError(f"引擎不存在: {engine_name}")
+        return self.engines[engine_name].get_capabilities()
     
-    def recognize_text(self, image_data, engine_name: str = None, **kwargs) -> List[Dict[str, Any]]:
-        """使用指定引擎识别文字"""
+    def auto_candidates(self, priority: int = PRIORITY_INTERACTIVE) -> List[str]:
+        """engine=auto 时的候选引擎顺序：预计耗时满足要求的引擎中成本最低的优先，
+        批量任务的耗时预算更宽，可以交给更慢但更便宜的引擎"""
+        budget = settings.ocr_auto_batch_latency_budget if priority >= PRIORITY_BATCH else settings.ocr_auto_latency_budget
+        capabilities = {name: engine.get_capabilities() for name, engine in self.engines.items()}
+        return self.router.rank(list(capabilities), capabilities, budget)
+    
+    def get_engine_states(self) -> Dict[str, Dict[str, Any]]:
+        """各引擎的初始化状态"""
+        return {
+            name: {
+                "state": state,
+                "error": self.engine_errors.get(name),
+                "circuit": self.router.breaker(name).snapshot()
+            }
+            for name, state in self.engine_states.items()
+        }
+    
+    def recognize_text(self, image_data, engine_name: str = None, trace: Optional[Dict[str, Any]] = None,
+                       image_digest: Optional[str] = None, **kwargs) -> List[Dict[str, Any]]:
+        """使用指定引擎识别文字；trace 用于回传本次调用的处理信息（如预处理节省的字节数），
+        image_digest 为已计算好的图片 sha256（避免重复哈希）"""
         engine_name = engine_name or self.default_engine
+        if engine_name == ENGINE_AUTO and self.engines:
+            engine_name = self.auto_candidates()[0]
         
         if engine_name not in self.engines:
             raise ValueError(f"不支持的OCR引擎: {engine_name}")
         
         engine = self.engines[engine_name]
-        return engine.recognize_text(image_data, **kwargs)
+        cache_key = self._cache_key(image_data, engine_name, kwargs, image_digest)
+        if cache_key:
+            with stage("cache_lookup"):
+                cached = self.cache.get(cache_key)
+            CACHE_LOOKUPS.inc(result="miss" if cached is None else "hit")
+            if cached is not None:
+                return cached
+        
+        with stage("preprocess"):
+            image_data = self._preprocess(image_data, engine, trace)
+        ENGINE_REQUESTS.inc(engine=engine_name)
+        try:
+            with stage(f"ocr_{engine_name}"):
+                results = engine.recognize_text(image_data, **kwargs)
+        except Exception:
+            ENGINE_ERRORS.inc(engine=engine_name)
+            raise
+        if cache_key:
+            self.cache.set(cache_key, results)
+        return results
+    
+    async def recognize_text_async(self, image_data, engine_name: str = None, trace: Optional[Dict[str, Any]] = None,
+                                   image_digest: Optional[str] = None, priority: int = PRIORITY_INTERACTIVE,
+                                   **kwargs) -> List[Dict[str, Any]]:
+        """使用指定引擎异步识别文字，不阻塞事件循环；
+        主引擎失败、过慢或熔断时按路由策略重试、对冲或切换到备用引擎，实际使用的引擎写入 trace["engine_used"]。
+        priority 为请求优先级（交互请求 PRIORITY_INTERACTIVE，批量任务 PRIORITY_BATCH），
+        engine_name 为 auto 时按优先级对应的耗时预算选择成本最低的引擎"""
+        engine_name = engine_name or self.default_engine
+        
+        if engine_name == ENGINE_AUTO:
+            if not self.engines and not await self.wait_any_engine_ready():
+                raise ValueError("没有可用的OCR引擎")
+            candidates = self.auto_candidates(priority)
+            engine_name = candidates[0]
+        else:
+            if engine_name not in self.engines and not await self.wait_engine_ready(engine_name):
+                if engine_name not in self.engine_states and engine_name not in self._init_tasks:
+                    raise ValueError(f"不支持的OCR引擎: {engine_name}")
+            candidates = self.router.candidates(engine_name, self.get_available_engines())
+            if not candidates:
+                raise ValueError(f"OCR引擎不可用: {engine_name}")
+        
+        cache_key = self._cache_key(image_data, engine_name, kwargs, image_digest)
+        if cache_key:
+            with stage("cache_lookup"):
+                cached = await self.cache.get_async(cache_key)
+            CACHE_LOOKUPS.inc(result="miss" if cached is None else "hit")
+            if cached is not None:
+                logger.debug(f"OCR缓存命中: engine={engine_name}")
+                if trace is not None:
+                    trace["engine_used"] = engine_name
+                return cached
+        
+        # 同一请求内按引擎限制缓存预处理结果，重试/对冲时不重复预处理
+        prepared: Dict[str, Any] = {}
+        
+        async def attempt(name: str) -> List[Dict[str, Any]]:
+            engine = self.engines[name]
+            data = image_data
+            if isinstance(image_data, bytes):
+                limits = tuple(engine.get_capabilities().limits().values())
+                if limits not in prepared:
+                    # 解码/缩放/压缩属于CPU密集操作，放到线程池执行
+                    loop = asyncio.get_running_loop()
+                    with stage("preprocess"):
+                        prepared[limits] = await loop.run_in_executor(
+                            get_ocr_executor(), self._preprocess, image_data, engine, trace)
+                data = prepared[limits]
+            ENGINE_REQUESTS.inc(engine=name)
+            try:
+                with stage(f"ocr_{name}"):
+                    return await engine.recognize_text_async(data, priority=priority, **kwargs)
+            except Exception:
+                ENGINE_ERRORS.inc(engine=name)
+                raise
+        
+        engine_used, results = await self.router.run(candidates, attempt)
+        if trace is not None:
+            trace["engine_used"] = engine_used
+        if engine_used != engine_name:
+            logger.info(f"OCR引擎 {engine_name} 不可用，已由 {engine_used} 完成识别")
+        elif cache_key:
+            # 只缓存请求引擎本身的结果，备用引擎的结果不写入主引擎的缓存键
+            await self.cache.set_async(cache_key, results)
+        return results
+    
+    def _cache_key(self, image_data, engine_name: str, options: Dict[str, Any],
+                   digest: Optional[str] = None) -> Optional[str]:
+        """只缓存字节形式的图片数据，其它输入直接调用引擎"""
+        if self.cache is None or not isinstance(image_data, bytes):
+            return None
+        options = {**options, "preprocess": image_preprocessor.signature()}
+        # 同一引擎切换识别接口（如是否返回文字位置）后，结果格式不同，不能复用旧缓存
+        engine = self.engines.get(engine_name)
+        api = engine.get_engine_info().get("api") if engine else None
+        if api:
+            options["api"] = api
+        return OCRResultCache.make_key(image_data, engine_name, options, digest=digest)
+    
+    def _preprocess(self, image_data, engine: BaseOCREngine, trace: Optional[Dict[str, Any]]):
+        """按引擎限制预处理图片字节，失败时回退为原图"""
+        if not isinstance(image_data, bytes):
+            return image_data
+        try:
+            result = image_preprocessor.process(image_data, engine.get_capabilities().limits())
+        except Exception as e:
+            logger.warning(f"图片预处理失败，使用原图: {str(e)}")
+            return image_data
+        PAYLOAD_BYTES.observe(result.original_bytes, kind="upload")
+        PAYLOAD_BYTES.observe(result.processed_bytes, kind="preprocessed")
+        if trace is not None:
+            trace["preprocess"] = result.to_dict()
+        return result.data
+    
+    def get_cache_stats(self) -> Dict[str, Any]:
+        """获取OCR结果缓存的命中统计"""
+        if self.cache is None:
+            return {"enabled": False}
+        return {"enabled": True, **self.cache.stats()}
+    
+    async def aclose(self):
+        """释放所有引擎资源"""
+        for task in self._init_tasks.values():
+            task.cancel()
+        for name, engine in self.engines.items():
+            try:
+                await engine.aclose()
+            except Exception as e:
+                logger.error(f"关闭OCR引擎 {name} 失败: {str(e)}")
+        shutdown_ocr_executor()
     
     def get_available_engines(self) -> List[str]:
         """获取可用的引擎列表"""
         return list(self.engines.keys())
     
     def get_engine_info(self, engine_name: str) -> Dict[str, Any]:
-        """获取引擎信息"""
+        """获取引擎信息（含能力与成本，以及结合实测耗时的预计耗时）"""
         if engine_name not in self.engines:
             raise ValueError(f"引擎不存在: {engine_name}")
-        return self.engines[engine_name].get_engine_info()
+        engine = self.engines[engine_name]
+        capabilities = engine.get_capabilities()
+        return {
+            **engine.get_engine_info(),
+            "capabilities": capabilities.to_dict(),
+            "expected_latency": round(self.router.expected_latency(engine_name, capabilities.expected_latency), 3)
+        }
 
 # 全局OCR管理器实例
 ocr_manager = OCRManager()
\ No newline at end of file
@@ -1,24 +1,56 @@
 # 百度ocr实现
 # BaiduOCR实现
 import requests
-import base64
+from requests.adapters import HTTPAdapter
+import httpx
+import asyncio
+import hashlib
+import threading
 import time
-import numpy as np
-import cv2
-from PIL import Image
-import io
 import os
-from .base_ocr import BaseOCREngine, OCRResult
-from typing import List, Dict, Any
+from .base_ocr import BaseOCREngine, EngineCapabilities, OCRResult, OCREngineError, TransientOCRError, PRIORITY_INTERACTIVE
+from .rate_limiter import RequestScheduler, QuotaTracker, QuotaExceededError
+from typing import List, Dict, Any, Optional
 import logging
 from dotenv import load_dotenv
 
+from core.config import settings
+from core.metrics import stage, PAYLOAD_BYTES
+from core.shared_state import shared_state
+from utils.helpers import Base64FormBody
+
 # 加载环境变量
 load_dotenv(".env")
 
 logger = logging.getLogger(__name__)
 
+TOKEN_PATH = "/oauth/2.0/token"
+OCR_PATH = f"/rest/2.0/ocr/v1/{settings.baidu_ocr_api}"
+
+# 可重试的百度API错误码：服务暂不可用、QPS超限、内部错误
+TRANSIENT_ERROR_CODES = {1, 2, 18, 282000}
+# access_token 无效或过期，刷新后可重试
+TOKEN_ERROR_CODES = {110, 111}
+# 每日/总调用量已达上限
+QUOTA_ERROR_CODES = {17, 19}
+# 多进程共享 token 时，其它进程正在刷新的情况下最多等待的秒数（超时后自行刷新）
+PEER_TOKEN_WAIT = 10.0
+
+
+def _billable(status_code: int, result: Optional[Dict[str, Any]]) -> bool:
+    """百度只对成功的识别计费：HTTP 200 且没有 error_code"""
+    return status_code == 200 and isinstance(result, dict) and 'error_code' not in result
+
 class BaiduOCREngine(BaseOCREngine):
+    # accurate/accurate_basic 接口限制：base64 后不超过10M，最长边不超过8192px；
+    # 成本按高精度版按量计费单价估算，实际价格以购买的套餐为准（可用 OCR_ENGINE_COSTS 覆盖）
+    capabilities = EngineCapabilities(
+        max_image_bytes=7 * 1024 * 1024,
+        max_long_edge=8192,
+        expected_latency=1.0,
+        cost_per_call=0.01
+    )
+    
     def __init__(self):
         self.access_token = None
         self.token_expire_time = 0
@@ -26,6 +58,23 @@ class BaiduOCREngine(BaseOCREngine):
         self.secret_key = None
         self.language_type = 'CHN_ENG'  # 默认
         self.initialized = False
+        self._session: Optional[requests.Session] = None
+        self._async_client: Optional[httpx.AsyncClient] = None
+        # 保证同一时刻只有一个 token 刷新在进行
+        self._token_lock = threading.Lock()
+        self._token_task: Optional[asyncio.Task] = None
+        self._refresher_task: Optional[asyncio.Task] = None
+        # 按接口QPS限制发送速率，并跟踪当日剩余额度（多进程运行时各进程共用同一份令牌桶和额度）
+        self.scheduler = RequestScheduler(
+            qps=settings.baidu_qps,
+            burst=settings.baidu_burst,
+            max_queue=settings.baidu_max_queue,
+            queue_timeout=settings.baidu_queue_timeout,
+            shared=shared_state,
+            name="baidu_ocr:rate_limit"
+        )
+        self.quota = QuotaTracker(settings.baidu_daily_quota, settings.baidu_quota_reserve,
+                                  shared=shared_state, name="baidu_ocr:quota")
     
     def initialize(self, languages: List[str] = ['ch_sim', 'en'], **kwargs) -> bool:
         """初始化BaiduOCR，需要API Key和Secret Key（从环境变量获取）"""
@@ -52,22 +101,217 @@ class BaiduOCREngine(BaseOCREngine):
             logger.error("BaiduOCR初始化失败: 获取 access_token 失败")
             return False
     
+    def _token_params(self) -> Dict[str, str]:
+        return {
+            'grant_type': 'client_credentials',
+            'client_id': self.api_key,
+            'client_secret': self.secret_key
+        }
+    
+    def _store_token(self, status_code: int, data: Dict[str, Any], text: str) -> bool:
+        """保存 oauth 接口返回的 access_token（多进程运行时同时写入共享存储）"""
+        if status_code == 200 and 'access_token' in data:
+            self.access_token = data['access_token']
+            self.token_expire_time = time.time() + data['expires_in'] - 60  # 提前1分钟刷新
+            if shared_state is not None:
+                shared_state.set(self._shared_token_key(),
+                                 {"access_token": self.access_token, "expire_time": self.token_expire_time},
+                                 ttl=data['expires_in'])
+            return True
+        logger.error(f"获取 access_token 失败: {text}")
+        return False
+    
+    def _shared_token_key(self) -> str:
+        # 按 API Key 区分，切换账号后不会读到旧账号的 token
+        return "baidu_ocr:token:" + hashlib.sha256(self.api_key.encode("utf-8")).hexdigest()[:16]
+    
+    def _adopt_shared_token(self, min_valid: float = 0.0) -> bool:
+        """采用其它进程已刷新的 token；本进程的 token 剩余有效期超过 min_valid 秒时返回 True"""
+        if shared_state is not None:
+            record = shared_state.get(self._shared_token_key())
+            if record and record["expire_time"] > self.token_expire_time:
+                self.access_token = record["access_token"]
+                self.token_expire_time = record["expire_time"]
+        return time.time() < self.token_expire_time - min_valid
+    
+    def _invalidate_token(self):
+        """token 被服务端判定无效：本进程和共享存储中的同一个 token 都不再使用（共享存储在后台更新）"""
+        if shared_state is not None:
+            key = self._shared_token_key()
+            token = self.access_token
+            shared_state.submit(shared_state.update, key,
+                                lambda record: (None if record and record["access_token"] == token else record, None))
+        self.token_expire_time = 0
+    
     def _get_access_token(self) -> bool:
-        """获取或刷新 access_token"""
+        """获取或刷新 access_token（并发调用时只有一个线程、多进程运行时只有一个进程真正发起刷新）"""
         if time.time() < self.token_expire_time:
             return True
         
-        token_url = f"https://aip.baidubce.com/oauth/2.0/token?grant_type=client_credentials&client_id={self.api_key}&client_secret={self.secret_key}"
-        response = requests.post(token_url)
+        with self._token_lock:
+            # 等待锁期间其他线程（或其它进程）可能已经刷新成功
+            if self._adopt_shared_token():
+                return True
+            if shared_state is not None and not shared_state.try_lock("baidu_ocr:token_refresh", PEER_TOKEN_WAIT):
+                deadline = time.time() + PEER_TOKEN_WAIT
+                while time.time() < deadline:
+                    time.sleep(0.2)
+                    if self._adopt_shared_token():
+                        return True
+            try:
+                with stage("baidu_token_refresh"):
+                    response = self._get_session().post(settings.baidu_api_base + TOKEN_PATH, params=self._token_params(), timeout=self._timeouts())
+                data = response.json() if response.status_code == 200 else {}
+                return self._store_token(response.status_code, data, response.text)
+            finally:
+                if shared_state is not None:
+                    shared_state.unlock("baidu_ocr:token_refresh")
+    
+    async def _get_access_token_async(self, force: bool = False) -> bool:
+        """异步获取或刷新 access_token，并发调用共享同一个刷新任务"""
+        if not force and time.time() < self.token_expire_time:
+            return True
         
-        if response.status_code == 200:
-            data = response.json()
-            if 'access_token' in data:
-                self.access_token = data['access_token']
-                self.token_expire_time = time.time() + data['expires_in'] - 60  # 提前1分钟刷新
+        if self._token_task is None or self._token_task.done():
+            # 后台提前刷新时，其它进程刚刷新过的 token 若已不在刷新窗口内则直接采用
+            min_valid = settings.baidu_token_refresh_margin if force else 0.0
+            self._token_task = asyncio.ensure_future(self._refresh_token_async(min_valid))
+        # shield: 单个调用方被取消时不影响其他等待同一刷新结果的调用方
+        return await asyncio.shield(self._token_task)
+    
+    async def _refresh_token_async(self, min_valid: float = 0.0) -> bool:
+        # 访问共享存储可能因其它进程持有写锁而阻塞，放到存储的专用线程中执行
+        if shared_state is not None:
+            if await shared_state.run_async(self._adopt_shared_token, min_valid):
                 return True
-        logger.error(f"获取 access_token 失败: {response.text}")
-        return False
+            # 其它进程正在刷新时等待其结果，避免多个进程同时请求 oauth 接口
+            if not await shared_state.run_async(shared_state.try_lock, "baidu_ocr:token_refresh", PEER_TOKEN_WAIT):
+                deadline = time.time() + PEER_TOKEN_WAIT
+                while time.time() < deadline:
+                    await asyncio.sleep(0.2)
+                    if await shared_state.run_async(self._adopt_shared_token, min_valid):
+                        return True
+        try:
+            return await self._fetch_token_async()
+        finally:
+            if shared_state is not None:
+                await shared_state.run_async(shared_state.unlock, "baidu_ocr:token_refresh")
+    
+    async def _fetch_token_async(self) -> bool:
+        try:
+            with stage("baidu_token_refresh"):
+                response = await self._get_async_client().post(settings.baidu_api_base + TOKEN_PATH, params=self._token_params())
+            data = response.json() if response.status_code == 200 else {}
+            if shared_state is not None:
+                return await shared_state.run_async(self._store_token, response.status_code, data, response.text)
+            return self._store_token(response.status_code, data, response.text)
+        except httpx.HTTPError as e:
+            logger.error(f"获取 access_token 失败: {str(e)}")
+            return False
+    
+    def start_token_refresher(self):
+        """启动后台任务，在 token 过期前提前刷新，避免用户请求承担刷新耗时"""
+        if self._refresher_task is None or self._refresher_task.done():
+            self._refresher_task = asyncio.ensure_future(self._token_refresh_loop())
+    
+    async def _token_refresh_loop(self):
+        margin = settings.baidu_token_refresh_margin
+        while True:
+            # token_expire_time 已预留1分钟，这里再额外提前 margin 秒
+            delay = self.token_expire_time - margin - time.time()
+            await asyncio.sleep(max(delay, 1.0))
+            if time.time() < self.token_expire_time - margin:
+                continue
+            if await self._get_access_token_async(force=True):
+                logger.info("BaiduOCR access_token 已在后台刷新")
+            else:
+                # 刷新失败时稍后重试，旧 token 在过期前仍可使用
+                await asyncio.sleep(30)
+    
+    def _timeouts(self):
+        return (settings.baidu_connect_timeout, settings.baidu_read_timeout)
+    
+    def _get_session(self) -> requests.Session:
+        """复用带连接池的 Session，避免每次请求重新建立 TCP+TLS 连接"""
+        if self._session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=settings.baidu_pool_size)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            self._session = session
+        return self._session
+    
+    def _get_async_client(self) -> httpx.AsyncClient:
+        if self._async_client is None:
+            self._async_client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=settings.baidu_pool_size,
+                    max_keepalive_connections=settings.baidu_pool_size
+                ),
+                timeout=httpx.Timeout(settings.baidu_read_timeout, connect=settings.baidu_connect_timeout)
+            )
+        return self._async_client
+    
+    def _to_image_bytes(self, image_data) -> bytes:
+        """将文件路径/字节/numpy数组统一转换为图片字节"""
+        if isinstance(image_data, str):  # 文件路径
+            with open(image_data, 'rb') as f:
+                return f.read()
+        elif isinstance(image_data, bytes):  # 字节数据
+            return image_data
+        else:  # 假设是numpy数组（BGR），直接编码为JPEG，避免无损PNG放大请求体
+            import cv2
+            ok, encoded = cv2.imencode('.jpg', image_data, [cv2.IMWRITE_JPEG_QUALITY, 90])
+            if not ok:
+                raise ValueError("图片编码失败")
+            return encoded.tobytes()
+    
+    def _build_request(self, image_data) -> Dict[str, Any]:
+        """构造 accurate/accurate_basic 接口的请求参数；图片在发送时按块编码，不生成完整的base64副本"""
+        body = Base64FormBody('image', self._to_image_bytes(image_data), {
+            'language_type': self.language_type,
+            'detect_direction': 'true',  # 可选：检测方向
+            'probability': 'true'  # 启用置信度
+        })
+        with stage("baidu_encode"):
+            length = len(body)
+        PAYLOAD_BYTES.observe(length, kind="baidu_request")
+        # API 请求（使用高精度版以获取置信度和边界框）
+        return {
+            'url': f"{settings.baidu_api_base}{OCR_PATH}?access_token={self.access_token}",
+            'headers': {'Content-Type': 'application/x-www-form-urlencoded', 'Content-Length': str(length)},
+            'body': body
+        }
+    
+    def _parse_response(self, status_code: int, text: str, result: Optional[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """校验接口响应并转换为统一格式"""
+        if status_code != 200:
+            error_class = TransientOCRError if status_code >= 500 or status_code == 429 else OCREngineError
+            raise error_class(f"BaiduOCR HTTP错误: {status_code} - {text}")
+        if 'error_code' in result:
+            error_code = result['error_code']
+            message = f"BaiduOCR API错误({error_code}): {result.get('error_msg', '未知错误')}"
+            if error_code in QUOTA_ERROR_CODES:
+                self.quota.mark_exhausted()
+                raise QuotaExceededError(message)
+            if error_code in TOKEN_ERROR_CODES:
+                self._invalidate_token()  # 下次调用时重新获取 token
+                raise TransientOCRError(message)
+            if error_code in TRANSIENT_ERROR_CODES:
+                raise TransientOCRError(message)
+            raise OCREngineError(message)
+        
+        ocr_results = []
+        for item in result.get('words_result', []):
+            text = item.get('words', '')
+            confidence = item.get('probability', {}).get('average', 0.0)
+            loc = item.get('location', {})
+            left, top, width, height = loc.get('left', 0), loc.get('top', 0), loc.get('width', 0), loc.get('height', 0)
+            # 转换为平坦四边形边界框（类似于EasyOCR）
+            bbox_flat = [left, top, left + width, top, left + width, top + height, left, top + height]
+            ocr_results.append(OCRResult(text, confidence, bbox_flat).to_dict())
+        
+        return ocr_results
     
     def recognize_text(self, image_data, **kwargs) -> List[Dict[str, Any]]:
         """使用BaiduOCR识别文字"""
@@ -75,63 +319,80 @@ class BaiduOCREngine(BaseOCREngine):
             raise RuntimeError("BaiduOCR引擎未正确初始化")
         
         if not self._get_access_token():
-            raise RuntimeError("Access token 获取失败")
+            raise TransientOCRError("Access token 获取失败")
+        self.quota.consume()
         
+        billed = False
         try:
-            # 转换图像数据为 base64
-            if isinstance(image_data, str):  # 文件路径
-                with open(image_data, 'rb') as f:
-                    img_bytes = f.read()
-            elif isinstance(image_data, bytes):  # 字节数据
-                img_bytes = image_data
-            else:  # 假设是numpy数组
-                img = cv2.cvtColor(image_data, cv2.COLOR_BGR2RGB) if len(image_data.shape) == 3 else image_data
-                pil_img = Image.fromarray(img)
-                buf = io.BytesIO()
-                pil_img.save(buf, format='PNG')
-                img_bytes = buf.getvalue()
-            
-            base64_image = base64.b64encode(img_bytes).decode('utf-8')
-            # print("0000000000000")
-            # API 请求（使用高精度版以获取置信度和边界框）
-            ocr_url = f"https://aip.baidubce.com/rest/2.0/ocr/v1/accurate_basic?access_token={self.access_token}"
-            headers = {'Content-Type': 'application/x-www-form-urlencoded'}
-            data = {
-                'image': base64_image,
-                'language_type': self.language_type,
-                'detect_direction': 'true',  # 可选：检测方向
-                'probability': 'true'  # 启用置信度
-            }
-            
-            response = requests.post(ocr_url, headers=headers, data=data)
-            if response.status_code != 200:
-                raise ValueError(f"BaiduOCR HTTP错误: {response.status_code} - {response.text}")
-            # print("1111111111111")
-            result = response.json()
-            if 'error_code' in result:
-                raise ValueError(f"BaiduOCR API错误: {result.get('error_msg', '未知错误')}")
-            
-            # 转换为统一格式
-            ocr_results = []
-            for item in result.get('words_result', []):
-                text = item.get('words', '')
-                confidence = item.get('probability', {}).get('average', 0.0)
-                loc = item.get('location', {})
-                left, top, width, height = loc.get('left', 0), loc.get('top', 0), loc.get('width', 0), loc.get('height', 0)
-                # 转换为平坦四边形边界框（类似于EasyOCR）
-                bbox_flat = [left, top, left + width, top, left + width, top + height, left, top + height]
-                ocr_results.append(OCRResult(text, confidence, bbox_flat).to_dict())
-            
-            return ocr_results
+            request = self._build_request(image_data)
+            with stage("baidu_http"):
+                response = self._get_session().post(request['url'], headers=request['headers'], data=request['body'], timeout=self._timeouts())
+            result = response.json() if response.status_code == 200 else None
+            billed = _billable(response.status_code, result)
+            return self._parse_response(response.status_code, response.text, result)
         
+        except requests.RequestException as e:
+            # 超时、连接失败等网络错误可重试
+            logger.error(f"BaiduOCR请求失败: {str(e)}")
+            raise TransientOCRError(f"BaiduOCR请求失败: {str(e)}") from e
         except Exception as e:
             logger.error(f"BaiduOCR识别失败: {str(e)}")
             raise
+        finally:
+            if not billed:
+                self.quota.refund()
+    
+    async def recognize_text_async(self, image_data, priority: int = PRIORITY_INTERACTIVE, **kwargs) -> List[Dict[str, Any]]:
+        """使用BaiduOCR异步识别文字（非阻塞HTTP客户端），按QPS限流并检查当日额度"""
+        if not self.initialized:
+            raise RuntimeError("BaiduOCR引擎未正确初始化")
+        
+        # 额度不足时在排队前就拒绝，由路由层切换到其它引擎
+        await self.quota.consume_async(priority)
+        # 百度只对成功返回的识别计费：排队失败、token 获取失败、网络错误/超时、取消和错误响应都退回额度，
+        # 路由层重试和对冲的每次尝试各自扣减和退回
+        billed = False
+        try:
+            await self.scheduler.acquire(priority)
+            if not await self._get_access_token_async():
+                raise TransientOCRError("Access token 获取失败")
+            request = self._build_request(image_data)
+            with stage("baidu_http"):
+                response = await self._get_async_client().post(request['url'], headers=request['headers'], content=request['body'].aiter_chunks())
+            result = response.json() if response.status_code == 200 else None
+            billed = _billable(response.status_code, result)
+            return self._parse_response(response.status_code, response.text, result)
+        
+        except httpx.TransportError as e:
+            # 超时、连接失败等网络错误可重试
+            logger.error(f"BaiduOCR请求失败: {str(e)}")
+            raise TransientOCRError(f"BaiduOCR请求失败: {str(e)}") from e
+        except Exception as e:
+            logger.error(f"BaiduOCR识别失败: {str(e)}")
+            raise
+        finally:
+            if not billed:
+                self.quota.refund()
+    
+    async def aclose(self):
+        """停止后台刷新任务并关闭HTTP连接池"""
+        if self._refresher_task is not None:
+            self._refresher_task.cancel()
+            self._refresher_task = None
+        if self._session is not None:
+            self._session.close()
+            self._session = None
+        if self._async_client is not None:
+            await self._async_client.aclose()
+            self._async_client = None
     
     def get_engine_info(self) -> Dict[str, Any]:
         return {
             "name": "BaiduOCR",
             "version": "1.0.0",
             "languages": ["CHN_ENG", "ENG"],  # 支持的中英、英文等
+            "api": settings.baidu_ocr_api,
+            "rate_limit": self.scheduler.snapshot(),
+            "quota": self.quota.snapshot(),
             "initialized": self.initialized
-        }
\ No newline at end of file
+        }
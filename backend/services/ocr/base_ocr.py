@@ -1,13 +1,88 @@
 # OCR实现基类
 from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from typing import List, Dict, Any, Optional
-import base64
-from PIL import Image
-import io
+import asyncio
+import os
+import threading
+
+from core.config import settings
+
+# 请求优先级（数值越小越优先）：交互式单张上传优先于批量任务
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BATCH = 10
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def get_ocr_executor() -> ThreadPoolExecutor:
+    """获取同步/CPU密集型OCR调用共用的线程池（按配置大小懒加载）"""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                workers = settings.ocr_executor_workers or min(32, (os.cpu_count() or 1) + 4)
+                _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ocr")
+    return _executor
+
+
+def shutdown_ocr_executor():
+    """关闭OCR线程池"""
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False)
+            _executor = None
+
+
+class OCREngineError(RuntimeError):
+    """OCR引擎调用失败"""
+    pass
+
+
+class TransientOCRError(OCREngineError):
+    """可重试的临时错误（超时、限流、服务端错误等），路由层会重试或切换引擎"""
+    pass
+
+
+class EngineCapabilities:
+    """引擎能力与成本声明：路由层据此预处理图片，并为 engine=auto 的请求选择引擎"""
+    def __init__(self, max_image_bytes: Optional[int] = None, max_long_edge: Optional[int] = None,
+                 batch_size: int = 1, expected_latency: float = 1.0, cost_per_call: float = 0.0):
+        self.max_image_bytes = max_image_bytes  # 单张图片大小上限（字节），None 表示不限制
+        self.max_long_edge = max_long_edge  # 图片最长边上限（像素）
+        self.batch_size = batch_size  # 单次调用可识别的图片数，1 表示不支持多图批量
+        self.expected_latency = expected_latency  # 单张图片的预计识别耗时（秒）
+        self.cost_per_call = cost_per_call  # 单次调用成本（元），本地引擎为0
+    
+    def replace(self, **changes) -> "EngineCapabilities":
+        """返回修改了部分字段的副本（值为 None 的字段保持不变）"""
+        values = self.to_dict()
+        values.update({key: value for key, value in changes.items() if value is not None})
+        return EngineCapabilities(**values)
+    
+    def limits(self) -> Dict[str, Any]:
+        """图片预处理需要遵守的限制"""
+        return {"max_image_bytes": self.max_image_bytes, "max_long_edge": self.max_long_edge}
+    
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "max_image_bytes": self.max_image_bytes,
+            "max_long_edge": self.max_long_edge,
+            "batch_size": self.batch_size,
+            "expected_latency": self.expected_latency,
+            "cost_per_call": self.cost_per_call
+        }
+
 
 class BaseOCREngine(ABC):
     """OCR引擎基类，定义统一接口"""
     
+    # 子类按实际情况声明能力与成本
+    capabilities = EngineCapabilities()
+    
     @abstractmethod
     def initialize(self, **kwargs) -> bool:
         """初始化OCR引擎"""
@@ -18,6 +93,20 @@ class BaseOCREngine(ABC):
         """识别图片中的文字"""
         pass
     
+    async def recognize_text_async(self, image_data, priority: int = PRIORITY_INTERACTIVE, **kwargs) -> List[Dict[str, Any]]:
+        """异步识别图片中的文字，默认将同步实现放到线程池中执行，避免阻塞事件循环；
+        priority 供有限流的引擎安排请求顺序"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(get_ocr_executor(), partial(self.recognize_text, image_data, **kwargs))
+    
+    async def aclose(self):
+        """释放引擎持有的异步资源"""
+        pass
+    
+    def get_capabilities(self) -> EngineCapabilities:
+        """引擎能力与成本（可按初始化参数调整，如启用GPU后延迟更低）"""
+        return self.capabilities
+    
     @abstractmethod
     def get_engine_info(self) -> Dict[str, Any]:
         """获取引擎信息"""
@@ -35,4 +124,4 @@ class OCRResult:
             "text": self.text,
             "confidence": self.confidence,
             "bbox": self.bbox
-        }
\ No newline at end of file
+        }
@@ -0,0 +1,242 @@
+# OCR结果缓存（按图片内容哈希寻址）
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional, Tuple
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+# 共享存储中记录磁盘缓存总大小的键
+DISK_BYTES_KEY = "ocr_cache:disk_bytes"
+
+
+class OCRResultCache:
+    """两级OCR结果缓存：内存LRU + 带TTL和容量上限的磁盘缓存
+
+    磁盘缓存可由多个工作进程共用同一目录（原子替换写入）；传入 shared（core.shared_state.SharedStateStore）时
+    磁盘总大小也记在共享存储中，任一进程都能按所有进程写入的总量触发清理。
+    """
+
+    def __init__(self, max_entries: int = 512, disk_dir: Optional[str] = None,
+                 ttl: float = 7 * 24 * 3600, max_disk_bytes: int = 512 * 1024 * 1024, shared=None):
+        self.max_entries = max_entries
+        self.disk_dir = disk_dir or None
+        self.ttl = ttl
+        self.max_disk_bytes = max_disk_bytes
+        self._shared = shared
+        self._memory: "OrderedDict[str, Tuple[float, List[Dict[str, Any]]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk_bytes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+            self._set_disk_bytes(sum(size for _, size, _ in self._scan_disk()))
+
+    @staticmethod
+    def make_key(image_data: bytes, engine_name: str, options: Optional[Dict[str, Any]] = None,
+                 digest: Optional[str] = None) -> str:
+        """由图片内容哈希、引擎名和识别参数生成缓存键"""
+        digest = digest or hashlib.sha256(image_data).hexdigest()
+        opts = json.dumps(options or {}, sort_keys=True, default=str)
+        return hashlib.sha256(f"{digest}|{engine_name}|{opts}".encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[List[Dict[str, Any]]]:
+        """查询缓存，内存未命中时查询磁盘并回填内存"""
+        value = self._get_memory(key)
+        if value is None and self.disk_dir:
+            value = self._get_disk(key)
+            if value is not None:
+                self._set_memory(key, value)
+                with self._lock:
+                    self.disk_hits += 1
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def set(self, key: str, value: List[Dict[str, Any]]):
+        """写入缓存（内存和磁盘）"""
+        self._set_memory(key, value)
+        if self.disk_dir:
+            self._set_disk(key, value)
+
+    async def get_async(self, key: str) -> Optional[List[Dict[str, Any]]]:
+        """异步查询：启用磁盘缓存时在线程池中执行文件IO"""
+        if not self.disk_dir:
+            return self.get(key)
+        return await asyncio.get_running_loop().run_in_executor(None, self.get, key)
+
+    async def set_async(self, key: str, value: List[Dict[str, Any]]):
+        if not self.disk_dir:
+            self.set(key, value)
+            return
+        await asyncio.get_running_loop().run_in_executor(None, self.set, key, value)
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+        removed = sum(size for path, size, _ in self._scan_disk() if self._remove(path))
+        if removed:
+            self._add_disk_bytes(-removed)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "memory_entries": len(self._memory),
+                "max_entries": self.max_entries,
+                "disk_enabled": bool(self.disk_dir),
+                "disk_bytes": self._get_disk_bytes(),
+            }
+
+    # ---- 内存层 ----
+
+    def _get_memory(self, key: str) -> Optional[List[Dict[str, Any]]]:
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.time():
+                del self._memory[key]
+                return None
+            self._memory.move_to_end(key)
+            return value
+
+    def _set_memory(self, key: str, value: List[Dict[str, Any]]):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._memory[key] = (time.time() + self.ttl, value)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+                self.evictions += 1
+
+    # ---- 磁盘层 ----
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, key[:2], f"{key}.json")
+
+    def _get_disk(self, key: str) -> Optional[List[Dict[str, Any]]]:
+        path = self._path(key)
+        try:
+            if os.path.getmtime(path) + self.ttl < time.time():
+                self._discard(path)
+                return None
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning(f"读取OCR磁盘缓存失败 {path}: {str(e)}")
+            self._discard(path)
+            return None
+
+    def _set_disk(self, key: str, value: List[Dict[str, Any]]):
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(value, f, ensure_ascii=False)
+            size = os.path.getsize(tmp_path)
+            # 覆盖已有文件时只累加大小差
+            try:
+                size -= os.path.getsize(path)
+            except OSError:
+                pass
+            # 原子替换，避免并发读到写了一半的文件
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"写入OCR磁盘缓存失败 {path}: {str(e)}")
+            self._remove(tmp_path)
+            return
+        if self._add_disk_bytes(size) > self.max_disk_bytes:
+            self._evict_disk()
+
+    def _get_disk_bytes(self) -> int:
+        if self._shared is not None:
+            return self._shared.get(DISK_BYTES_KEY) or 0
+        return self._disk_bytes
+
+    def _set_disk_bytes(self, total: int):
+        if self._shared is not None:
+            self._shared.set(DISK_BYTES_KEY, total)
+            return
+        with self._lock:
+            self._disk_bytes = total
+
+    def _add_disk_bytes(self, size: int) -> int:
+        """累加磁盘缓存大小（删除文件时为负数），返回累加后的总量"""
+        if self._shared is not None:
+            return self._shared.update(DISK_BYTES_KEY, lambda total: (max(0, (total or 0) + size),) * 2)
+        with self._lock:
+            self._disk_bytes = max(0, self._disk_bytes + size)
+            return self._disk_bytes
+
+    def _scan_disk(self) -> List[Tuple[str, int, float]]:
+        """返回磁盘缓存文件列表 (路径, 大小, 修改时间)"""
+        entries = []
+        if not self.disk_dir or not os.path.isdir(self.disk_dir):
+            return entries
+        for root, _, names in os.walk(self.disk_dir):
+            for name in names:
+                if not name.endswith(".json"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((path, stat.st_size, stat.st_mtime))
+        return entries
+
+    def _evict_disk(self):
+        """清理过期文件，并按修改时间从旧到新删除直到低于容量上限的90%"""
+        entries = sorted(self._scan_disk(), key=lambda e: e[2])
+        total = sum(size for _, size, _ in entries)
+        target = self.max_disk_bytes * 0.9
+        now = time.time()
+        for path, size, mtime in entries:
+            if total <= target and mtime + self.ttl >= now:
+                continue
+            if self._remove(path):
+                total -= size
+                with self._lock:
+                    self.evictions += 1
+        self._set_disk_bytes(total)
+
+    def _discard(self, path: str):
+        """删除单个缓存文件（过期或损坏），并从磁盘总大小中扣除"""
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            return
+        if self._remove(path):
+            self._add_disk_bytes(-size)
+
+    @staticmethod
+    def _remove(path: str) -> bool:
+        try:
+            os.remove(path)
+            return True
+        except OSError:
+            return False
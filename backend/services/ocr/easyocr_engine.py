@@ -1,14 +1,14 @@
 # EasyOCR实现
-import easyocr
-import numpy as np
-import cv2
-from .base_ocr import BaseOCREngine, OCRResult
+from .base_ocr import BaseOCREngine, EngineCapabilities, OCRResult
 from typing import List, Dict, Any
 import logging
 
 logger = logging.getLogger(__name__)
 
 class EasyOCREngine(BaseOCREngine):
+    # 本地识别不计费；CPU上单张小票约数秒（canvas_size 默认2560，更大的图片会被缩小）
+    capabilities = EngineCapabilities(max_long_edge=2560, expected_latency=4.0, cost_per_call=0.0)
+    
     def __init__(self):
         self.reader = None
         self.initialized = False
@@ -16,6 +16,7 @@ class EasyOCREngine(BaseOCREngine):
     def initialize(self, languages: List[str] = ['ch_sim', 'en'], **kwargs) -> bool:
         """初始化EasyOCR阅读器[7,8](@ref)"""
         try:
+            import easyocr
             # 设置GPU参数，如果服务器有GPU可以设置为True
             gpu_enabled = kwargs.get('gpu', False)
             self.reader = easyocr.Reader(languages, gpu=gpu_enabled,detector=False)
@@ -39,6 +40,8 @@ class EasyOCREngine(BaseOCREngine):
                 results = self.reader.readtext(image_data, **kwargs)
             elif isinstance(image_data, bytes):
                 # 字节数据
+                import cv2
+                import numpy as np
                 nparr = np.frombuffer(image_data, np.uint8)
                 img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
                 results = self.reader.readtext(img, **kwargs)
@@ -0,0 +1,215 @@
+# EasyOCR进程池实现：每个工作进程启动时加载一次模型，识别任务在进程间分发
+from concurrent.futures import Future, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from typing import List, Dict, Any, Optional, Tuple
+import asyncio
+import logging
+import multiprocessing
+import os
+import threading
+import time
+
+from .base_ocr import BaseOCREngine, EngineCapabilities, OCRResult, TransientOCRError, get_ocr_executor, PRIORITY_INTERACTIVE
+
+logger = logging.getLogger(__name__)
+
+# 工作进程内的 easyocr.Reader（每个进程一个）
+_worker_reader = None
+
+
+def _init_worker(languages: List[str], gpu: bool):
+    """工作进程初始化：加载模型"""
+    global _worker_reader
+    import easyocr
+
+    _worker_reader = easyocr.Reader(languages, gpu=gpu)
+
+
+def _worker_ping(delay: float) -> int:
+    """预热任务，确保工作进程已启动并加载完模型"""
+    time.sleep(delay)
+    return os.getpid()
+
+
+def _worker_readtext(image_data, options: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """在工作进程中识别文字，返回统一格式的结果"""
+    import cv2
+    import numpy as np
+
+    if isinstance(image_data, bytes):
+        image_data = cv2.imdecode(np.frombuffer(image_data, np.uint8), cv2.IMREAD_COLOR)
+        if image_data is None:
+            raise ValueError("无法解码图片")
+    results = _worker_reader.readtext(image_data, **options)
+    ocr_results = []
+    for bbox, text, confidence in results:
+        bbox_flat = [int(point) for coord in bbox for point in coord]
+        ocr_results.append(OCRResult(text, float(confidence), bbox_flat).to_dict())
+    return ocr_results
+
+
+class EasyOCRPoolEngine(BaseOCREngine):
+    """基于进程池的EasyOCR引擎，CPU识别吞吐随核数扩展且不占用Web进程"""
+
+    capabilities = EngineCapabilities(max_long_edge=2560, expected_latency=4.0, cost_per_call=0.0)
+
+    def __init__(self):
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._slots: Optional[threading.BoundedSemaphore] = None
+        self._pending = 0
+        self._pending_lock = threading.Lock()
+        self._pool_lock = threading.Lock()
+        self.languages: List[str] = ['ch_sim', 'en']
+        self.gpu = False
+        self.workers = 1
+        self.max_queue = 0
+        self.queue_timeout = 10.0
+        self.initialized = False
+
+    def initialize(self, languages: List[str] = ['ch_sim', 'en'], **kwargs) -> bool:
+        """启动工作进程并等待模型加载完成"""
+        self.languages = languages
+        self.gpu = kwargs.get('gpu', False)
+        self.workers = max(1, kwargs.get('workers', 1))
+        self.max_queue = max(0, kwargs.get('max_queue', self.workers * 4))
+        self.queue_timeout = kwargs.get('queue_timeout', 10.0)
+        try:
+            self._pool = self._create_pool()
+            self._slots = threading.BoundedSemaphore(self.workers + self.max_queue)
+            warmup = [self._pool.submit(_worker_ping, 0.2) for _ in range(self.workers)]
+            done, not_done = wait(warmup, timeout=kwargs.get('startup_timeout', 600))
+            if not_done:
+                raise RuntimeError("工作进程启动超时")
+            for future in done:
+                future.result()
+            self.initialized = True
+            logger.info(f"EasyOCR进程池初始化成功: {self.workers} 个工作进程")
+            return True
+        except Exception as e:
+            logger.error(f"EasyOCR进程池初始化失败: {str(e)}")
+            self._shutdown_pool()
+            self.initialized = False
+            return False
+
+    def _create_pool(self) -> ProcessPoolExecutor:
+        # spawn: 避免 fork 复制Web进程中的线程和事件循环状态
+        return ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(self.languages, self.gpu)
+        )
+
+    def _rebuild_pool(self, broken: ProcessPoolExecutor):
+        """工作进程崩溃后进程池不可再用，重新创建（多个任务同时发现时只重建一次）"""
+        with self._pool_lock:
+            if self._pool is not broken or not self.initialized:
+                return
+            logger.error("EasyOCR工作进程异常退出，重新创建进程池")
+            broken.shutdown(wait=False, cancel_futures=True)
+            self._pool = self._create_pool()
+
+    def _acquire_slot(self, timeout: float):
+        if not self._slots.acquire(timeout=timeout):
+            raise RuntimeError("EasyOCR任务队列已满，请稍后重试")
+        with self._pending_lock:
+            self._pending += 1
+
+    def _release_slot(self, _future=None):
+        with self._pending_lock:
+            self._pending -= 1
+        self._slots.release()
+
+    def _submit(self, image_data, options: Dict[str, Any]) -> Tuple[Future, ProcessPoolExecutor]:
+        """提交识别任务（调用前已占用空位），返回 (future, 所用进程池)；提交失败时归还空位，任务结束时自动归还"""
+        pool = self._pool
+        try:
+            future = pool.submit(_worker_readtext, image_data, options)
+        except BrokenProcessPool as e:
+            self._release_slot()
+            self._rebuild_pool(pool)
+            raise TransientOCRError(f"EasyOCR工作进程异常退出: {str(e)}") from e
+        except BaseException:
+            self._release_slot()
+            raise
+        future.add_done_callback(self._release_slot)
+        return future, pool
+
+    def _check_broken(self, pool: ProcessPoolExecutor, error: Exception):
+        if isinstance(error, BrokenProcessPool):
+            self._rebuild_pool(pool)
+            raise TransientOCRError(f"EasyOCR工作进程异常退出: {str(error)}") from error
+
+    def recognize_text(self, image_data, **kwargs) -> List[Dict[str, Any]]:
+        """使用EasyOCR进程池识别文字（阻塞直到结果返回）"""
+        if not self.initialized:
+            raise RuntimeError("EasyOCR进程池未正确初始化")
+        self._acquire_slot(self.queue_timeout)
+        future, pool = self._submit(image_data, kwargs)
+        try:
+            return future.result()
+        except Exception as e:
+            logger.error(f"EasyOCR识别失败: {str(e)}")
+            self._check_broken(pool, e)
+            raise
+
+    async def _acquire_slot_async(self):
+        """队列已满时在线程中等待空位（带超时），形成背压；
+        等待的协程被取消（对冲请求落后、客户端断开）时线程仍会继续等待，取得的空位随即归还"""
+        waiter = get_ocr_executor().submit(self._acquire_slot, self.queue_timeout)
+        try:
+            await asyncio.wrap_future(waiter)
+        except asyncio.CancelledError:
+            waiter.add_done_callback(
+                lambda f: self._release_slot() if not f.cancelled() and f.exception() is None else None)
+            raise
+
+    async def recognize_text_async(self, image_data, priority: int = PRIORITY_INTERACTIVE, **kwargs) -> List[Dict[str, Any]]:
+        """异步识别：直接等待进程池的 future，不占用线程池"""
+        if not self.initialized:
+            raise RuntimeError("EasyOCR进程池未正确初始化")
+        # 有空位时立即提交，否则等待空位
+        if self._slots.acquire(blocking=False):
+            with self._pending_lock:
+                self._pending += 1
+        else:
+            await self._acquire_slot_async()
+        future, pool = self._submit(image_data, kwargs)
+        try:
+            return await asyncio.wrap_future(future)
+        except Exception as e:
+            logger.error(f"EasyOCR识别失败: {str(e)}")
+            self._check_broken(pool, e)
+            raise
+
+    def _shutdown_pool(self):
+        with self._pool_lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
+
+    async def aclose(self):
+        """关闭工作进程"""
+        self.initialized = False
+        self._shutdown_pool()
+
+    def get_capabilities(self) -> EngineCapabilities:
+        """排队的任务越多，新任务的预计耗时越长"""
+        with self._pending_lock:
+            pending = self._pending
+        rounds = 1 + max(0, pending - self.workers) / self.workers
+        return self.capabilities.replace(expected_latency=self.capabilities.expected_latency * rounds)
+
+    def get_engine_info(self) -> Dict[str, Any]:
+        with self._pending_lock:
+            pending = self._pending
+        return {
+            "name": "EasyOCR",
+            "version": "1.0.0",
+            "languages": self.languages,
+            "mode": "process_pool",
+            "workers": self.workers,
+            "max_queue": self.max_queue,
+            "pending": pending,
+            "initialized": self.initialized
+        }
@@ -0,0 +1,272 @@
+# 客户端限流：令牌桶 + 有界优先级队列 + 每日额度跟踪
+from typing import Dict, List, Any, Optional, Tuple
+import asyncio
+import datetime
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+from .base_ocr import OCREngineError, PRIORITY_INTERACTIVE
+
+logger = logging.getLogger(__name__)
+
+
+class QuotaExceededError(OCREngineError):
+    """当日调用额度已用完（或只剩保留给交互请求的额度）"""
+    pass
+
+
+class SchedulerQueueFullError(OCREngineError):
+    """限流队列已满或排队超时"""
+    pass
+
+
+# 共享额度计数保留两天，跨过零点时仍能读到前一天的记录
+QUOTA_STATE_TTL = 2 * 24 * 3600
+# 共享令牌桶长时间无人使用时过期，过期后视为满桶
+BUCKET_STATE_TTL = 3600
+
+
+class QuotaTracker:
+    """按自然日统计调用次数；limit 为 0 表示不限制
+
+    传入 shared（core.shared_state.SharedStateStore）时，计数保存在共享存储中，多个工作进程共用同一份额度；
+    本进程记住最近一次读写时看到的计数，用于快速拒绝（额度用尽不会自行恢复）和状态查询，不访问存储。
+    """
+
+    def __init__(self, daily_limit: int = 0, reserve_ratio: float = 0.0, shared=None, name: str = "quota"):
+        self.daily_limit = daily_limit
+        # 为交互请求保留的额度比例，剩余额度低于该值时拒绝批量请求
+        self.reserve = int(daily_limit * reserve_ratio)
+        self._shared = shared
+        self._name = name
+        self._day = datetime.date.today()
+        self._state = self._empty_state()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _empty_state() -> Dict[str, Any]:
+        return {"used": 0, "exhausted": False}
+
+    def _shared_key(self) -> str:
+        return f"{self._name}:{datetime.date.today().isoformat()}"
+
+    def _local_state(self) -> Dict[str, Any]:
+        """本进程的计数（共享模式下为最近一次看到的共享计数），跨过零点时清零；需持有 _lock"""
+        today = datetime.date.today()
+        if today != self._day:
+            self._day = today
+            self._state = self._empty_state()
+        return self._state
+
+    def _apply_shared(self, func, state: Optional[Dict[str, Any]]) -> Tuple[Dict[str, Any], Any]:
+        state = state or self._empty_state()
+        # 先记住读到的计数：func 拒绝（额度不足）时本进程之后也能直接拒绝
+        self._remember(state)
+        state, result = func(state)
+        self._remember(state)
+        return state, result
+
+    def _remember(self, state: Dict[str, Any]):
+        with self._lock:
+            self._local_state()
+            self._state = state
+
+    def _update(self, func) -> Any:
+        """对当天的计数执行 func(state) -> (新state, 返回值)（共享模式下会阻塞，只在线程中调用）"""
+        if self._shared is not None:
+            return self._shared.update(self._shared_key(), lambda state: self._apply_shared(func, state),
+                                       QUOTA_STATE_TTL)
+        with self._lock:
+            self._state, result = func(self._local_state())
+            return result
+
+    def _update_in_background(self, func):
+        """先更新本进程记住的计数，共享存储在后台写入（退回额度、标记用尽等不需要等待的操作）"""
+        if self._shared is None:
+            self._update(func)
+            return
+        with self._lock:
+            self._state, _ = func(self._local_state())
+        self._shared.submit(self._update, func)
+
+    def _consume(self, state: Dict[str, Any], priority: int) -> Tuple[Dict[str, Any], None]:
+        if state["exhausted"]:
+            raise QuotaExceededError("今日OCR调用额度已用完")
+        if self.daily_limit:
+            remaining = self.daily_limit - state["used"]
+            if remaining <= 0:
+                raise QuotaExceededError("今日OCR调用额度已用完")
+            if priority > PRIORITY_INTERACTIVE and remaining <= self.reserve:
+                raise QuotaExceededError("今日OCR剩余额度仅保留给交互请求")
+        return {**state, "used": state["used"] + 1}, None
+
+    def consume(self, priority: int = PRIORITY_INTERACTIVE):
+        """占用一次调用额度，额度不足时抛出 QuotaExceededError"""
+        self._update(lambda state: self._consume(state, priority))
+
+    async def consume_async(self, priority: int = PRIORITY_INTERACTIVE):
+        """consume 的异步版本：共享模式下先按本进程记住的计数快速拒绝，再在存储线程中扣减"""
+        if self._shared is None:
+            self.consume(priority)
+            return
+        with self._lock:
+            self._consume(self._local_state(), priority)
+        await self._shared.run_async(self.consume, priority)
+
+    def refund(self):
+        """请求未实际发出时退回占用的额度"""
+        self._update_in_background(lambda state: ({**state, "used": max(0, state["used"] - 1)}, None))
+
+    def mark_exhausted(self):
+        """服务端返回额度用尽时调用，当天不再发送请求"""
+        self._update_in_background(lambda state: ({**state, "exhausted": True}, None))
+
+    def remaining(self) -> Optional[int]:
+        return self._remaining(self._update(lambda state: (state, state)))
+
+    def _remaining(self, state: Dict[str, Any]) -> Optional[int]:
+        if state["exhausted"]:
+            return 0
+        return max(0, self.daily_limit - state["used"]) if self.daily_limit else None
+
+    def snapshot(self) -> Dict[str, Any]:
+        """额度概况（不访问共享存储，共享模式下为本进程最近一次看到的计数）"""
+        with self._lock:
+            state = dict(self._local_state())
+        return {
+            "daily_limit": self.daily_limit or None,
+            "used_today": state["used"],
+            "remaining": self._remaining(state),
+            "reserve": self.reserve,
+            "exhausted": state["exhausted"],
+            "shared": self._shared is not None
+        }
+
+
+def _take_tokens(bucket: Optional[Dict[str, float]], now: float, qps: float, burst: int,
+                 count: int = 1) -> Tuple[Dict[str, float], int, float]:
+    """令牌桶取最多 count 个令牌：返回 (新的桶状态, 取得的令牌数, 没取到时需要等待的秒数)"""
+    if bucket is None:
+        tokens = float(burst)
+    else:
+        tokens = min(burst, bucket["tokens"] + max(0.0, now - bucket["updated"]) * qps)
+    if tokens >= 1:
+        granted = min(count, int(tokens))
+        return {"tokens": tokens - granted, "updated": now}, granted, 0.0
+    return {"tokens": tokens, "updated": now}, 0, (1 - tokens) / qps
+
+
+class RequestScheduler:
+    """令牌桶限流，超出速率的请求进入有界优先级队列（数值越小优先级越高）
+
+    传入 shared 时令牌桶保存在共享存储中，多个工作进程合计不超过 qps：每次从共享令牌桶预取一小批令牌
+    （约 LEASE_SECONDS 秒的配额，不超过 burst），在本进程内存中逐个发放，过期未用完的令牌作废，
+    访问存储在专用线程中进行；排队仍在各进程内进行。
+    """
+
+    # 预取令牌的有效期（秒）
+    LEASE_SECONDS = 0.5
+
+    def __init__(self, qps: float, burst: int = 1, max_queue: int = 100, queue_timeout: float = 30.0,
+                 shared=None, name: str = "rate_limit"):
+        self.qps = qps
+        self.burst = max(1, burst)
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._shared = shared
+        self._name = name
+        self._bucket: Optional[Dict[str, float]] = None
+        self._leased = 0
+        self._lease_expires = 0.0
+        self._lease_size = max(1, min(self.burst, int(qps * self.LEASE_SECONDS)))
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self._dispatcher: Optional[asyncio.Task] = None
+
+    def _take_shared(self) -> Tuple[int, float]:
+        # 各进程的单调时钟不可比较，共享令牌桶使用系统时间
+        def take(bucket):
+            bucket, granted, wait = _take_tokens(bucket, time.time(), self.qps, self.burst, self._lease_size)
+            return bucket, (granted, wait)
+        return self._shared.update(self._name, take, BUCKET_STATE_TTL)
+
+    async def _take(self) -> float:
+        """取一个令牌，取得时返回 0，否则返回下一个令牌产生前需要等待的秒数"""
+        if self._shared is None:
+            self._bucket, granted, wait = _take_tokens(self._bucket, time.monotonic(), self.qps, self.burst)
+            return 0.0 if granted else wait
+        if self._leased > 0 and time.monotonic() < self._lease_expires:
+            self._leased -= 1
+            return 0.0
+        granted, wait = await self._shared.run_async(self._take_shared)
+        if not granted:
+            return wait
+        self._leased = granted - 1
+        self._lease_expires = time.monotonic() + self.LEASE_SECONDS
+        return 0.0
+
+    async def acquire(self, priority: int = PRIORITY_INTERACTIVE):
+        """获取一次发送许可；队列已满或等待超时时抛出 SchedulerQueueFullError"""
+        if self.qps <= 0:
+            return
+        if not self._waiters and await self._take() == 0:
+            return
+        if len(self._waiters) >= self.max_queue:
+            raise SchedulerQueueFullError("OCR请求排队已满，请稍后重试")
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), future))
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.ensure_future(self._dispatch())
+        try:
+            await asyncio.wait_for(asyncio.shield(future), self.queue_timeout)
+        except asyncio.TimeoutError:
+            future.cancel()
+            raise SchedulerQueueFullError("OCR请求排队超时，请稍后重试")
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+
+    async def _dispatch(self):
+        """按速率依次放行队列中的请求"""
+        while self._waiters:
+            # 清理队首已超时或被取消的等待者，避免为它们消耗令牌
+            while self._waiters and self._waiters[0][2].done():
+                heapq.heappop(self._waiters)
+            if not self._waiters:
+                break
+            wait = await self._take()
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+            # 共享模式下取令牌会让出事件循环，期间等待者可能已超时或被取消，令牌交给下一个仍在等待的请求
+            while self._waiters and self._waiters[0][2].done():
+                heapq.heappop(self._waiters)
+            if not self._waiters:
+                self._return_token()
+                break
+            _, _, future = heapq.heappop(self._waiters)
+            future.set_result(None)
+
+    def _return_token(self):
+        """退回取得后没有用上的令牌（共享模式下退回本进程预取的令牌，预取已过期时作废）"""
+        if self._shared is None:
+            if self._bucket is not None:
+                self._bucket = {**self._bucket, "tokens": min(float(self.burst), self._bucket["tokens"] + 1)}
+        elif time.monotonic() < self._lease_expires:
+            self._leased += 1
+
+    def queue_depth(self) -> int:
+        return sum(1 for _, _, future in self._waiters if not future.done())
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "qps": self.qps,
+            "burst": self.burst,
+            "queue_depth": self.queue_depth(),
+            "max_queue": self.max_queue,
+            "shared": self._shared is not None
+        }
@@ -0,0 +1,105 @@
+# 引擎注册表：内置引擎、配置（OCR_ENGINE_PLUGINS）和Python入口点（gootool.ocr_engines）声明的引擎，
+# 只在引擎启用（OCR_ENGINES）时才导入其实现模块，避免加载未使用的重量级依赖
+from typing import Dict, Any, Optional
+import importlib
+import importlib.metadata
+import logging
+
+from .base_ocr import BaseOCREngine
+from core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# 第三方包在 pyproject.toml 中声明：[project.entry-points."gootool.ocr_engines"] 名称 = "模块:类名"
+ENTRY_POINT_GROUP = "gootool.ocr_engines"
+
+
+class EngineSpec:
+    """引擎声明：名称、实现类（"模块:类名"）、初始化参数和来源"""
+    def __init__(self, name: str, target: str, options: Optional[Dict[str, Any]] = None, source: str = "builtin"):
+        self.name = name
+        self.target = target
+        self.options = options or {}
+        self.source = source
+
+    def create(self) -> BaseOCREngine:
+        """导入并实例化引擎类"""
+        module_name, _, class_name = self.target.partition(":")
+        if not class_name:
+            raise ValueError(f"引擎 {self.name} 的实现类格式应为 模块:类名，实际为 {self.target}")
+        engine_class = getattr(importlib.import_module(module_name), class_name)
+        if not (isinstance(engine_class, type) and issubclass(engine_class, BaseOCREngine)):
+            raise TypeError(f"引擎 {self.name} 的实现类 {self.target} 未继承 BaseOCREngine")
+        return engine_class()
+
+
+def builtin_engines() -> Dict[str, EngineSpec]:
+    """内置引擎及其按配置生成的初始化参数"""
+    languages = ['ch_sim', 'en']
+    if settings.easyocr_mode == "inline":
+        easyocr = EngineSpec("easyocr", "services.ocr.easyocr_engine:EasyOCREngine",
+                             {"languages": languages, "gpu": settings.easyocr_gpu})
+    else:
+        easyocr = EngineSpec("easyocr", "services.ocr.easyocr_pool_engine:EasyOCRPoolEngine", {
+            "languages": languages,
+            "gpu": settings.easyocr_gpu,
+            "workers": settings.easyocr_workers,
+            "max_queue": settings.easyocr_max_queue,
+            "queue_timeout": settings.easyocr_queue_timeout
+        })
+    return {
+        "baiduocr": EngineSpec("baiduocr", "services.ocr.baidu_ocr_engine:BaiduOCREngine", {"languages": languages}),
+        "easyocr": easyocr
+    }
+
+
+def _entry_points():
+    """读取入口点声明（只读取元数据，不导入模块）"""
+    try:
+        return importlib.metadata.entry_points(group=ENTRY_POINT_GROUP)
+    except TypeError:
+        # Python 3.9 及更早版本不支持按组筛选
+        return importlib.metadata.entry_points().get(ENTRY_POINT_GROUP, [])
+
+
+class EngineRegistry:
+    """汇总所有已声明的引擎；同名时配置声明优先于入口点，入口点优先于内置引擎"""
+
+    def __init__(self):
+        self._specs: Optional[Dict[str, EngineSpec]] = None
+
+    def register(self, spec: EngineSpec):
+        """在代码中注册引擎（需在引擎初始化前调用）"""
+        self.specs()[spec.name] = spec
+
+    def specs(self) -> Dict[str, EngineSpec]:
+        if self._specs is None:
+            self._specs = self._discover()
+        return self._specs
+
+    @staticmethod
+    def _discover() -> Dict[str, EngineSpec]:
+        specs = builtin_engines()
+        try:
+            for entry_point in _entry_points():
+                specs[entry_point.name] = EngineSpec(entry_point.name, entry_point.value, source="entry_point")
+        except Exception as e:
+            logger.error(f"读取OCR引擎入口点失败: {str(e)}")
+        for name, target in settings.ocr_engine_plugins.items():
+            specs[name] = EngineSpec(name, target, source="config")
+        return specs
+
+    def enabled(self) -> Dict[str, EngineSpec]:
+        """按 OCR_ENGINES 的顺序返回需要启用的引擎，未声明的名称记录错误后跳过"""
+        specs = self.specs()
+        enabled = {}
+        for name in settings.ocr_engines:
+            if name in specs:
+                enabled[name] = specs[name]
+            else:
+                logger.error(f"未找到OCR引擎 {name}，可选: {', '.join(sorted(specs))}")
+        return enabled
+
+
+# 全局引擎注册表
+engine_registry = EngineRegistry()
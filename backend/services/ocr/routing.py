@@ -0,0 +1,239 @@
+# 多引擎路由：主引擎 + 备用引擎、对冲请求、熔断器、带抖动的退避重试
+from typing import Awaitable, Callable, Dict, List, Any, Optional, Tuple
+import asyncio
+import logging
+import math
+import random
+import threading
+import time
+
+from .base_ocr import EngineCapabilities, OCREngineError, TransientOCRError
+from core.metrics import registry, Counter
+
+logger = logging.getLogger(__name__)
+
+ROUTER_EVENTS = registry.register(Counter(
+    "gootool_ocr_router_events_total", "OCR路由事件（重试/对冲/故障转移/熔断拒绝）", ("event", "engine")))
+
+# 实测耗时的平滑系数，以及实测值的有效时间（秒）：长时间未被使用的引擎逐渐回到声明的预计耗时，
+# 避免一次慢请求后再也不被选中
+LATENCY_EWMA_ALPHA = 0.2
+LATENCY_MEMORY = 60.0
+
+# 熔断器状态
+CIRCUIT_CLOSED = "closed"
+CIRCUIT_OPEN = "open"
+CIRCUIT_HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(OCREngineError):
+    """引擎处于熔断状态，暂时不接受请求"""
+    pass
+
+
+class CircuitBreaker:
+    """连续失败达到阈值后熔断，冷却时间后放行一个试探请求"""
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CIRCUIT_CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow_request(self) -> bool:
+        with self._lock:
+            if self.state == CIRCUIT_CLOSED:
+                return True
+            if self.state == CIRCUIT_OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = CIRCUIT_HALF_OPEN
+                self._trial_in_flight = False
+            if self.state == CIRCUIT_HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def is_available(self) -> bool:
+        """只读检查（不占用半开状态的试探名额）"""
+        with self._lock:
+            if self.state == CIRCUIT_OPEN:
+                return time.monotonic() - self.opened_at >= self.reset_timeout
+            return self.state == CIRCUIT_CLOSED or not self._trial_in_flight
+
+    def record_success(self):
+        with self._lock:
+            self.state = CIRCUIT_CLOSED
+            self.failures = 0
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == CIRCUIT_HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = CIRCUIT_OPEN
+                self.opened_at = time.monotonic()
+                self._trial_in_flight = False
+
+    def release_trial(self):
+        """试探请求没有得出结论（被取消或非引擎故障的错误）时，归还半开状态的试探名额，状态保持不变"""
+        with self._lock:
+            self._trial_in_flight = False
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"state": self.state, "failures": self.failures}
+
+
+class RoutingPolicy:
+    """路由策略配置"""
+
+    def __init__(self, fallbacks: Optional[List[str]] = None, hedge_after: float = 0.0, max_retries: int = 2,
+                 backoff_base: float = 0.2, backoff_max: float = 2.0,
+                 breaker_threshold: int = 5, breaker_reset: float = 30.0):
+        self.fallbacks = fallbacks or []
+        self.hedge_after = hedge_after  # 主请求超过该时间（秒）未返回时并行请求下一个引擎，0 表示关闭
+        self.max_retries = max_retries  # 临时错误的重试次数
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.breaker_threshold = breaker_threshold
+        self.breaker_reset = breaker_reset
+
+
+class EngineRouter:
+    """按策略在多个引擎间调度一次识别请求"""
+
+    def __init__(self, policy: RoutingPolicy):
+        self.policy = policy
+        self.breakers: Dict[str, CircuitBreaker] = {}
+        # 各引擎成功调用的平滑耗时 (秒, 记录时间)
+        self.latencies: Dict[str, Tuple[float, float]] = {}
+
+    def breaker(self, engine_name: str) -> CircuitBreaker:
+        if engine_name not in self.breakers:
+            self.breakers[engine_name] = CircuitBreaker(self.policy.breaker_threshold, self.policy.breaker_reset)
+        return self.breakers[engine_name]
+
+    def candidates(self, primary: str, available: List[str]) -> List[str]:
+        """主引擎 + 已就绪的备用引擎（去重、保持顺序）"""
+        order = []
+        for name in [primary] + self.policy.fallbacks:
+            if name in available and name not in order:
+                order.append(name)
+        return order
+
+    def record_latency(self, engine_name: str, seconds: float):
+        previous = self.latencies.get(engine_name)
+        if previous is not None:
+            seconds = previous[0] + LATENCY_EWMA_ALPHA * (seconds - previous[0])
+        self.latencies[engine_name] = (seconds, time.monotonic())
+
+    def expected_latency(self, engine_name: str, declared: float) -> float:
+        """预计耗时：实测值随时间衰减回引擎声明的值"""
+        observed = self.latencies.get(engine_name)
+        if observed is None:
+            return declared
+        weight = math.exp(-(time.monotonic() - observed[1]) / LATENCY_MEMORY)
+        return declared + (observed[0] - declared) * weight
+
+    def rank(self, available: List[str], capabilities: Dict[str, EngineCapabilities],
+             latency_budget: float) -> List[str]:
+        """为 engine=auto 的请求排列候选引擎：预计耗时在预算内的引擎按成本从低到高（同成本时更快的优先），
+        超出预算的按预计耗时排在后面作为备用，熔断中的引擎排在最后"""
+        def sort_key(name: str):
+            caps = capabilities.get(name) or EngineCapabilities()
+            latency = self.expected_latency(name, caps.expected_latency)
+            fast_enough = latency <= latency_budget
+            return (not self.breaker(name).is_available(), not fast_enough,
+                    caps.cost_per_call if fast_enough else 0.0, latency)
+        return sorted(available, key=sort_key)
+
+    async def run(self, candidates: List[str],
+                  attempt: Callable[[str], Awaitable[List[Dict[str, Any]]]]) -> Tuple[str, List[Dict[str, Any]]]:
+        """依次/对冲调用候选引擎，返回 (实际使用的引擎, 识别结果)"""
+        queue = [name for name in candidates if self.breaker(name).is_available()]
+        if not queue:
+            raise CircuitOpenError(f"OCR引擎均处于熔断状态: {', '.join(candidates)}")
+
+        pending: Dict[asyncio.Task, str] = {}
+        errors: List[str] = []
+        hedged = False
+
+        def launch() -> bool:
+            while queue:
+                name = queue.pop(0)
+                if self.breaker(name).is_available():
+                    pending[asyncio.ensure_future(self._attempt_with_retries(name, attempt))] = name
+                    return True
+                ROUTER_EVENTS.inc(event="circuit_rejected", engine=name)
+            return False
+
+        launch()
+        try:
+            while pending:
+                timeout = None
+                if self.policy.hedge_after > 0 and not hedged and queue:
+                    timeout = self.policy.hedge_after
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    # 主请求过慢：并行发起对冲请求，取先返回的结果
+                    hedged = True
+                    if launch():
+                        ROUTER_EVENTS.inc(event="hedge", engine=list(pending.values())[-1])
+                    continue
+                for task in done:
+                    name = pending.pop(task)
+                    error = task.exception()
+                    if error is None:
+                        return name, task.result()
+                    errors.append(f"{name}: {error}")
+                if not pending and queue:
+                    if launch():
+                        ROUTER_EVENTS.inc(event="failover", engine=list(pending.values())[-1])
+        finally:
+            for task in pending:
+                task.cancel()
+
+        raise errors_to_exception(errors)
+
+    async def _attempt_with_retries(self, engine_name: str,
+                                    attempt: Callable[[str], Awaitable[List[Dict[str, Any]]]]) -> List[Dict[str, Any]]:
+        """调用单个引擎，临时错误时按指数退避（全抖动）重试"""
+        breaker = self.breaker(engine_name)
+        for retry in range(self.policy.max_retries + 1):
+            if not breaker.allow_request():
+                ROUTER_EVENTS.inc(event="circuit_rejected", engine=engine_name)
+                raise CircuitOpenError(f"OCR引擎 {engine_name} 已熔断")
+            started = time.monotonic()
+            try:
+                result = await attempt(engine_name)
+            except TransientOCRError as e:
+                breaker.record_failure()
+                if retry >= self.policy.max_retries:
+                    raise
+                delay = random.uniform(0, min(self.policy.backoff_max, self.policy.backoff_base * (2 ** retry)))
+                logger.warning(f"OCR引擎 {engine_name} 临时错误，{delay:.2f}s 后重试: {str(e)}")
+                ROUTER_EVENTS.inc(event="retry", engine=engine_name)
+                await asyncio.sleep(delay)
+                continue
+            except OCREngineError:
+                # 非临时错误（如图片格式不支持、鉴权失败）不计入熔断，但也不代表引擎已恢复，熔断状态保持不变
+                breaker.release_trial()
+                raise
+            except Exception:
+                breaker.record_failure()
+                raise
+            except BaseException:
+                # 对冲请求中落后的一方被取消、客户端断开等：不能占着半开状态的试探名额，否则引擎永远不可用
+                breaker.release_trial()
+                raise
+            breaker.record_success()
+            self.record_latency(engine_name, time.monotonic() - started)
+            return result
+
+
+def errors_to_exception(errors: List[str]) -> OCREngineError:
+    if len(errors) == 1:
+        return OCREngineError(errors[0])
+    return OCREngineError("所有OCR引擎均识别失败: " + "; ".join(errors))
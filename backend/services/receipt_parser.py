@@ -1,116 +1,266 @@
 # 小票解析核心逻辑
 import re
-from typing import List, Dict, Any, Optional
+from typing import Iterable, List, Dict, Any, Optional, FrozenSet
 from datetime import datetime
 import logging
 
+from services.layout_parser import analyze_layout, extract_payment, PAYMENT_SOURCES
+
 logger = logging.getLogger(__name__)
 
+# 行类型
+LINE_STORE = "store"
+LINE_DATETIME = "datetime"
+LINE_TOTAL = "total"
+LINE_ITEM = "item"
+LINE_NOISE = "noise"
+
+# 解析结果的字段（按输出顺序）
+RECEIPT_FIELDS = ("store_name", "transaction_date", "transaction_time", "total_amount", "items", "raw_lines", "confidence")
+# 只有微信/支付宝截图才有的字段：来源、支付方式、交易单号
+PAYMENT_FIELDS = ("source", "payment_method", "transaction_id")
+ALL_FIELDS = frozenset(RECEIPT_FIELDS + PAYMENT_FIELDS)
+
+
+def resolve_fields(columns: Optional[Iterable[str]]) -> FrozenSet[str]:
+    """将用户请求的列换算为需要提取的结果字段，未请求的字段不做提取
+
+    列可以重复传参，也可以逗号分隔；不是结果字段的列（如 name、price）视为商品明细中的列。
+    """
+    if not columns:
+        return ALL_FIELDS
+    fields = set()
+    for column in columns:
+        for name in column.split(","):
+            name = name.strip()
+            if name:
+                fields.add(name if name in ALL_FIELDS else "items")
+    return frozenset(fields) or ALL_FIELDS
+
+
+class ReceiptItems:
+    """商品明细的列式存储：每列一个数组，比每个商品一个字典占用更少内存"""
+    __slots__ = ("names", "prices", "quantities")
+
+    def __init__(self):
+        self.names: List[str] = []
+        self.prices: List[float] = []
+        self.quantities: List[int] = []
+
+    def append(self, name: str, price: float, quantity: int = 1):
+        self.names.append(name)
+        self.prices.append(price)
+        self.quantities.append(quantity)
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def to_records(self) -> List[Dict[str, Any]]:
+        """转为每个商品一个字典（接口返回格式）"""
+        return [{"name": name, "price": price, "quantity": quantity}
+                for name, price, quantity in zip(self.names, self.prices, self.quantities)]
+
+    def to_columns(self) -> Dict[str, List[Any]]:
+        return {"name": self.names, "price": self.prices, "quantity": self.quantities}
+
+
+class ParsedReceipt:
+    """解析结果；未请求的字段为 None"""
+    __slots__ = RECEIPT_FIELDS + PAYMENT_FIELDS + ("fields",)
+
+    def __init__(self, fields: FrozenSet[str] = ALL_FIELDS, **values):
+        self.fields = fields
+        for name in RECEIPT_FIELDS + PAYMENT_FIELDS:
+            setattr(self, name, values.get(name))
+
+    def to_dict(self) -> Dict[str, Any]:
+        """只输出已提取的字段，商品明细转为字典列表；支付截图额外输出 PAYMENT_FIELDS"""
+        names = RECEIPT_FIELDS + PAYMENT_FIELDS if self.source else RECEIPT_FIELDS
+        data = {}
+        for name in names:
+            if name in self.fields:
+                value = getattr(self, name)
+                data[name] = value.to_records() if name == "items" else value
+        return data
+
+
+def _keyword_regex(keywords: List[str], flags: int = 0) -> "re.Pattern":
+    """将关键词列表合并为一个正则（长词优先），一次扫描即可判断是否命中任意关键词"""
+    return re.compile("|".join(re.escape(k) for k in sorted(set(keywords), key=len, reverse=True)), flags)
+
+
 class ReceiptParser:
     """购物小票解析器"""
-    
+
     def __init__(self):
         # 常见商店关键词
         self.store_keywords = ['超市', '商场', '便利店', '百货', '市场', 'store', 'market', 'mart']
+        # 商店名称中常见的公司后缀
+        self.company_keywords = ['有限公司', '公司', '专卖店', '分店']
+        # 总金额关键词（不区分大小写）
+        self.total_keywords = ['合计', '总计', '总额', '金额', '应收', 'total', 'amount', 'sum']
+        # 明显不是商品的行
+        self.skip_keywords = ['合计', '总计', '收款', '找零', '欢迎']
         # 金额模式
         self.amount_pattern = r'(\d+\.\d{2})|(\d+[\.\,]\d{2})'
         # 日期模式
         self.date_pattern = r'(\d{4}[-/年]\d{1,2}[-/月]\d{1,2})|(\d{1,2}[-/]\d{1,2}[-/]\d{4})'
         # 时间模式
         self.time_pattern = r'(\d{1,2}:\d{2}:\d{2})|(\d{1,2}:\d{2})'
-    
-    def parse_receipt_text(self, ocr_results: List[Dict[str, Any]]) -> Dict[str, Any]:
-        """解析OCR结果，提取结构化信息[2,5](@ref)"""
-        lines = [result['text'].strip() for result in ocr_results if result['text'].strip()]
-        
-        parsed_data = {
-            "store_name": self._extract_store_name(lines),
-            "transaction_date": self._extract_date(lines),
-            "transaction_time": self._extract_time(lines),
-            "total_amount": self._extract_total_amount(lines),
-            "items": self._extract_items(lines),
-            "raw_lines": lines,
-            "confidence": sum(r.get('confidence', 0) for r in ocr_results) / len(ocr_results) if ocr_results else 0
-        }
-        
-        return parsed_data
-    
-    def _extract_store_name(self, lines: List[str]) -> Optional[str]:
-        """提取商店名称"""
-        for i, line in enumerate(lines[:3]):  # 通常在前三行
-            for keyword in self.store_keywords:
-                if keyword in line:
-                    return line
-            # 检查是否包含特定模式
-            if any(word in line for word in ['有限公司', '公司', '专卖店', '分店']):
-                return line
-        return lines[0] if lines else "未知商店"
-    
-    def _extract_date(self, lines: List[str]) -> Optional[str]:
-        """提取日期"""
-        for line in lines:
-            date_match = re.search(self.date_pattern, line)
-            if date_match:
-                return date_match.group()
-        return None
-    
-    def _extract_time(self, lines: List[str]) -> Optional[str]:
-        """提取时间"""
-        for line in lines:
-            time_match = re.search(self.time_pattern, line)
-            if time_match:
-                return time_match.group()
-        return None
-    
-    def _extract_total_amount(self, lines: List[str]) -> Optional[float]:
-        """提取总金额[5](@ref)"""
-        total_keywords = ['合计', '总计', '总额', '金额', '应收', 'total', 'amount', 'sum']
-        
-        for line in reversed(lines):  # 从后往前找，通常总金额在最后
-            line_lower = line.lower()
-            if any(keyword in line_lower for keyword in total_keywords):
-                amount_match = re.search(self.amount_pattern, line)
-                if amount_match:
-                    try:
-                        return float(amount_match.group().replace(',', '.'))
-                    except ValueError:
-                        continue
-        
-        # 如果没有找到关键词，尝试找最大的数字
-        amounts = []
-        for line in lines:
-            amount_matches = re.findall(self.amount_pattern, line)
-            for match in amount_matches:
-                matched_value = match[0] if match[0] else match[1]
-                try:
-                    amount = float(matched_value.replace(',', '.'))
-                    amounts.append(amount)
-                except ValueError:
-                    continue
-        
-        return max(amounts) if amounts else None
-    
-    def _extract_items(self, lines: List[str]) -> List[Dict[str, Any]]:
-        """提取商品信息[5](@ref)"""
-        items = []
-        item_pattern = r'^(.+?)\s+(\d+\.\d{2})\s*$'
-        
-        for line in lines:
-            # 跳过明显不是商品的行
-            if any(keyword in line for keyword in ['合计', '总计', '收款', '找零', '欢迎']):
+        # 商品模式：商品名 价格（行尾以空白分隔的价格）
+        self.price_pattern = r'\d+\.\d{2}'
+
+        # 所有规则只编译一次
+        self._amount_re = re.compile(self.amount_pattern)
+        self._date_re = re.compile(self.date_pattern)
+        self._time_re = re.compile(self.time_pattern)
+        self._price_re = re.compile(self.price_pattern)
+        self._store_re = _keyword_regex(self.store_keywords + self.company_keywords)
+        self._total_re = _keyword_regex(self.total_keywords)
+        self._skip_re = _keyword_regex(self.skip_keywords)
+
+    def parse_receipt_text(self, ocr_results: List[Dict[str, Any]],
+                           fields: FrozenSet[str] = ALL_FIELDS) -> Dict[str, Any]:
+        """解析OCR结果，提取结构化信息[2,5](@ref)；fields 为需要的字段（见 resolve_fields）"""
+        return self.parse(ocr_results, fields).to_dict()
+
+    def parse(self, ocr_results: List[Dict[str, Any]], fields: FrozenSet[str] = ALL_FIELDS) -> ParsedReceipt:
+        """解析OCR结果为紧凑的 ParsedReceipt，只运行所需字段的提取逻辑
+
+        先按文字框位置还原行并判断单据类型：微信/支付宝截图交给 标签-值 提取，
+        其余按小票逐行规则解析（同一行的商品名和价格框已合并为一行）。
+        """
+        document = analyze_layout(ocr_results)
+        lines = document.lines
+
+        confidence = None
+        if "confidence" in fields:
+            confidence = sum(r.get('confidence', 0) for r in ocr_results) / len(ocr_results) if ocr_results else 0
+
+        if document.source in PAYMENT_SOURCES:
+            return self._parse_payment(document, lines, fields, confidence)
+
+        scan = self._scan_lines(lines, fields)
+
+        return ParsedReceipt(
+            fields,
+            store_name=scan["store_name"],
+            transaction_date=scan["date"],
+            transaction_time=scan["time"],
+            total_amount=scan["total_amount"],
+            items=scan["items"],
+            raw_lines=lines if "raw_lines" in fields else None,
+            confidence=confidence
+        )
+
+    def _parse_payment(self, document, lines: List[str], fields: FrozenSet[str],
+                       confidence: Optional[float]) -> ParsedReceipt:
+        """支付截图：整笔支付作为一个商品行，金额即总额"""
+        values = extract_payment(document)
+        items = None
+        if "items" in fields:
+            items = ReceiptItems()
+            for name, price in values["items"]:
+                items.append(name, price)
+        return ParsedReceipt(
+            fields,
+            store_name=values["store_name"],
+            transaction_date=values["transaction_date"],
+            transaction_time=values["transaction_time"],
+            total_amount=values["total_amount"],
+            items=items,
+            raw_lines=lines if "raw_lines" in fields else None,
+            confidence=confidence,
+            source=document.source,
+            payment_method=values["payment_method"],
+            transaction_id=values["transaction_id"]
+        )
+
+    def classify_lines(self, lines: List[str]) -> List[str]:
+        """返回每一行的类型：store / datetime / total / item / noise"""
+        return self._scan_lines(lines)["line_types"]
+
+    def _scan_lines(self, lines: List[str], fields: FrozenSet[str] = ALL_FIELDS) -> Dict[str, Any]:
+        """单次遍历所有行，同时完成行分类和各字段提取；不在 fields 中的字段跳过提取（结果为 None）"""
+        store_name = None
+        date = None
+        time = None
+        keyword_total = None  # 最后一个带总额关键词的金额（总金额通常在最后）
+        amount_lines = []  # 没有总额关键词时退回到所有金额中的最大值
+        items = ReceiptItems() if "items" in fields else None
+        line_types = []
+        if items is not None:
+            # 直接写入各列，省去每个商品一次方法调用
+            add_name, add_price, add_quantity = items.names.append, items.prices.append, items.quantities.append
+        date_re, time_re, amount_re = self._date_re, self._time_re, self._amount_re
+        price_re, total_re, skip_re = self._price_re, self._total_re, self._skip_re
+        # 已找到或不需要的字段不再匹配
+        want_store = "store_name" in fields
+        want_date = "transaction_date" in fields
+        want_time = "transaction_time" in fields
+        want_total = "total_amount" in fields
+        want_amounts = want_total or items is not None
+
+        for index, line in enumerate(lines):
+            line_type = LINE_NOISE
+
+            # 商店名称通常在前三行
+            if want_store and index < 3 and self._store_re.search(line):
+                store_name = line
+                line_type = LINE_STORE
+                want_store = False
+
+            if want_date:
+                date_match = date_re.search(line)
+                if date_match:
+                    date = date_match.group()
+                    line_type = LINE_DATETIME
+                    want_date = False
+            if want_time:
+                time_match = time_re.search(line)
+                if time_match:
+                    time = time_match.group()
+                    line_type = LINE_DATETIME
+                    want_time = False
+
+            # 金额必须包含小数点或逗号，先用字符串查找过滤掉大部分行
+            if not want_amounts or ('.' not in line and ',' not in line):
+                line_types.append(line_type)
                 continue
-            
-            # 尝试匹配商品模式：商品名 价格
-            match = re.match(item_pattern, line.strip())
-            if match:
-                name, price = match.groups()
-                try:
-                    items.append({
-                        "name": name.strip(),
-                        "price": float(price),
-                        "quantity": 1  # 默认数量为1
-                    })
-                except ValueError:
-                    continue
-        
-        return items
\ No newline at end of file
+
+            if want_total:
+                amount_lines.append(line)
+                if total_re.search(line.lower()):
+                    amount_match = amount_re.search(line)
+                    if amount_match:
+                        keyword_total = float(amount_match.group().replace(',', '.'))
+                        line_type = LINE_TOTAL
+
+            # 商品行：商品名 价格（以价格结尾，跳过合计、找零等行）
+            if items is not None and len(line) > 4 and line[-3] == '.':
+                parts = line.rsplit(None, 1)
+                if len(parts) == 2 and price_re.fullmatch(parts[1]) and not skip_re.search(line):
+                    add_name(parts[0])
+                    add_price(float(parts[1]))
+                    add_quantity(1)  # 默认数量为1
+                    if line_type != LINE_TOTAL:
+                        line_type = LINE_ITEM
+
+            line_types.append(line_type)
+
+        total_amount = keyword_total
+        if want_total and total_amount is None:
+            amounts = [float((m[0] or m[1]).replace(',', '.')) for line in amount_lines for m in amount_re.findall(line)]
+            total_amount = max(amounts) if amounts else None
+
+        if store_name is None and "store_name" in fields:
+            store_name = lines[0] if lines else "未知商店"
+
+        return {
+            "store_name": store_name,
+            "date": date,
+            "time": time,
+            "total_amount": total_amount,
+            "items": items,
+            "line_types": line_types
+        }
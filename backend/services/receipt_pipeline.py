@@ -0,0 +1,108 @@
+# 单张小票的处理流程：OCR识别 -> 解析，供同步批量接口与后台任务共用
+from typing import FrozenSet, Iterable, List, Dict, Any, Optional
+import logging
+
+from core.config import settings
+from core.metrics import stage
+from services.ocr import ocr_manager, PRIORITY_INTERACTIVE
+from services.data_processor import receipt_rows
+from services.dedup import ImageDeduplicator, mark_duplicate, DUPLICATE_IMAGE
+from services.receipt_parser import ReceiptParser, resolve_fields, ALL_FIELDS
+from services.refinement import refine_ocr_results
+from utils.helpers import UploadedImage
+
+logger = logging.getLogger(__name__)
+receipt_parser = ReceiptParser()
+
+
+# 合并支付表格和结果摘要所需的字段；原始文本行（raw_lines）只在请求时返回
+TABLE_FIELDS = ALL_FIELDS - {"raw_lines"}
+
+
+def table_fields(columns: Optional[List[str]]) -> FrozenSet[str]:
+    """批量/任务接口需要提取的字段：表格字段 + 用户额外请求的列"""
+    return TABLE_FIELDS | resolve_fields(columns) if columns else TABLE_FIELDS
+
+
+def new_deduplicator() -> Optional[ImageDeduplicator]:
+    """每个批量请求/任务使用一个去重器（OCR_DEDUP_ENABLED 关闭时为 None）"""
+    return ImageDeduplicator() if settings.dedup_enabled else None
+
+
+async def process_image(upload: UploadedImage, engine: str, priority: int = PRIORITY_INTERACTIVE,
+                        fields: FrozenSet[str] = TABLE_FIELDS, dedup: Optional[ImageDeduplicator] = None,
+                        index: int = 0) -> Dict[str, Any]:
+    """识别并解析单张图片，失败时返回错误状态而不是抛出异常
+
+    传入 dedup 时先与同批已登记的图片比较，内容完全相同的图片不调用OCR，直接标记为 duplicate；
+    外观相近的图片照常识别，记录 similar_to 供合并时参考。
+    返回格式: {"file", "status": "ok"/"error"/"duplicate", "error", "parsed", "engine_used", "image_stats"}
+    """
+    result = {"file": upload.filename, "status": "ok", "parsed": None}
+    try:
+        if dedup is not None:
+            original, similar = await dedup.check(index, upload)
+            if original is not None:
+                mark_duplicate(result, original, DUPLICATE_IMAGE)
+                return result
+            if similar is not None:
+                # 外观相近只是提示，是否重复由合并时的交易比对决定
+                result["similar_to"] = similar
+        trace = {}
+        ocr_results = await ocr_manager.recognize_text_async(upload.data, engine_name=engine, trace=trace,
+                                                             image_digest=upload.sha256, priority=priority)
+        result["image_stats"] = trace.get("preprocess")
+        result["engine_used"] = trace.get("engine_used")
+        if settings.refine_enabled and ocr_results:
+            # 可疑的文字框裁剪后再识别一次，避免因一行模糊的金额整张重传
+            with stage("refine"):
+                ocr_results = await refine_ocr_results(upload.data, ocr_results, result["engine_used"] or engine,
+                                                        trace, priority)
+            if trace.get("refine"):
+                result["refined_lines"] = trace["refine"]["replaced"]
+        with stage("parse"):
+            result["parsed"] = receipt_parser.parse_receipt_text(ocr_results, fields)
+    except Exception as e:
+        logger.error(f"识别 {upload.filename} 失败: {str(e)}")
+        result["status"] = "error"
+        result["error"] = str(e)
+    return result
+
+
+def engines_used(results: Iterable[Optional[Dict[str, Any]]], requested: str) -> str:
+    """批量结果实际使用的引擎（如 engine=auto 时选中的引擎），多个时按首次出现的顺序以逗号分隔；
+    没有结果调用过引擎（全部失败或重复）时返回请求的引擎"""
+    names = dict.fromkeys(result["engine_used"] for result in results if result and result.get("engine_used"))
+    return ",".join(names) or requested
+
+
+def summarize_result(result: Dict[str, Any], columns: Optional[List[str]] = None,
+                     index: Optional[int] = None) -> Dict[str, Any]:
+    """单张图片结果的对外格式（批量、流式和任务接口共用）
+
+    商品明细不放在 full_data 中重复返回：批量接口通过合并后的 data 返回，
+    传入 index 时（流式/任务进度）附带该图片在支付表格中的行（重复或失败的结果没有行）。
+    """
+    parsed = result.get("parsed")
+    summary = {
+        "file": result["file"],
+        "status": result["status"],
+        "error": result.get("error"),
+        "duplicate_of": result.get("duplicate_of"),
+        "engine_used": result.get("engine_used"),
+        "item_count": len(parsed.get("items", [])) if parsed else 0,
+        "confidence": parsed.get("confidence", 0) if parsed else 0,
+        "refined_lines": result.get("refined_lines", 0),
+        "full_data": filter_columns(parsed, columns) if parsed else None,
+        "image_stats": result.get("image_stats")
+    }
+    if index is not None:
+        summary["index"] = index
+        summary["rows"] = receipt_rows(result, index) if result["status"] == "ok" else []
+    return summary
+
+
+def filter_columns(data: Dict[str, Any], columns: Optional[List[str]]) -> Dict[str, Any]:
+    """根据用户选择的列过滤数据（商品明细单独返回，不在此重复）"""
+    fields = resolve_fields(columns)
+    return {key: value for key, value in data.items() if key in fields and key != "items"}
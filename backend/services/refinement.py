@@ -0,0 +1,233 @@
+# 二次识别：只把置信度低或金额/日期格式异常的文字框裁剪放大后再识别一次，不重新识别整张图片
+from typing import List, Dict, Any, Optional, Tuple
+import asyncio
+import bisect
+import io
+import logging
+import re
+
+from PIL import Image, ImageOps
+
+from core.config import settings
+from core.metrics import registry, Counter
+from services.image_preprocessor import image_preprocessor
+from services.ocr import ocr_manager, get_ocr_executor, PRIORITY_INTERACTIVE
+
+logger = logging.getLogger(__name__)
+
+REFINE_REGIONS = registry.register(Counter(
+    "gootool_ocr_refine_regions_total", "二次识别的文字框数（replaced 已替换 / kept 保留原文字 / failed 识别失败）",
+    ("result",)))
+
+# 选中原因
+REASON_LOW_CONFIDENCE = "low_confidence"
+REASON_AMOUNT = "amount"
+REASON_DATE = "date"
+REASON_TIME = "time"
+
+# 裁剪时向四周扩展的边距（相对框高），以及合成图中区域之间的留白（相对行高）
+CROP_PADDING = 0.25
+SLOT_GAP = 0.5
+
+# 只有带货币符号、金额标签，或紧挨着金额标签的文字框才按金额校验（"1.5kg"、"V1.2" 这类普通文字不算）
+_CURRENCY_RE = re.compile(r"[¥￥]|元|RMB", re.IGNORECASE)
+_AMOUNT_LABEL_RE = re.compile(r"合计|总计|总额|金额|应收|应付|实收|实付|小计|单价|售价|价格|total|amount|price|sum",
+                              re.IGNORECASE)
+# 合法金额：整数、一位或两位小数，可带千分位
+_PRICE_RE = re.compile(r"\d{1,3}(?:,\d{3})+(?:\.\d{1,2})?(?![\d.])|\d+(?:\.\d{1,2})?(?![\d.])")
+# 金额中与数字形近、常被误识别的字母（如 0/O、1/l、5/S、8/B）
+_CONFUSABLE_RE = re.compile(r"(?<=[\d.,])[OoDQIl|SsBZz]|[OoDQIl|SsBZz](?=[.,]?\d)")
+_DATE_PARTS_RE = re.compile(r"(\d{4})[-/年](\d{1,2})[-/月](\d{1,2})")
+_TIME_PARTS_RE = re.compile(r"(\d{1,2}):(\d{2})")
+
+
+def is_amount_label(text: str) -> bool:
+    """只有金额标签、没有数字的文字框（如 "实付金额"），金额通常在相邻的文字框中"""
+    return bool(_AMOUNT_LABEL_RE.search(text)) and not any(ch.isdigit() for ch in text)
+
+
+def validation_issue(text: str, amount_context: bool = False) -> Optional[str]:
+    """金额、日期或时间的格式明显有误时返回问题类型，否则返回 None
+
+    amount_context 表示相邻的文字框是金额标签，此时即使本行没有货币符号或标签也按金额校验。
+    """
+    is_amount = amount_context or _CURRENCY_RE.search(text) or _AMOUNT_LABEL_RE.search(text)
+    if is_amount and any(ch.isdigit() for ch in text) and (not _PRICE_RE.search(text) or _CONFUSABLE_RE.search(text)):
+        return REASON_AMOUNT
+    match = _DATE_PARTS_RE.search(text)
+    if match and not (1 <= int(match.group(2)) <= 12 and 1 <= int(match.group(3)) <= 31):
+        return REASON_DATE
+    match = _TIME_PARTS_RE.search(text)
+    if match and not (int(match.group(1)) <= 23 and int(match.group(2)) <= 59):
+        return REASON_TIME
+    return None
+
+
+def _box_extent(bbox: Any) -> Optional[Tuple[float, float, float, float]]:
+    """bbox（四边形8个坐标或 [x1, y1, x2, y2]）的外接矩形，无效时返回 None"""
+    if not bbox or len(bbox) < 4:
+        return None
+    xs, ys = (bbox[0::2], bbox[1::2]) if len(bbox) >= 8 else ((bbox[0], bbox[2]), (bbox[1], bbox[3]))
+    left, top, right, bottom = min(xs), min(ys), max(xs), max(ys)
+    if right <= left or bottom <= top:
+        return None
+    return left, top, right, bottom
+
+
+def select_regions(ocr_results: List[Dict[str, Any]], min_confidence: float,
+                   max_regions: int) -> List[Tuple[int, str]]:
+    """选出需要二次识别的文字框 (序号, 原因)：格式异常的优先，其次按置信度从低到高，最多 max_regions 个
+
+    引擎不返回置信度（全部为0）时只按格式判断。
+    """
+    has_confidence = any(result.get("confidence") for result in ocr_results)
+    labels = [is_amount_label(result["text"]) for result in ocr_results]
+    candidates = []
+    for index, result in enumerate(ocr_results):
+        text = result["text"].strip()
+        if not text or _box_extent(result.get("bbox")) is None:
+            continue
+        confidence = result.get("confidence") or 0.0
+        # 识别结果按阅读顺序排列，同一行的标签和值是相邻的文字框
+        amount_context = (index > 0 and labels[index - 1]) or (index + 1 < len(labels) and labels[index + 1])
+        reason = validation_issue(text, amount_context)
+        if reason is None and has_confidence and confidence < min_confidence:
+            reason = REASON_LOW_CONFIDENCE
+        if reason is not None:
+            candidates.append((reason == REASON_LOW_CONFIDENCE, confidence, index, reason))
+    candidates.sort()
+    return [(index, reason) for _, _, index, reason in candidates[:max_regions]]
+
+
+def build_canvas(image_data: bytes, boxes: List[Any], processed_size: Optional[Tuple[int, int]],
+                 limits: Optional[Dict[str, Any]],
+                 line_height: int) -> Tuple[bytes, List[Tuple[float, float]], Tuple[int, int]]:
+    """从原图裁剪各文字框并放大到 line_height，上下排列合成一张图（一次调用识别所有区域）
+
+    文字框坐标对应送给引擎的预处理后图片，按原图与预处理后尺寸之比换算；
+    返回 PNG 字节、每个区域在合成图中的纵向范围 (top, bottom) 和合成图尺寸。
+    """
+    with Image.open(io.BytesIO(image_data)) as opened:
+        image = ImageOps.exif_transpose(opened) if image_preprocessor.enabled else opened
+        image = image.convert("L")
+    processed_size = processed_size or image_preprocessor.output_size(image.size, limits)
+    scale_x = image.width / processed_size[0]
+    scale_y = image.height / processed_size[1]
+
+    crops = []
+    for bbox in boxes:
+        left, top, right, bottom = _box_extent(bbox)
+        pad = (bottom - top) * CROP_PADDING
+        region = (max(0, int((left - pad) * scale_x)), max(0, int((top - pad) * scale_y)),
+                  min(image.width, int((right + pad) * scale_x) + 1), min(image.height, int((bottom + pad) * scale_y) + 1))
+        crop = image.crop(region)
+        # 只放大不缩小：原图分辨率高于送给引擎的图片时，裁剪本身就提高了清晰度
+        factor = max(1.0, line_height / crop.height)
+        if factor > 1.0:
+            crop = crop.resize((max(1, round(crop.width * factor)), max(1, round(crop.height * factor))), Image.LANCZOS)
+        crops.append(crop)
+
+    gap = max(8, int(line_height * SLOT_GAP))
+    canvas = Image.new("L", (max(crop.width for crop in crops) + 2 * gap,
+                             sum(crop.height for crop in crops) + gap * (len(crops) + 1)), 255)
+    slots = []
+    y = gap
+    for crop in crops:
+        canvas.paste(crop, (gap, y))
+        # 区域的范围向上下各延伸半个留白，落在留白中的文字框归入最近的区域
+        slots.append((y - gap / 2, y + crop.height + gap / 2))
+        y += crop.height + gap
+    buf = io.BytesIO()
+    canvas.save(buf, format="PNG", optimize=True)
+    return buf.getvalue(), slots, canvas.size
+
+
+def scale_slots(slots: List[Tuple[float, float]], canvas_size: Tuple[int, int],
+                processed_size: Tuple[int, int]) -> List[Tuple[float, float]]:
+    """合成图送给引擎前可能被预处理缩小（长边或大小超过限制），把区域范围换算到引擎识别的图片坐标"""
+    scale = processed_size[1] / canvas_size[1]
+    if scale == 1:
+        return slots
+    return [(top * scale, bottom * scale) for top, bottom in slots]
+
+
+def _assign_to_slots(results: List[Dict[str, Any]], slots: List[Tuple[float, float]]) -> List[List[Dict[str, Any]]]:
+    """按纵向中心把二次识别的文字框分配到各区域"""
+    tops = [top for top, _ in slots]
+    assigned: List[List[Dict[str, Any]]] = [[] for _ in slots]
+    for result in results:
+        extent = _box_extent(result.get("bbox"))
+        if extent is None:
+            # 没有位置信息时只能处理单个区域的情况
+            if len(slots) == 1:
+                assigned[0].append(result)
+            continue
+        center = (extent[1] + extent[3]) / 2
+        slot = bisect.bisect_right(tops, center) - 1
+        if 0 <= slot < len(slots) and center < slots[slot][1]:
+            assigned[slot].append(result)
+    return assigned
+
+
+async def refine_ocr_results(image_data: bytes, ocr_results: List[Dict[str, Any]], engine: str,
+                             trace: Optional[Dict[str, Any]] = None,
+                             priority: int = PRIORITY_INTERACTIVE) -> List[Dict[str, Any]]:
+    """对可疑的文字框做二次识别，返回替换后的新列表（不修改传入的列表，它可能来自缓存）
+
+    新文字通过格式校验，且置信度更高（或原文字格式有误、新置信度达到阈值）时才替换；
+    二次识别失败时返回原结果。engine 为首次识别实际使用的引擎，OCR_REFINE_ENGINE 可指定其它引擎。
+    """
+    regions = select_regions(ocr_results, settings.refine_min_confidence, settings.refine_max_regions)
+    if not regions:
+        return ocr_results
+
+    refine_engine = settings.refine_engine or engine
+    processed = (trace or {}).get("preprocess")
+    processed_size = (processed["width"], processed["height"]) if processed else None
+    try:
+        limits = ocr_manager.get_capabilities(engine).limits()
+        loop = asyncio.get_running_loop()
+        canvas, slots, canvas_size = await loop.run_in_executor(
+            get_ocr_executor(), build_canvas, image_data, [ocr_results[index]["bbox"] for index, _ in regions],
+            processed_size, limits, settings.refine_line_height)
+        second_trace: Dict[str, Any] = {}
+        second_pass = await ocr_manager.recognize_text_async(canvas, engine_name=refine_engine, trace=second_trace,
+                                                             priority=priority)
+        # 二次识别的文字框坐标对应预处理后的合成图；缓存命中时没有预处理信息，按预处理规则估算
+        second_processed = second_trace.get("preprocess")
+        if second_processed:
+            slots = scale_slots(slots, canvas_size, (second_processed["width"], second_processed["height"]))
+        else:
+            refine_limits = ocr_manager.get_capabilities(second_trace.get("engine_used", refine_engine)).limits()
+            slots = scale_slots(slots, canvas_size, image_preprocessor.output_size(canvas_size, refine_limits))
+    except Exception as e:
+        logger.warning(f"二次识别失败，保留首次识别结果: {str(e)}")
+        REFINE_REGIONS.inc(len(regions), result="failed")
+        return ocr_results
+
+    has_confidence = any(result.get("confidence") for result in second_pass)
+    refined = list(ocr_results)
+    replaced = 0
+    for (index, reason), found in zip(regions, _assign_to_slots(second_pass, slots)):
+        if not found:
+            continue
+        original = ocr_results[index]
+        found.sort(key=lambda result: (_box_extent(result.get("bbox")) or (0,))[0])
+        text = " ".join(result["text"].strip() for result in found if result["text"].strip())
+        confidence = sum(result.get("confidence") or 0.0 for result in found) / len(found)
+        if not text or validation_issue(text, reason == REASON_AMOUNT) is not None:
+            continue
+        if reason == REASON_LOW_CONFIDENCE:
+            better = confidence > (original.get("confidence") or 0.0)
+        else:
+            # 原文字格式有误：新文字格式正确且置信度达到阈值即可（引擎不返回置信度时只看格式）
+            better = not has_confidence or confidence >= settings.refine_min_confidence
+        if better:
+            refined[index] = {**original, "text": text, "confidence": confidence, "refined": True}
+            replaced += 1
+            logger.debug(f"二次识别替换文字: {original['text']!r} -> {text!r} ({reason})")
+    REFINE_REGIONS.inc(replaced, result="replaced")
+    REFINE_REGIONS.inc(len(regions) - replaced, result="kept")
+    if trace is not None:
+        trace["refine"] = {"regions": len(regions), "replaced": replaced, "engine": refine_engine}
+    return refined
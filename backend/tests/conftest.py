@@ -0,0 +1,5 @@
+# 测试从 backend 目录导入应用模块（与 uvicorn 启动方式一致）
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
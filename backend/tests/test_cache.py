@@ -0,0 +1,108 @@
+# OCR结果缓存的磁盘大小统计
+import os
+import time
+
+from services.ocr.cache import DISK_BYTES_KEY, OCRResultCache
+
+
+class FakeSharedStore:
+    """内存版共享存储（get/set/update）"""
+
+    def __init__(self):
+        self.values = {}
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def set(self, key, value, ttl=None):
+        self.values[key] = value
+
+    def update(self, key, func, ttl=None):
+        self.values[key], result = func(self.values.get(key))
+        return result
+
+
+def disk_total(cache: OCRResultCache) -> int:
+    return sum(size for _, size, _ in cache._scan_disk())
+
+
+def make_key(cache: OCRResultCache, n: int) -> str:
+    return cache.make_key(f"image-{n}".encode(), "baiduocr")
+
+
+def expire(cache: OCRResultCache, key: str):
+    old = time.time() - cache.ttl - 1
+    os.utime(cache._path(key), (old, old))
+
+
+def test_overwrite_counts_size_difference(tmp_path):
+    cache = OCRResultCache(disk_dir=str(tmp_path))
+    key = make_key(cache, 1)
+    for n in range(20):
+        cache.set(key, [{"text": "x" * (n % 5 * 100)}])
+        assert cache.stats()["disk_bytes"] == disk_total(cache)
+
+
+def test_repeated_overwrite_does_not_evict(tmp_path):
+    cache = OCRResultCache(disk_dir=str(tmp_path), max_disk_bytes=1000)
+    key = make_key(cache, 1)
+    for _ in range(50):
+        cache.set(key, [{"text": "x" * 300}])
+    assert cache.evictions == 0
+    assert os.path.exists(cache._path(key))
+
+
+def test_expired_entry_is_subtracted(tmp_path):
+    cache = OCRResultCache(disk_dir=str(tmp_path))
+    keys = [make_key(cache, n) for n in range(3)]
+    for key in keys:
+        cache.set(key, [{"text": key}])
+    expire(cache, keys[0])
+    # 新实例的内存缓存为空，读取会走磁盘
+    reader = OCRResultCache(disk_dir=str(tmp_path))
+    assert reader.get(keys[0]) is None
+    assert not os.path.exists(reader._path(keys[0]))
+    assert reader.stats()["disk_bytes"] == disk_total(reader)
+
+
+def test_corrupt_entry_is_subtracted(tmp_path):
+    cache = OCRResultCache(disk_dir=str(tmp_path))
+    key = make_key(cache, 1)
+    cache.set(key, [{"text": "ok"}])
+    with open(cache._path(key), "w", encoding="utf-8") as f:
+        f.write("{not json")
+    reader = OCRResultCache(disk_dir=str(tmp_path))
+    assert reader.get(key) is None
+    assert reader.stats()["disk_bytes"] == 0
+
+
+def test_eviction_brings_total_under_limit(tmp_path):
+    cache = OCRResultCache(disk_dir=str(tmp_path), max_disk_bytes=2000)
+    for n in range(30):
+        cache.set(make_key(cache, n), [{"text": "x" * 200}])
+    assert cache.evictions > 0
+    assert cache.stats()["disk_bytes"] == disk_total(cache) <= 2000
+
+
+def test_clear_resets_total(tmp_path):
+    cache = OCRResultCache(disk_dir=str(tmp_path))
+    for n in range(5):
+        cache.set(make_key(cache, n), [{"text": "x"}])
+    cache.clear()
+    assert cache.stats()["disk_bytes"] == 0
+    assert disk_total(cache) == 0
+
+
+def test_shared_total_follows_all_processes(tmp_path):
+    shared = FakeSharedStore()
+    first = OCRResultCache(disk_dir=str(tmp_path), shared=shared)
+    second = OCRResultCache(disk_dir=str(tmp_path), shared=shared)
+    key = make_key(first, 1)
+    first.set(key, [{"text": "a" * 100}])
+    second.set(key, [{"text": "b" * 300}])
+    second.set(make_key(second, 2), [{"text": "c"}])
+    assert shared.get(DISK_BYTES_KEY) == disk_total(first)
+    expire(first, key)
+    third = OCRResultCache(disk_dir=str(tmp_path), shared=shared)
+    assert third.get(key) is None
+    assert shared.get(DISK_BYTES_KEY) == disk_total(first)
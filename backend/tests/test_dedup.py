@@ -0,0 +1,98 @@
+# 图片感知哈希与交易指纹去重
+import io
+import random
+
+from PIL import Image, ImageDraw
+
+from services.dedup import HASH_BITS, ImageHashIndex, TransactionIndex, image_dhash
+
+
+def flip(value: int, bits) -> int:
+    for bit in bits:
+        value ^= 1 << bit
+    return value
+
+
+def test_hash_index_matches_within_distance():
+    index = ImageHashIndex(max_distance=3)
+    base = random.Random(1).getrandbits(HASH_BITS)
+    assert index.find_or_add("a", base) is None
+    # 改动分散在各段，仍能通过某一段完全相同找到
+    assert index.find_or_add("b", flip(base, [0, 20, 40])) == "a"
+    assert index.find_or_add("c", flip(base, [0, 20, 40, 60])) is None
+
+
+def test_hash_index_agrees_with_brute_force():
+    rng = random.Random(2)
+    for max_distance in (0, 1, 3, 6):
+        index = ImageHashIndex(max_distance=max_distance)
+        seen = []
+        for n in range(300):
+            if seen and rng.random() < 0.5:
+                value = flip(rng.choice(seen)[0], rng.sample(range(HASH_BITS), rng.randint(0, max_distance + 2)))
+            else:
+                value = rng.getrandbits(HASH_BITS)
+            found = index.find_or_add(n, value)
+            expected = [key for other, key in seen if bin(value ^ other).count("1") <= max_distance]
+            if expected:
+                assert found in expected
+            else:
+                assert found is None
+                seen.append((value, n))
+
+
+def make_image(fmt: str, quality: int = 90) -> bytes:
+    image = Image.new("RGB", (400, 600), "white")
+    draw = ImageDraw.Draw(image)
+    for y in range(0, 600, 40):
+        draw.rectangle((20, y, 20 + y // 2, y + 20), fill="black")
+    buffer = io.BytesIO()
+    image.save(buffer, fmt, quality=quality)
+    return buffer.getvalue()
+
+
+def test_dhash_survives_recompression():
+    original = image_dhash(make_image("PNG"))
+    recompressed = image_dhash(make_image("JPEG", quality=40))
+    assert original is not None
+    assert bin(original ^ recompressed).count("1") <= 3
+
+
+def test_dhash_of_invalid_data_is_none():
+    assert image_dhash(b"not an image") is None
+
+
+def test_receipt_and_payment_screenshot_match():
+    index = TransactionIndex(time_window=600)
+    receipt = {"source": "receipt", "total_amount": 35.5, "transaction_date": "2024-03-01",
+               "transaction_time": "12:30", "store_name": "永辉超市(万达店)"}
+    wechat = {"source": "wechat", "total_amount": 35.50, "transaction_date": "2024/3/1",
+              "transaction_time": "12:34:10", "store_name": "永辉超市"}
+    assert index.find_or_add(0, receipt) is None
+    assert index.find_or_add(1, wechat) == 0
+
+
+def test_same_source_needs_exact_minute():
+    index = TransactionIndex(time_window=600)
+    first = {"source": "receipt", "total_amount": 12.0, "transaction_date": "2024-03-01",
+             "transaction_time": "08:00", "store_name": "便利店"}
+    assert index.find_or_add(0, first) is None
+    assert index.find_or_add(1, dict(first, transaction_time="08:05")) is None
+    assert index.find_or_add(2, dict(first)) == 0
+
+
+def test_different_amount_or_transaction_id_is_not_duplicate():
+    index = TransactionIndex(time_window=600)
+    payment = {"source": "alipay", "total_amount": 20.0, "transaction_date": "2024-03-01",
+               "transaction_time": "09:00", "transaction_id": "A1"}
+    assert index.find_or_add(0, payment) is None
+    assert index.find_or_add(1, dict(payment, total_amount=21.0)) is None
+    assert index.find_or_add(2, dict(payment, transaction_id="A2")) is None
+    assert index.find_or_add(3, dict(payment, source="wechat")) == 0
+
+
+def test_missing_date_and_time_is_never_duplicate():
+    index = TransactionIndex(time_window=600)
+    undated = {"source": "receipt", "total_amount": 5.0}
+    assert index.find_or_add(0, undated) is None
+    assert index.find_or_add(1, dict(undated)) is None
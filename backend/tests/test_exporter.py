@@ -0,0 +1,34 @@
+# 表格导出的公式注入防护
+import csv
+import io
+
+import pytest
+
+from services.exporter import CSVStreamWriter, _csv_cell
+
+
+@pytest.mark.parametrize("text", ["=SUM(A1:A2)", "+1", "-1+2", "@cmd", "\tx", "\rx"])
+def test_formula_prefix_is_escaped(text):
+    assert _csv_cell(text) == "'" + text
+
+
+@pytest.mark.parametrize("value", ["永辉超市", "12.50", "", 12.5, -3.0, 0])
+def test_plain_values_are_unchanged(value):
+    assert _csv_cell(value) == value
+
+
+def test_none_becomes_empty():
+    assert _csv_cell(None) == ""
+
+
+def test_stream_writer_output():
+    writer = CSVStreamWriter()
+    writer.write_row(["商户", "金额"])
+    writer.write_row(["=HYPERLINK(\"x\")", -8.5])
+    first = writer.drain()
+    assert first.startswith("﻿".encode("utf-8"))
+    writer.write_row([None, 1])
+    second = writer.drain()
+    rows = list(csv.reader(io.StringIO((first + second).decode("utf-8-sig"))))
+    assert rows == [["商户", "金额"], ["'=HYPERLINK(\"x\")", "-8.5"], ["", "1"]]
+    assert writer.pending_bytes == 0
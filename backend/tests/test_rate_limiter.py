@@ -0,0 +1,158 @@
+# 令牌桶调度器与每日额度
+import asyncio
+
+import pytest
+
+from services.ocr.rate_limiter import QuotaTracker, QuotaExceededError, RequestScheduler, SchedulerQueueFullError
+from services.ocr.base_ocr import PRIORITY_BATCH, PRIORITY_INTERACTIVE
+
+
+class FakeSharedState:
+    """内存版共享存储：run_async 会让出事件循环，on_take 在调度协程取到令牌后调用一次"""
+
+    def __init__(self):
+        self.values = {}
+        self.scheduler = None
+        self.on_take = None
+
+    def update(self, key, func, ttl=None):
+        self.values[key], result = func(self.values.get(key))
+        return result
+
+    async def run_async(self, func, *args, **kwargs):
+        await asyncio.sleep(0.005)
+        result = func(*args, **kwargs)
+        granted = result[0]
+        if granted and self.on_take and self.scheduler and asyncio.current_task() is self.scheduler._dispatcher:
+            callback, self.on_take = self.on_take, None
+            callback()
+            # 让取消/超时在调度协程恢复之前完成
+            await asyncio.sleep(0.005)
+        return result
+
+
+def test_acquire_within_burst_does_not_wait():
+    async def run():
+        scheduler = RequestScheduler(qps=1, burst=3)
+        for _ in range(3):
+            await asyncio.wait_for(scheduler.acquire(), 0.1)
+    asyncio.run(run())
+
+
+def test_zero_qps_disables_limit():
+    async def run():
+        scheduler = RequestScheduler(qps=0)
+        for _ in range(100):
+            await scheduler.acquire()
+    asyncio.run(run())
+
+
+def test_queue_full_rejects():
+    async def run():
+        scheduler = RequestScheduler(qps=1, burst=1, max_queue=1)
+        await scheduler.acquire()
+        waiter = asyncio.ensure_future(scheduler.acquire())
+        await asyncio.sleep(0)
+        with pytest.raises(SchedulerQueueFullError):
+            await scheduler.acquire()
+        waiter.cancel()
+    asyncio.run(run())
+
+
+def test_higher_priority_waiter_goes_first():
+    async def run():
+        scheduler = RequestScheduler(qps=50, burst=1)
+        await scheduler.acquire()
+        order = []
+
+        async def request(name, priority):
+            await scheduler.acquire(priority)
+            order.append(name)
+
+        batch = asyncio.ensure_future(request("batch", PRIORITY_BATCH))
+        await asyncio.sleep(0)
+        interactive = asyncio.ensure_future(request("interactive", PRIORITY_INTERACTIVE))
+        await asyncio.wait_for(asyncio.gather(batch, interactive), 1)
+        assert order == ["interactive", "batch"]
+    asyncio.run(run())
+
+
+def test_timed_out_waiter_does_not_block_queue():
+    async def run():
+        scheduler = RequestScheduler(qps=20, burst=1, queue_timeout=0.01)
+        await scheduler.acquire()
+        with pytest.raises(SchedulerQueueFullError):
+            await scheduler.acquire()
+        scheduler.queue_timeout = 1.0
+        await asyncio.wait_for(scheduler.acquire(), 0.5)
+        assert scheduler.queue_depth() == 0
+    asyncio.run(run())
+
+
+def test_cancelled_waiter_does_not_block_queue():
+    async def run():
+        scheduler = RequestScheduler(qps=20, burst=1)
+        await scheduler.acquire()
+        cancelled = asyncio.ensure_future(scheduler.acquire())
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        await asyncio.wait_for(scheduler.acquire(), 0.5)
+    asyncio.run(run())
+
+
+def test_waiter_cancelled_while_dispatcher_takes_shared_token():
+    async def run():
+        shared = FakeSharedState()
+        scheduler = RequestScheduler(qps=20, burst=1, shared=shared)
+        shared.scheduler = scheduler
+        await scheduler.acquire()
+        first = asyncio.ensure_future(scheduler.acquire(PRIORITY_INTERACTIVE))
+        await asyncio.sleep(0.02)
+        second = asyncio.ensure_future(scheduler.acquire(PRIORITY_BATCH))
+        await asyncio.sleep(0)
+        # 调度协程为队首的 first 取到令牌时它已被取消，令牌应交给 second
+        shared.on_take = first.cancel
+        await asyncio.wait_for(second, 1)
+        assert first.cancelled()
+        assert not scheduler._dispatcher.done() or scheduler._dispatcher.exception() is None
+    asyncio.run(run())
+
+
+def test_unused_token_returns_to_bucket():
+    async def run():
+        shared = FakeSharedState()
+        scheduler = RequestScheduler(qps=20, burst=1, shared=shared)
+        shared.scheduler = scheduler
+        await scheduler.acquire()
+        only = asyncio.ensure_future(scheduler.acquire())
+        await asyncio.sleep(0)
+        shared.on_take = only.cancel
+        await asyncio.sleep(0.2)
+        assert only.cancelled()
+        assert scheduler._dispatcher.exception() is None
+        assert scheduler._leased == 1
+    asyncio.run(run())
+
+
+def test_quota_reserve_and_refund():
+    quota = QuotaTracker(daily_limit=3, reserve_ratio=0.34)
+    quota.consume(PRIORITY_BATCH)
+    quota.consume(PRIORITY_BATCH)
+    # 剩余1次保留给交互请求
+    with pytest.raises(QuotaExceededError):
+        quota.consume(PRIORITY_BATCH)
+    quota.consume(PRIORITY_INTERACTIVE)
+    with pytest.raises(QuotaExceededError):
+        quota.consume(PRIORITY_INTERACTIVE)
+    quota.refund()
+    quota.consume(PRIORITY_INTERACTIVE)
+    assert quota.remaining() == 0
+
+
+def test_quota_exhausted_rejects_until_next_day():
+    quota = QuotaTracker(daily_limit=0)
+    quota.consume()
+    quota.mark_exhausted()
+    with pytest.raises(QuotaExceededError):
+        quota.consume()
+    assert quota.snapshot()["exhausted"]
@@ -0,0 +1,169 @@
+# 熔断器状态切换与路由层的重试、对冲、故障转移
+import asyncio
+
+import pytest
+
+from services.ocr import routing
+from services.ocr.base_ocr import OCREngineError, TransientOCRError
+from services.ocr.routing import (CIRCUIT_CLOSED, CIRCUIT_HALF_OPEN, CIRCUIT_OPEN, CircuitBreaker,
+                                  CircuitOpenError, EngineRouter, RoutingPolicy)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """可手动推进的单调时钟（只用于同步测试，事件循环也依赖 time.monotonic）"""
+    now = [1000.0]
+    monkeypatch.setattr(routing.time, "monotonic", lambda: now[0])
+    return now
+
+
+def open_breaker(threshold=2, reset=30.0) -> CircuitBreaker:
+    breaker = CircuitBreaker(failure_threshold=threshold, reset_timeout=reset)
+    for _ in range(threshold):
+        assert breaker.allow_request()
+        breaker.record_failure()
+    return breaker
+
+
+def test_breaker_opens_at_threshold(clock):
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=30.0)
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == CIRCUIT_CLOSED and breaker.allow_request()
+    breaker.record_failure()
+    assert breaker.state == CIRCUIT_OPEN
+    assert not breaker.allow_request()
+    assert not breaker.is_available()
+
+
+def test_success_resets_failure_count(clock):
+    breaker = CircuitBreaker(failure_threshold=2)
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == CIRCUIT_CLOSED
+
+
+def test_half_open_allows_single_trial(clock):
+    breaker = open_breaker()
+    clock[0] += 29.9
+    assert not breaker.allow_request()
+    clock[0] += 0.1
+    assert breaker.is_available()
+    assert breaker.allow_request()
+    assert breaker.state == CIRCUIT_HALF_OPEN
+    assert not breaker.allow_request()
+    assert not breaker.is_available()
+
+
+def test_half_open_success_closes(clock):
+    breaker = open_breaker()
+    clock[0] += 30
+    assert breaker.allow_request()
+    breaker.record_success()
+    assert breaker.snapshot() == {"state": CIRCUIT_CLOSED, "failures": 0}
+    assert breaker.allow_request() and breaker.allow_request()
+
+
+def test_half_open_failure_reopens(clock):
+    breaker = open_breaker(threshold=5)
+    clock[0] += 30
+    assert breaker.allow_request()
+    breaker.record_failure()
+    assert breaker.state == CIRCUIT_OPEN
+    assert not breaker.allow_request()
+    clock[0] += 30
+    assert breaker.allow_request()
+
+
+def test_release_trial_keeps_half_open(clock):
+    breaker = open_breaker()
+    clock[0] += 30
+    assert breaker.allow_request()
+    breaker.release_trial()
+    assert breaker.state == CIRCUIT_HALF_OPEN
+    assert breaker.allow_request()
+
+
+def make_router(**kwargs) -> EngineRouter:
+    kwargs.setdefault("backoff_base", 0.0)
+    return EngineRouter(RoutingPolicy(**kwargs))
+
+
+def test_transient_error_is_retried():
+    calls = []
+
+    async def attempt(name):
+        calls.append(name)
+        if len(calls) < 3:
+            raise TransientOCRError("timeout")
+        return [{"text": "ok"}]
+
+    router = make_router(max_retries=2, breaker_threshold=5)
+    assert asyncio.run(router.run(["a"], attempt)) == ("a", [{"text": "ok"}])
+    assert calls == ["a", "a", "a"]
+    assert router.breaker("a").state == CIRCUIT_CLOSED
+
+
+def test_permanent_error_is_not_retried_and_not_counted():
+    calls = []
+
+    async def attempt(name):
+        calls.append(name)
+        raise OCREngineError("unsupported image")
+
+    router = make_router(max_retries=2, breaker_threshold=1)
+    with pytest.raises(OCREngineError):
+        asyncio.run(router.run(["a"], attempt))
+    assert calls == ["a"]
+    assert router.breaker("a").state == CIRCUIT_CLOSED
+
+
+def test_failover_to_next_engine():
+    async def attempt(name):
+        if name == "a":
+            raise TransientOCRError("down")
+        return [{"text": name}]
+
+    router = make_router(max_retries=0, breaker_threshold=1)
+    assert asyncio.run(router.run(["a", "b"], attempt)) == ("b", [{"text": "b"}])
+    assert router.breaker("a").state == CIRCUIT_OPEN
+
+
+def test_all_engines_open_raises():
+    router = make_router(breaker_threshold=1)
+    router.breaker("a").record_failure()
+
+    async def attempt(name):
+        return []
+
+    with pytest.raises(CircuitOpenError):
+        asyncio.run(router.run(["a"], attempt))
+
+
+def test_hedge_loser_is_cancelled_and_releases_trial():
+    cancelled = []
+
+    async def attempt(name):
+        if name == "slow":
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.append(name)
+                raise
+        return [{"text": name}]
+
+    router = make_router(hedge_after=0.01, breaker_threshold=1, breaker_reset=0.0)
+    # 慢引擎处于半开状态：被取消的试探请求必须归还名额
+    router.breaker("slow").record_failure()
+
+    async def run():
+        result = await router.run(["slow", "fast"], attempt)
+        await asyncio.sleep(0)
+        return result
+
+    assert asyncio.run(run()) == ("fast", [{"text": "fast"}])
+    assert cancelled == ["slow"]
+    breaker = router.breaker("slow")
+    assert breaker.state == CIRCUIT_HALF_OPEN
+    assert breaker.allow_request()
@@ -0,0 +1,108 @@
+# 通用工具函数
+from typing import Dict, Iterator, AsyncIterator, Optional
+from urllib.parse import quote, urlencode
+import base64
+import hashlib
+import io
+
+from utils.validators import detect_image_type, IMAGE_HEADER_SIZE
+
+
+class UploadRejected(Exception):
+    """上传的文件不符合要求（过大或不是图片）"""
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+class UploadedImage:
+    """分块读取后的上传图片"""
+    def __init__(self, filename: Optional[str], data: bytes, mime: str, sha256: str):
+        self.filename = filename
+        self.data = data
+        self.mime = mime
+        self.sha256 = sha256
+
+    @property
+    def size(self) -> int:
+        return len(self.data)
+
+
+async def read_upload(file, max_bytes: int, chunk_size: int = 64 * 1024) -> UploadedImage:
+    """分块读取上传文件：超过大小上限立即拒绝，按文件头校验图片类型，并在读取过程中计算哈希"""
+    # 客户端声明了大小时，不读取内容直接拒绝
+    declared_size = getattr(file, "size", None)
+    if declared_size is not None and declared_size > max_bytes:
+        raise UploadRejected(413, f"图片大小超过上限 {max_bytes // (1024 * 1024)}MB")
+
+    buf = io.BytesIO()
+    digest = hashlib.sha256()
+    mime = None
+    total = 0
+    while True:
+        chunk = await file.read(chunk_size)
+        if not chunk:
+            break
+        total += len(chunk)
+        if total > max_bytes:
+            raise UploadRejected(413, f"图片大小超过上限 {max_bytes // (1024 * 1024)}MB")
+        digest.update(chunk)
+        buf.write(chunk)
+        if mime is None and (total >= IMAGE_HEADER_SIZE):
+            mime = detect_image_type(buf.getbuffer()[:IMAGE_HEADER_SIZE].tobytes())
+            if mime is None:
+                raise UploadRejected(415, "请上传图片文件（支持 JPEG/PNG/BMP/GIF/TIFF/WEBP）")
+
+    if mime is None:
+        raise UploadRejected(415 if total else 400, "请上传图片文件" if total else "上传的文件为空")
+    # BytesIO.getvalue 在没有其它引用时直接返回内部缓冲，不会再复制一份
+    return UploadedImage(getattr(file, "filename", None), buf.getvalue(), mime, digest.hexdigest())
+
+
+class Base64FormBody:
+    """application/x-www-form-urlencoded 请求体，其中一个字段为base64编码的二进制数据。
+
+    base64 只编码一次并缓存（计算 Content-Length 和发送共用），URL转义在发送时按块进行，
+    不生成完整的转义副本。
+    """
+    # 每次发送的base64块大小
+    CHUNK_SIZE = 4 * 16 * 1024
+
+    def __init__(self, field: str, data: bytes, extra_fields: Optional[Dict[str, str]] = None):
+        self._data = data
+        self._prefix = f"{quote(field)}=".encode("ascii")
+        self._suffix = f"&{urlencode(extra_fields)}".encode("utf-8") if extra_fields else b""
+        self._encoded: Optional[bytes] = None
+        self._length: Optional[int] = None
+
+    @staticmethod
+    def _escape(chunk: bytes) -> bytes:
+        # base64 字母表中只有这三个字符需要URL转义
+        return chunk.replace(b"+", b"%2B").replace(b"/", b"%2F").replace(b"=", b"%3D")
+
+    def _base64(self) -> bytes:
+        if self._encoded is None:
+            self._encoded = base64.b64encode(self._data)
+        return self._encoded
+
+    def __iter__(self) -> Iterator[bytes]:
+        yield self._prefix
+        encoded = memoryview(self._base64())
+        for i in range(0, len(encoded), self.CHUNK_SIZE):
+            yield self._escape(encoded[i:i + self.CHUNK_SIZE].tobytes())
+        yield self._suffix
+
+    async def aiter_chunks(self) -> AsyncIterator[bytes]:
+        """异步HTTP客户端使用的分块迭代器"""
+        for chunk in self:
+            yield chunk
+
+    def __len__(self) -> int:
+        """请求体总长度，用于设置 Content-Length：base64 长度为 4*ceil(n/3)，每个需转义的字符多占2字节"""
+        if self._length is None:
+            encoded = self._base64()
+            padding = (3 - len(self._data) % 3) % 3
+            escaped = encoded.count(b"+") + encoded.count(b"/") + padding
+            self._length = len(self._prefix) + len(self._suffix) + 4 * -(-len(self._data) // 3) + 2 * escaped
+        return self._length
@@ -0,0 +1,26 @@
+# 输入校验
+from typing import Optional
+
+# 常见图片格式的文件头（magic bytes）
+_IMAGE_SIGNATURES = (
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+    (b"BM", "image/bmp"),
+    (b"II*\x00", "image/tiff"),
+    (b"MM\x00*", "image/tiff"),
+)
+
+# 判断文件类型至少需要的字节数
+IMAGE_HEADER_SIZE = 12
+
+
+def detect_image_type(header: bytes) -> Optional[str]:
+    """根据文件头判断图片类型，返回MIME类型；不是支持的图片时返回 None"""
+    for signature, mime in _IMAGE_SIGNATURES:
+        if header.startswith(signature):
+            return mime
+    if header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+        return "image/webp"
+    return None